@@ -0,0 +1,39 @@
+"""
+Measure bulk resource creation throughput against a local mock CKAN action API for different worker pool sizes.
+
+Usage:
+  python benchmarks/bulk_benchmark.py
+"""
+import time
+
+from support import setup_django
+
+setup_django()
+
+from tethys_datasets.bulk import bulk_create_resources
+from tethys_datasets.models import DatasetService
+from tethys_datasets.tests.mock_server import MockServer, MockCkanApp
+from tethys_datasets.utilities import get_dataset_engine
+
+ITEMS = 200
+LATENCY = 0.01
+WORKERS = (1, 4, 16)
+
+
+def main():
+    with MockServer(MockCkanApp(latency=LATENCY)) as server:
+        DatasetService.objects.create(name='mock', endpoint=server.url + '/api/3/action', apikey='benchmark',
+                                      pool_maxsize=max(WORKERS))
+        get_dataset_engine('mock').create_dataset(name='bulk')
+
+        print('{0:>8} {1:>14} {2:>8}'.format('workers', 'items/s', 'failed'))
+
+        for workers in WORKERS:
+            items = [{'url': 'http://example.com/{0}'.format(i), 'name': 'r{0}'.format(i)} for i in range(ITEMS)]
+            start = time.time()
+            result = bulk_create_resources('mock', 'bulk', items, max_workers=workers)
+            print('{0:>8} {1:>14.0f} {2:>8}'.format(workers, ITEMS / (time.time() - start), len(result.failed)))
+
+
+if __name__ == '__main__':
+    main()
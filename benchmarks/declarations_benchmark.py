@@ -0,0 +1,72 @@
+"""
+Measure how long an app takes to declare many dataset services and how much memory the declarations take.
+
+Apps build their DatasetService and SpatialDatasetService declarations every time dataset_services() and
+spatial_dataset_services() are called.
+
+Usage:
+  python benchmarks/declarations_benchmark.py
+"""
+import tracemalloc
+
+import sys
+
+from support import ROOT, best_of
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from tethys_datasets.base import DatasetService, SpatialDatasetService
+
+SERVICES = 100
+KEPT_CALLS = 100
+
+
+# Arguments of the declarations, built once like the literals in the app.py of an app
+DATASET_SERVICES = [('service-{0}'.format(i), 'ckan' if i % 2 else 'hydroshare',
+                     'http://localhost/{0}/api/3/action'.format(i)) for i in range(SERVICES)]
+SPATIAL_DATASET_SERVICES = [('geoserver-{0}'.format(i), 'geoserver', 'http://localhost/{0}/geoserver/rest/'.format(i))
+                            for i in range(SERVICES // 10)]
+
+
+class ManyServicesApp(object):
+    """
+    App that declares SERVICES dataset services and a tenth as many spatial dataset services.
+    """
+
+    def dataset_services(self):
+        return [DatasetService(name, engine_type, endpoint, apikey='key')
+                for name, engine_type, endpoint in DATASET_SERVICES]
+
+    def spatial_dataset_services(self):
+        return [SpatialDatasetService(name, engine_type, endpoint, username='admin', password='geoserver')
+                for name, engine_type, endpoint in SPATIAL_DATASET_SERVICES]
+
+
+def measure_declarations():
+    """
+    Returns:
+      (dict): Microseconds per dataset_services() call and kilobytes of memory kept per call when the declarations of
+        KEPT_CALLS calls are held at the same time.
+    """
+    app = ManyServicesApp()
+    results = {'dataset_services_us': best_of(app.dataset_services, number=200) * 1e6,
+               'spatial_dataset_services_us': best_of(app.spatial_dataset_services, number=200) * 1e6}
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [app.dataset_services() + app.spatial_dataset_services() for _ in range(KEPT_CALLS)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    results['declarations_kept_kb_per_call'] = (after - before) / 1024.0 / len(kept)
+    return results
+
+
+def main():
+    for name, value in sorted(measure_declarations().items()):
+        print('{0:<32} {1:>10.1f}'.format(name, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Measure how long a fresh process takes to set up Django and import the tethys_datasets modules a worker loads at boot,
+and which heavy dependencies are pulled in on the way.
+
+Usage:
+  python benchmarks/import_benchmark.py
+"""
+import json
+import subprocess
+import sys
+
+from support import ROOT
+
+RUNS = 7
+
+# Modules a worker loads at boot: the app config, URL configuration, views, admin and the public helpers
+BOOT_SCRIPT = '''
+import gc, json, sys, time
+sys.path.insert(0, {root!r})
+start = time.time()
+import django
+from django.conf import settings
+settings.configure(
+    SECRET_KEY='benchmarks',
+    INSTALLED_APPS=['django.contrib.admin', 'django.contrib.contenttypes', 'django.contrib.auth',
+                    'django.contrib.sessions', 'django.contrib.messages', 'tethys_datasets'],
+    DATABASES={{'default': {{'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}}},
+)
+django.setup()
+setup = time.time()
+# Collect the garbage of the Django setup first, or a full collection of it lands in whichever import comes next
+gc.collect()
+gc_start = time.time()
+import tethys_datasets.admin, tethys_datasets.views, tethys_datasets.utilities
+end = time.time()
+heavy = ('requests', 'tethys_apps', 'tethys_dataset_services.engines', 'geoserver')
+print(json.dumps({{
+    'django_ms': (setup - start) * 1000,
+    'tethys_datasets_ms': (end - gc_start) * 1000,
+    'loaded': sorted(name for name in heavy if name in sys.modules),
+}}))
+'''
+
+
+def measure_import_time(runs=RUNS):
+    """
+    Median import times of a fresh interpreter in milliseconds.
+
+    Returns:
+      (dict): 'django_ms' and 'tethys_datasets_ms' and the heavy modules that were 'loaded'.
+    """
+    samples = []
+
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', BOOT_SCRIPT.format(root=ROOT)])
+        samples.append(json.loads(output.decode('utf-8')))
+
+    result = {'loaded': samples[0]['loaded']}
+
+    for key in ('django_ms', 'tethys_datasets_ms'):
+        result[key] = sorted(sample[key] for sample in samples)[len(samples) // 2]
+
+    return result
+
+
+def main():
+    result = measure_import_time()
+    print('django setup:     {0:8.1f} ms'.format(result['django_ms']))
+    print('tethys_datasets:  {0:8.1f} ms'.format(result['tethys_datasets_ms']))
+    print('heavy modules:    {0}'.format(', '.join(result['loaded']) or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Measure CKAN engine requests/sec against a local stand-in server with and without the shared connection pool.
+
+Usage:
+  python benchmarks/pooling_benchmark.py
+"""
+import sys
+import threading
+import time
+
+from support import ROOT
+
+sys.path.insert(0, ROOT)
+
+from tethys_dataset_services.engines import ckan_engine
+from tethys_dataset_services.engines import CkanDatasetEngine
+from tethys_datasets import transport
+from tethys_datasets.tests.mock_server import MockServer
+
+REQUESTS = 1000
+THREADS = (1, 8)
+
+
+def requests_per_second(engine, threads):
+    per_thread = REQUESTS // threads
+
+    def worker():
+        for _ in range(per_thread):
+            engine.list_datasets()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.time()
+
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    return per_thread * threads / (time.time() - start)
+
+
+def main():
+    with MockServer() as server:
+        engine = CkanDatasetEngine(endpoint=server.url + '/api/3/action', apikey='benchmark')
+        unpooled = dict((threads, requests_per_second(engine, threads)) for threads in THREADS)
+
+        transport.install(ckan_engine)
+        transport.get_session_pool().configure(server.url, transport.PoolSettings(maxsize=max(THREADS),
+                                                                                  max_retries=0,
+                                                                                  backoff=0.0))
+        pooled = dict((threads, requests_per_second(engine, threads)) for threads in THREADS)
+
+    print('{0:>8} {1:>16} {2:>16}'.format('threads', 'unpooled (req/s)', 'pooled (req/s)'))
+    for threads in THREADS:
+        print('{0:>8} {1:>16.0f} {2:>16.0f}'.format(threads, unpooled[threads], pooled[threads]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Compare dataset service name resolution strategies as the DatasetService table grows.
+
+Usage:
+  python benchmarks/registry_benchmark.py
+"""
+from support import setup_django, best_of
+
+setup_django()
+
+from tethys_datasets.models import DatasetService
+from tethys_datasets.registry import ServiceRegistry
+
+ROW_COUNTS = (10, 100, 1000, 5000)
+
+
+def scan(name):
+    # Resolution used before the registry: load every row and compare names in Python
+    services = DatasetService.objects.all()
+
+    if services:
+        for service in services:
+            if service.name == name:
+                return service
+
+
+def indexed(name):
+    return DatasetService.objects.filter(name=name).first()
+
+
+def main():
+    print('{0:>8} {1:>14} {2:>14} {3:>14}'.format('rows', 'scan (us)', 'filter (us)', 'registry (us)'))
+    created = 0
+
+    for count in ROW_COUNTS:
+        DatasetService.objects.bulk_create(
+            DatasetService(name='service-{0}'.format(i), endpoint='http://localhost/api/3/action')
+            for i in range(created, count)
+        )
+        created = count
+
+        # The last row is the worst case for the scan
+        name = 'service-{0}'.format(count - 1)
+        registry = ServiceRegistry(DatasetService, ttl=None)
+        registry.load()
+
+        number = max(1, 2000 // count)
+        print('{0:>8} {1:>14.1f} {2:>14.1f} {3:>14.3f}'.format(
+            count,
+            best_of(lambda: scan(name), number=number) * 1e6,
+            best_of(lambda: indexed(name), number=200) * 1e6,
+            best_of(lambda: registry.get(name), number=10000) * 1e6,
+        ))
+
+
+if __name__ == '__main__':
+    main()
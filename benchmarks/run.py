@@ -0,0 +1,198 @@
+"""
+Offline performance benchmark suite for tethys_datasets.
+
+Measures the import time of a fresh worker and runs every other scenario against in-process stand-ins for CKAN and
+GeoServer (see tethys_datasets.tests.mock_server). The results are saved as JSON so runs of different versions can be
+compared.
+
+Usage:
+  python benchmarks/run.py --label 1.0.0
+  python benchmarks/run.py --label next --compare benchmarks/results/1.0.0.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from declarations_benchmark import measure_declarations
+from import_benchmark import measure_import_time
+from support import ROOT, setup_django, best_of
+
+setup_django()
+
+from tethys_datasets import registry, transfers
+from tethys_datasets.cache import get_engine_cache
+from tethys_datasets.models import DatasetService, SpatialDatasetService
+from tethys_datasets.tests.mock_server import MockServer, MockCkanApp, MockGeoServerApp, route_by_prefix
+from tethys_datasets.utilities import get_dataset_engine, get_spatial_dataset_engine
+
+DATASETS = 200
+UPLOAD_SIZE = 32 * 1024 * 1024
+CONCURRENCY_LATENCY = 0.01
+CONCURRENCY_CALLS = 200
+CONCURRENCY_WORKERS = (1, 4, 16)
+
+# Metrics where a larger value is better, all others are timings
+THROUGHPUT_METRICS = ('upload_mb_per_s', 'concurrency_')
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def latency_ms(func, calls=200):
+    samples = []
+
+    for _ in range(calls):
+        start = time.time()
+        func()
+        samples.append((time.time() - start) * 1000)
+
+    return percentile(samples, 0.5), percentile(samples, 0.95)
+
+
+def bench_resolution(results):
+    get_dataset_engine('ckan')
+    results['resolve_warm_us'] = best_of(lambda: get_dataset_engine('ckan'), number=2000) * 1e6
+
+    def cold():
+        get_engine_cache().clear()
+        registry.get_service_registry(DatasetService).clear()
+        get_dataset_engine('ckan')
+
+    results['resolve_cold_us'] = best_of(cold, number=50) * 1e6
+    results['resolve_spatial_warm_us'] = best_of(lambda: get_spatial_dataset_engine('geoserver'), number=2000) * 1e6
+
+
+def bench_catalog_calls(results):
+    engine = get_dataset_engine('ckan')
+
+    for method, func in (
+        ('list_datasets', lambda: engine.list_datasets(limit=50)),
+        ('search_datasets', lambda: engine.search_datasets(query={'version': '1.0'}, rows=50)),
+        ('get_dataset', lambda: engine.get_dataset(dataset_id='dataset-7')),
+        ('list_layers', lambda: get_spatial_dataset_engine('geoserver').list_layers()),
+    ):
+        results['{0}_p50_ms'.format(method)], results['{0}_p95_ms'.format(method)] = latency_ms(func)
+
+
+def bench_upload(results):
+    with tempfile.NamedTemporaryFile(suffix='.bin') as upload:
+        upload.write(os.urandom(1024 * 1024) * (UPLOAD_SIZE // (1024 * 1024)))
+        upload.flush()
+
+        start = time.time()
+        transfers.upload_resource('ckan', 'dataset-0', upload.name)
+        results['upload_mb_per_s'] = UPLOAD_SIZE / (1024.0 * 1024.0) / (time.time() - start)
+
+
+def bench_concurrency(results, app):
+    engine = get_dataset_engine('ckan')
+    app.latency = CONCURRENCY_LATENCY
+
+    try:
+        for workers in CONCURRENCY_WORKERS:
+            executor = ThreadPoolExecutor(max_workers=workers)
+            start = time.time()
+            list(executor.map(lambda i: engine.get_dataset(dataset_id='dataset-{0}'.format(i % DATASETS)),
+                              range(CONCURRENCY_CALLS)))
+            results['concurrency_{0}_calls_per_s'.format(workers)] = CONCURRENCY_CALLS / (time.time() - start)
+            executor.shutdown()
+
+        # Bursts of identical reads, as when many requests ask for the same popular dataset
+        executor = ThreadPoolExecutor(max_workers=max(CONCURRENCY_WORKERS))
+        start = time.time()
+        list(executor.map(lambda i: engine.get_dataset(dataset_id='dataset-0'), range(CONCURRENCY_CALLS)))
+        results['concurrency_identical_calls_per_s'] = CONCURRENCY_CALLS / (time.time() - start)
+        executor.shutdown()
+    finally:
+        app.latency = 0.0
+
+
+def run():
+    results = {'import_tethys_datasets_ms': measure_import_time()['tethys_datasets_ms']}
+    results.update(measure_declarations())
+    ckan = MockCkanApp()
+
+    with MockServer(route_by_prefix({'/api/3/action': ckan, '/geoserver': MockGeoServerApp()})) as server:
+        DatasetService.objects.create(name='ckan', endpoint=server.url + '/api/3/action', apikey='benchmark',
+                                      pool_maxsize=max(CONCURRENCY_WORKERS))
+        SpatialDatasetService.objects.create(name='geoserver', endpoint=server.url + '/geoserver/rest/',
+                                             username='admin', password='geoserver')
+
+        engine = get_dataset_engine('ckan')
+        for i in range(DATASETS):
+            engine.create_dataset(name='dataset-{0}'.format(i), version='1.0' if i % 2 else '2.0')
+
+        bench_resolution(results)
+        bench_catalog_calls(results)
+        bench_upload(results)
+        bench_concurrency(results, ckan)
+
+    return results
+
+
+def default_label():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'local'
+
+
+def compare(results, baseline):
+    print('{0:<32} {1:>12} {2:>12} {3:>9}'.format('metric', 'baseline', 'current', 'change'))
+
+    for metric in sorted(results):
+        current = results[metric]
+        previous = baseline.get(metric)
+
+        if not previous:
+            print('{0:<32} {1:>12} {2:>12.3f} {3:>9}'.format(metric, '-', current, '-'))
+            continue
+
+        change = (current - previous) / previous * 100
+        better = change > 0 if metric.startswith(THROUGHPUT_METRICS) else change < 0
+        print('{0:<32} {1:>12.3f} {2:>12.3f} {3:>+8.1f}% {4}'.format(metric, previous, current, change,
+                                                                      '' if better or abs(change) < 5 else '<-'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--label', default=default_label(), help='Name of the run, used as the file name.')
+    parser.add_argument('--output-dir', default=os.path.join(ROOT, 'benchmarks', 'results'))
+    parser.add_argument('--compare', help='Results file of an earlier run to compare with.')
+    args = parser.parse_args()
+
+    results = run()
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    path = os.path.join(args.output_dir, '{0}.json'.format(args.label))
+
+    with open(path, 'w') as output:
+        json.dump({
+            'label': args.label,
+            'date': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'results': results,
+        }, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline)['results'])
+    else:
+        for metric in sorted(results):
+            print('{0:<32} {1:>12.3f}'.format(metric, results[metric]))
+
+    print('Results saved to {0}'.format(path))
+
+
+if __name__ == '__main__':
+    main()
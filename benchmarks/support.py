@@ -0,0 +1,37 @@
+"""
+Helpers shared by the benchmark scripts in this directory.
+"""
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_django(**extra_settings):
+    """
+    Configure a throwaway Django project with an in-memory SQLite database and the tethys_datasets tables.
+    """
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    options = dict(
+        SECRET_KEY='benchmarks',
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'tethys_datasets'],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    )
+    options.update(extra_settings)
+    settings.configure(**options)
+    django.setup()
+    call_command('migrate', verbosity=0)
+
+
+def best_of(func, number=100, repeat=5):
+    """
+    Best average time of one call to func in seconds.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
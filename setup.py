@@ -9,6 +9,7 @@ os.chdir(os.path.normpath(os.path.join(os.path.abspath(__file__), os.pardir)))
 
 requires = ['django',
             'requests',
+            'requests_toolbelt',
             'tethys_dataset_services']
 
 version = '1.0.0'
@@ -1,12 +1,24 @@
 from django.contrib import admin
-from .models import DatasetService, SpatialDatasetService
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.html import format_html
+from .models import DatasetJob, DatasetService, SpatialDatasetService
+from .tracing import clear_profiles, merged_profile, profile_files
 from django.forms import ModelForm, PasswordInput
 
+try:
+    from django.conf.urls import url
+    from django.core.urlresolvers import reverse
+except ImportError:
+    from django.urls import re_path as url, reverse
+
 
 class DatasetServiceForm(ModelForm):
     class Meta:
         model = DatasetService
-        fields = ('name', 'engine', 'endpoint', 'apikey', 'username', 'password')
+        fields = ('name', 'engine', 'endpoint', 'apikey', 'username', 'password', 'pool_maxsize', 'max_retries',
+                  'retry_backoff', 'cache_ttl', 'mirrors', 'failure_threshold', 'breaker_cooldown', 'index_catalog',
+                  'job_concurrency', 'rate_limit', 'rate_burst', 'max_concurrency', 'profile_rate')
         widgets = {
             'password': PasswordInput(),
         }
@@ -15,27 +27,105 @@ class DatasetServiceForm(ModelForm):
 class SpatialDatasetServiceForm(ModelForm):
     class Meta:
         model = SpatialDatasetService
-        fields = ('name', 'engine', 'endpoint', 'apikey', 'username', 'password')
+        fields = ('name', 'engine', 'endpoint', 'apikey', 'username', 'password', 'pool_maxsize', 'max_retries',
+                  'retry_backoff', 'mirrors', 'failure_threshold', 'breaker_cooldown', 'job_concurrency', 'rate_limit',
+                  'rate_burst', 'max_concurrency', 'profile_rate')
         widgets = {
             'password': PasswordInput(),
         }
 
 
-class DatasetServiceAdmin(admin.ModelAdmin):
+class ProfileAdminMixin(object):
+    """
+    Adds the download of the profiles of a service (see tethys_datasets.tracing) to its admin page.
+    """
+    readonly_fields = ('profile',)
+    actions = ('clear_profiles',)
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = [
+            url(r'^(\d+)/profile/$', self.admin_site.admin_view(self.download_profile),
+                name='{0}_{1}_profile'.format(*info)),
+        ]
+        return urls + super(ProfileAdminMixin, self).get_urls()
+
+    def profile(self, obj):
+        if obj is None or obj.pk is None:
+            return '-'
+
+        files = profile_files(obj)
+
+        if not files:
+            return 'No profiles yet.'
+
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return format_html('<a href="{0}">Download {1}.prof</a> (profiles of {2} process{3})',
+                           reverse('admin:{0}_{1}_profile'.format(*info), args=[obj.pk]), obj.name, len(files),
+                           '' if len(files) == 1 else 'es')
+
+    def download_profile(self, request, object_id):
+        service = get_object_or_404(self.model, pk=object_id)
+
+        if not self.has_change_permission(request, service):
+            raise Http404
+
+        profile = merged_profile(service)
+
+        if profile is None:
+            raise Http404('No profiles of "{0}".'.format(service.name))
+
+        response = HttpResponse(profile, content_type='application/octet-stream')
+        response['Content-Disposition'] = 'attachment; filename="{0}.prof"'.format(service.name)
+        return response
+
+    def clear_profiles(self, request, queryset):
+        for service in queryset:
+            clear_profiles(service)
+
+    clear_profiles.short_description = 'Discard the profiles of the selected services'
+
+
+class DatasetServiceAdmin(ProfileAdminMixin, admin.ModelAdmin):
     """
     Admin model for Web Processing Service Model
     """
     form = DatasetServiceForm
-    fields = ('name', 'engine', 'endpoint', 'apikey', 'username', 'password')
+    fieldsets = (
+        (None, {'fields': ('name', 'engine', 'endpoint', 'apikey', 'username', 'password')}),
+        ('Connection', {'fields': ('pool_maxsize', 'max_retries', 'retry_backoff', 'job_concurrency')}),
+        ('Limits', {'fields': ('rate_limit', 'rate_burst', 'max_concurrency')}),
+        ('Availability', {'fields': ('mirrors', 'failure_threshold', 'breaker_cooldown')}),
+        ('Caching', {'fields': ('cache_ttl', 'index_catalog')}),
+        ('Profiling', {'fields': ('profile_rate', 'profile')}),
+    )
 
 
-class SpatialDatasetServiceAdmin(admin.ModelAdmin):
+class SpatialDatasetServiceAdmin(ProfileAdminMixin, admin.ModelAdmin):
     """
     Admin model for Spatial Dataset Service Model
     """
     form = SpatialDatasetServiceForm
-    fields = ('name', 'engine', 'endpoint', 'apikey', 'username', 'password')
+    fieldsets = (
+        (None, {'fields': ('name', 'engine', 'endpoint', 'apikey', 'username', 'password')}),
+        ('Connection', {'fields': ('pool_maxsize', 'max_retries', 'retry_backoff', 'job_concurrency')}),
+        ('Limits', {'fields': ('rate_limit', 'rate_burst', 'max_concurrency')}),
+        ('Availability', {'fields': ('mirrors', 'failure_threshold', 'breaker_cooldown')}),
+        ('Profiling', {'fields': ('profile_rate', 'profile')}),
+    )
+
+
+class DatasetJobAdmin(admin.ModelAdmin):
+    """
+    Admin model for Dataset Job Model
+    """
+    list_display = ('job_id', 'service_name', 'method', 'status', 'attempts', 'progress', 'total', 'created_at',
+                    'finished_at')
+    list_filter = ('status', 'service_name')
+    readonly_fields = ('job_id', 'service_name', 'spatial', 'method', 'arguments', 'attempts', 'progress', 'total',
+                       'result', 'error', 'worker', 'created_at', 'started_at', 'heartbeat_at', 'finished_at')
 
 
 admin.site.register(DatasetService, DatasetServiceAdmin)
 admin.site.register(SpatialDatasetService, SpatialDatasetServiceAdmin)
+admin.site.register(DatasetJob, DatasetJobAdmin)
@@ -0,0 +1,163 @@
+"""
+Asyncio facade for dataset engines.
+
+Engine calls block on network I/O, so each call is run in a shared thread pool. Calls to different services can then be
+awaited together and take as long as the slowest one rather than the sum of all of them:
+
+    async def load():
+        ckan, hydroshare = await asyncio.gather(aget_dataset_engine('ckan'), aget_dataset_engine('hydroshare'))
+        return await asyncio.gather(ckan.list_datasets(), hydroshare.list_datasets())
+
+Views that are not coroutines can use run_concurrently():
+
+    ckan_datasets, hydroshare_datasets = run_concurrently(AsyncDatasetEngine(ckan).list_datasets(),
+                                                          AsyncDatasetEngine(hydroshare).list_datasets())
+
+Engine lookups may query the database, so they run with sync_to_async in the thread that Django uses for the database
+work of the current request, which looks after its connection.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+
+from .utilities import get_dataset_engine, get_spatial_dataset_engine
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Get the thread pool that runs engine calls, sized by the TETHYS_DATASETS_ASYNC_WORKERS setting.
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'TETHYS_DATASETS_ASYNC_WORKERS', 16),
+                                               thread_name_prefix='tethys_datasets')
+
+    return _executor
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """
+    Run a blocking function in the engine thread pool and wait for its result.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+class AsyncDatasetEngine(object):
+    """
+    Wraps a dataset or spatial dataset engine so that its methods are coroutines.
+    """
+
+    def __init__(self, engine):
+        """
+        Constructor
+
+        Args:
+          engine (DatasetEngine): The engine to wrap.
+        """
+        self.engine = engine
+
+    def __getattr__(self, name):
+        attribute = getattr(self.engine, name)
+
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        async def method(*args, **kwargs):
+            return await run_in_executor(attribute, *args, **kwargs)
+
+        method.__name__ = name
+        return method
+
+    def __repr__(self):
+        return '<AsyncDatasetEngine engine={0!r}>'.format(self.engine)
+
+    async def list_datasets(self, **kwargs):
+        """
+        Coroutine version of the list_datasets engine method.
+        """
+        return await run_in_executor(self.engine.list_datasets, **kwargs)
+
+    async def search_datasets(self, query=None, **kwargs):
+        """
+        Coroutine version of the search_datasets engine method.
+        """
+        return await run_in_executor(self.engine.search_datasets, query=query, **kwargs)
+
+    async def get_dataset(self, dataset_id, **kwargs):
+        """
+        Coroutine version of the get_dataset engine method.
+        """
+        return await run_in_executor(self.engine.get_dataset, dataset_id, **kwargs)
+
+    async def get_resource(self, resource_id, **kwargs):
+        """
+        Coroutine version of the get_resource engine method.
+        """
+        return await run_in_executor(self.engine.get_resource, resource_id, **kwargs)
+
+
+async def aget_dataset_engine(name, app_class=None):
+    """
+    Coroutine version of get_dataset_engine.
+
+    Args:
+      name (string): Name of the dataset engine to retrieve.
+      app_class (class): The app class to include in the search for dataset engines.
+
+    Returns:
+      (AsyncDatasetEngine): The dataset engine wrapped so its methods are coroutines.
+    """
+    engine = await sync_to_async(get_dataset_engine, thread_sensitive=True)(name, app_class)
+    return AsyncDatasetEngine(engine)
+
+
+async def aget_spatial_dataset_engine(name, app_class=None):
+    """
+    Coroutine version of get_spatial_dataset_engine.
+
+    Args:
+      name (string): Name of the spatial dataset engine to retrieve.
+      app_class (class): The app class to include in the search for dataset engines.
+
+    Returns:
+      (AsyncDatasetEngine): The spatial dataset engine wrapped so its methods are coroutines.
+    """
+    engine = await sync_to_async(get_spatial_dataset_engine, thread_sensitive=True)(name, app_class)
+    return AsyncDatasetEngine(engine)
+
+
+def run_concurrently(*awaitables, return_exceptions=False):
+    """
+    Run awaitables concurrently from synchronous code, such as a Django view, and return their results in order. When
+    the calling thread already runs an event loop, the awaitables run in another thread while the caller waits.
+
+    Args:
+      *awaitables: Coroutines to run, e.g. AsyncDatasetEngine(engine).list_datasets().
+      return_exceptions (bool, optional): Return exceptions in the results instead of raising the first one.
+
+    Returns:
+      (list): The results of the awaitables.
+    """
+    async def gather():
+        return await asyncio.gather(*awaitables, return_exceptions=return_exceptions)
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return async_to_sync(gather)()
+
+    # async_to_sync can not be used in the thread of a running event loop. A thread of the engine pool is not used,
+    # since the engine calls of the awaitables could be waiting for it.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(async_to_sync(gather)).result()
@@ -1,6 +1,78 @@
+import logging
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+# Management commands that serve requests
+SERVER_COMMANDS = ('runserver', 'runserver_plus')
+
+
+def serves_requests(argv=None, environ=None):
+    """
+    Whether the process serves requests: it runs under a WSGI or ASGI server, or it is the process of runserver that
+    serves requests rather than the one that reloads it. Other management commands (migrate, shell, ...) do not.
+
+    Args:
+      argv (list, optional): Command line of the process. Defaults to sys.argv.
+      environ (dict, optional): Environment of the process. Defaults to os.environ.
+    """
+    argv = sys.argv if argv is None else argv
+    environ = os.environ if environ is None else environ
+    program = argv[0] if argv else ''
+
+    is_command = os.path.basename(program) in ('manage.py', 'django-admin', 'django-admin.py') or \
+        program.endswith(os.path.join('django', '__main__.py'))
+
+    if not is_command:
+        return True
+
+    if len(argv) < 2 or argv[1] not in SERVER_COMMANDS:
+        return False
+
+    return '--noreload' in argv or environ.get('RUN_MAIN') == 'true'
 
 
 class TethysDatasetsConfig(AppConfig):
     name = 'tethys_datasets'
     verbose_name = 'Tethys Datasets'
+
+    def ready(self):
+        # Connect signal handlers
+        from . import signals
+        from .health import start_health_checker
+
+        # The background threads are only of use to processes that serve requests, not to migrate, shell, ...
+        if not serves_requests():
+            return
+
+        start_health_checker()
+
+        # Optionally run the background jobs in the web processes instead of a separate run_dataset_jobs process
+        if getattr(settings, 'TETHYS_DATASETS_JOBS', {}).get('AUTOSTART', False):
+            from .jobs import start_job_workers
+            start_job_workers()
+
+        # Optionally create the engines in the background so the first requests of a new worker do not pay for it
+        if getattr(settings, 'TETHYS_DATASETS_WARM_UP', False):
+            connect = getattr(settings, 'TETHYS_DATASETS_WARM_UP_CONNECTIONS', False)
+            thread = threading.Thread(target=self.warm_up, args=(connect,), name='tethys_datasets-warm-up')
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def warm_up(connect=False):
+        from django.db import DatabaseError, connection
+        from .utilities import warm_up
+
+        try:
+            warm_up(connect=connect)
+        except DatabaseError:
+            # E.g. the tables do not exist yet because the migrations have not been run
+            log.warning('Could not warm up the dataset engines.', exc_info=True)
+        finally:
+            connection.close()
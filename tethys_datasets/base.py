@@ -1,38 +1,111 @@
+from types import MappingProxyType
+
 from tethys_dataset_services.valid_engines import VALID_ENGINES, VALID_SPATIAL_ENGINES
 
 
-class DatasetService:
+class EngineRegistry(object):
     """
-    Used to define dataset services for apps.
+    Immutable mapping of engine types to the dot-paths of their engine classes, built once per process.
     """
+    __slots__ = ('engines', 'description')
 
-    def __init__(self, name, type, endpoint, apikey=None, username=None, password=None):
+    def __init__(self, engines):
         """
         Constructor
+
+        Args:
+          engines (dict): Engine class dot-paths keyed by engine type.
         """
-        self.name = name
+        engines = MappingProxyType(dict(engines))
+        types = ['"{0}"'.format(engine_type) for engine_type in engines]
 
-        # Validate the types
-        if type in VALID_ENGINES:
-            self.type = type
-            self.engine = VALID_ENGINES[type]
+        if len(types) > 2:
+            description = '{0}, and {1}'.format(', '.join(types[:-1]), types[-1])
         else:
-            if len(VALID_ENGINES) > 2:
-                comma_separated_types = ', '.join('"{0}"'.format(t) for t in VALID_ENGINES.keys()[:-1])
-                last_type = '"{0}"'.format(VALID_ENGINES.keys()[-1])
-                valid_types_string = '{0}, and {1}'.format(comma_separated_types, last_type)
-            elif len(VALID_ENGINES) == 2:
-                valid_types_string = '"{0}" and "{1}"'.format(VALID_ENGINES.keys()[0], VALID_ENGINES.keys()[1])
-            else:
-                valid_types_string = '"{0}"'.format(VALID_ENGINES.keys()[0])
-
-            raise ValueError('The value "{0}" is not a valid for argument "type" of DatasetService. Valid values for '
-                             '"type" argument include {1}.'.format(type, valid_types_string))
-
-        self.endpoint = endpoint
-        self.apikey = apikey
-        self.username = username
-        self.password = password
+            description = ' and '.join(types)
+
+        object.__setattr__(self, 'engines', engines)
+        object.__setattr__(self, 'description', description)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('EngineRegistry is immutable.')
+
+    def __contains__(self, engine_type):
+        return engine_type in self.engines
+
+    def __getitem__(self, engine_type):
+        return self.engines[engine_type]
+
+    def __repr__(self):
+        return '<EngineRegistry: types={0}>'.format(self.description)
+
+
+ENGINES = EngineRegistry(VALID_ENGINES)
+SPATIAL_ENGINES = EngineRegistry(VALID_SPATIAL_ENGINES)
+
+# Most declarations of each class kept for reuse
+MAX_INTERNED = 4096
+
+
+class _ServiceDeclaration(object):
+    """
+    Base class of the immutable dataset service declarations of apps. Declarations with the same arguments are the same
+    object, so apps that declare their services on every call do not allocate new ones.
+    """
+    __slots__ = ('name', 'type', 'engine', 'endpoint', 'apikey', 'username', 'password')
+
+    # Set by subclasses
+    engine_registry = None
+    _interned = None
+
+    def __new__(cls, name, type, endpoint, apikey=None, username=None, password=None):
+        key = (name, type, endpoint, apikey, username, password)
+
+        try:
+            return cls._interned[key]
+        except KeyError:
+            pass
+
+        # Validate the type
+        if type not in cls.engine_registry:
+            raise ValueError('The value "{0}" is not a valid for argument "type" of {1}. Valid values for "type" '
+                             'argument include {2}.'.format(type, cls.__name__, cls.engine_registry.description))
+
+        declaration = super(_ServiceDeclaration, cls).__new__(cls)
+        set_attribute = object.__setattr__
+        set_attribute(declaration, 'name', name)
+        set_attribute(declaration, 'type', type)
+        set_attribute(declaration, 'engine', cls.engine_registry[type])
+        set_attribute(declaration, 'endpoint', endpoint)
+        set_attribute(declaration, 'apikey', apikey)
+        set_attribute(declaration, 'username', username)
+        set_attribute(declaration, 'password', password)
+
+        # Declarations are few and small, but apps that build them from changing values must not grow the table forever
+        if len(cls._interned) >= MAX_INTERNED:
+            cls._interned.clear()
+
+        # Another thread may have interned the same declaration in the meantime, in which case that one is used
+        return cls._interned.setdefault(key, declaration)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{0} declarations are immutable.'.format(self.__class__.__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError('{0} declarations are immutable.'.format(self.__class__.__name__))
+
+    def __reduce__(self):
+        return self.__class__, (self.name, self.type, self.endpoint, self.apikey, self.username, self.password)
+
+
+class DatasetService(_ServiceDeclaration):
+    """
+    Used to define dataset services for apps.
+    """
+    __slots__ = ()
+
+    engine_registry = ENGINES
+    _interned = {}
 
     def __repr__(self):
         """
@@ -41,43 +114,17 @@ class DatasetService:
         return '<DatasetService: type={0}, api_endpoint={1}>'.format(self.type, self.endpoint)
 
 
-class SpatialDatasetService:
+class SpatialDatasetService(_ServiceDeclaration):
     """
     Used to define spatial dataset services for apps.
     """
+    __slots__ = ()
 
-    def __init__(self, name, type, endpoint, apikey=None, username=None, password=None):
-        """
-        Constructor
-        """
-        self.name = name
-
-        # Validate the types
-        if type in VALID_SPATIAL_ENGINES:
-            self.type = type
-            self.engine = VALID_SPATIAL_ENGINES[type]
-        else:
-            if len(VALID_SPATIAL_ENGINES) > 2:
-                comma_separated_types = ', '.join('"{0}"'.format(t) for t in VALID_SPATIAL_ENGINES.keys()[:-1])
-                last_type = '"{0}"'.format(VALID_SPATIAL_ENGINES.keys()[-1])
-                valid_types_string = '{0}, and {1}'.format(comma_separated_types, last_type)
-            elif len(VALID_SPATIAL_ENGINES) == 2:
-                valid_types_string = '"{0}" and "{1}"'.format(VALID_SPATIAL_ENGINES.keys()[0], VALID_SPATIAL_ENGINES.keys()[1])
-            else:
-                valid_types_string = '"{0}"'.format(VALID_SPATIAL_ENGINES.keys()[0])
-
-            raise ValueError('The value "{0}" is not a valid for argument "type" of SpatialDatasetService. Valid values for '
-                             '"type" argument include {1}.'.format(type, valid_types_string))
-
-        self.endpoint = endpoint
-        self.apikey = apikey
-        self.username = username
-        self.password = password
+    engine_registry = SPATIAL_ENGINES
+    _interned = {}
 
     def __repr__(self):
         """
         String representation
         """
         return '<SpatialDatasetService: type={0}, api_endpoint={1}>'.format(self.type, self.endpoint)
-
-
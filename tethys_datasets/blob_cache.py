@@ -0,0 +1,475 @@
+"""
+Disk cache of the files of dataset service resources.
+
+Apps that read the same resource files over and over can open them from local disk instead of downloading them every
+time:
+
+    from tethys_datasets.blob_cache import open_resource
+
+    with open_resource('ckan', resource_id) as data:
+        header = data[:512]
+
+open_resource fetches the resource with get_resource and downloads its file only when the cache has no copy of the
+current version of the resource, which is told by its checksum ('hash') or modification time together with its URL and
+size. Files are stored under the SHA-256 of their content, so resources with the same content share one file. The least
+recently used files are evicted when the cache grows beyond MAX_SIZE bytes.
+
+The cache can be shared by all the worker processes of a site: files are written to a temporary file and renamed into
+place, downloads of the same resource are serialized with a lock file so only one process downloads it, and eviction
+runs under a cache-wide lock file. The size of the cache is kept in a file next to that lock, so the files are only
+walked when the cache grows beyond its size. Files are mapped read-only, so a file evicted while mapped stays readable
+until the map is closed.
+
+The cache is configured in settings.py:
+
+    TETHYS_DATASETS_BLOB_CACHE = {
+        'LOCATION': '/var/cache/tethys_datasets/blobs',
+        'MAX_SIZE': 10 * 1024 ** 3,
+    }
+"""
+import errno
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+log = logging.getLogger(__name__)
+
+# Resource fields that tell a version of the file of a resource, in order of preference
+VERSION_FIELDS = ('hash', 'last_modified', 'metadata_modified')
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def resource_version(resource):
+    """
+    Describe the version of the file of a resource.
+
+    Args:
+      resource (dict): The resource, as returned by get_resource.
+
+    Returns:
+      (string): The URL and size of the resource and the first of its VERSION_FIELDS that is set.
+    """
+    version = ''
+
+    for field in VERSION_FIELDS:
+        if resource.get(field):
+            version = u'{0}:{1}'.format(field, resource[field])
+            break
+
+    return u'{0}\n{1}\n{2}'.format(resource.get('url') or '', resource.get('size') or '', version)
+
+
+def file_digest(path):
+    """
+    Get the hex SHA-256 digest of the content of a file.
+    """
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on a lock file, shared by all processes on the host.
+    """
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def map_file(path):
+    """
+    Map a file into memory read-only.
+
+    Returns:
+      (mmap.mmap): The read-only map. Empty files can not be mapped and give an empty memoryview instead.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b'')
+
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class BlobCache(object):
+    """
+    Content-addressed files on local disk, with references from the versions of resources to their files.
+    """
+
+    def __init__(self, location, max_size=10 * 1024 ** 3):
+        """
+        Constructor
+
+        Args:
+          location (string): Directory of the cache.
+          max_size (int): Size in bytes beyond which the least recently used files are evicted.
+        """
+        self.location = location
+        self.max_size = max_size
+        self._local_locks = {}
+        self._local_locks_lock = threading.Lock()
+
+        for directory in ('blobs', 'refs', 'locks', 'tmp'):
+            try:
+                os.makedirs(os.path.join(location, directory))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    @staticmethod
+    def key(service_name, resource_id, version):
+        """
+        Key of the reference of a version of a resource.
+        """
+        value = u'\0'.join((service_name, resource_id, version))
+        return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+    def blob_path(self, digest):
+        return os.path.join(self.location, 'blobs', digest[:2], digest)
+
+    def _ref_path(self, key):
+        return os.path.join(self.location, 'refs', key[:2], key)
+
+    def _size_path(self):
+        return os.path.join(self.location, 'locks', 'evict.size')
+
+    def _read_size(self):
+        # Only read and written under the evict lock
+        try:
+            with open(self._size_path(), 'rb') as f:
+                return int(f.read().decode('ascii'))
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError:
+            pass
+
+        # Unknown, e.g. a cache made by an earlier version: the files are walked to find it
+        return None
+
+    def _write_size(self, size):
+        self._write_atomic(self._size_path(), str(size).encode('ascii'))
+
+    @contextmanager
+    def _lock(self, name):
+        # flock locks belong to the open file, so threads of the same process need a lock of their own as well
+        with self._local_locks_lock:
+            local_lock = self._local_locks.setdefault(name, threading.Lock())
+
+        with local_lock:
+            with file_lock(os.path.join(self.location, 'locks', name + '.lock')):
+                yield
+
+    def _write_atomic(self, path, data):
+        self._makedirs(os.path.dirname(path))
+        temp_path = self.temp_path()
+
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+
+        os.rename(temp_path, path)
+
+    @staticmethod
+    def _makedirs(directory):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def get(self, key):
+        """
+        Get the file of a reference and mark it as recently used.
+
+        Returns:
+          (string): Path of the file, None if there is no such reference or its file was evicted.
+        """
+        try:
+            with open(self._ref_path(key), 'rb') as f:
+                path = self.blob_path(f.read().decode('ascii').strip())
+
+            # The modification time orders the files for eviction, in every process
+            os.utime(path, None)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+            return None
+
+        return path
+
+    def put(self, key, path):
+        """
+        Move a file into the cache and reference it by key.
+
+        Args:
+          key (string): Key of the reference.
+          path (string): The file, which is moved into the cache. Must be on the same file system as the cache, e.g. a
+            file made with temp_path.
+
+        Returns:
+          (string): Path of the cached file.
+        """
+        digest = file_digest(path)
+        blob_path = self.blob_path(digest)
+
+        with self._lock('evict'):
+            size = self._read_size()
+            self._makedirs(os.path.dirname(blob_path))
+
+            if os.path.exists(blob_path):
+                # Same content as another resource, or another version of the same resource
+                os.remove(path)
+                os.utime(blob_path, None)
+            else:
+                os.rename(path, blob_path)
+
+                if size is not None:
+                    size += os.stat(blob_path).st_size
+
+            self._write_atomic(self._ref_path(key), digest.encode('ascii'))
+
+            if size is None or size > self.max_size:
+                self._evict(keep=blob_path)
+            else:
+                self._write_size(size)
+
+        return blob_path
+
+    def temp_path(self):
+        """
+        Get the path of a new temporary file in the cache directory.
+        """
+        return os.path.join(self.location, 'tmp', uuid.uuid4().hex)
+
+    def fetch(self, key, download):
+        """
+        Get the file of a reference, downloading it if it is not cached. Processes that miss the same key at the same
+        time wait for the one that downloads it.
+
+        Args:
+          key (string): Key of the reference.
+          download (callable): Called with the path to download the file to.
+
+        Returns:
+          (string): Path of the cached file.
+        """
+        path = self.get(key)
+
+        if path is not None:
+            return path
+
+        with self._lock(key):
+            path = self.get(key)
+
+            if path is not None:
+                return path
+
+            temp_path = self.temp_path()
+
+            try:
+                download(temp_path)
+                return self.put(key, temp_path)
+            finally:
+                # Left behind by failed downloads, including the partial file of tethys_datasets.transfers
+                for leftover in (temp_path, temp_path + '.part'):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+
+    def _evict(self, keep=None):
+        blobs = []
+        size = 0
+
+        for directory, _, names in os.walk(os.path.join(self.location, 'blobs')):
+            for name in names:
+                path = os.path.join(directory, name)
+
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                blobs.append((stat.st_mtime, stat.st_size, path))
+                size += stat.st_size
+
+        blobs.sort()
+        evicted = False
+
+        for _, blob_size, path in blobs:
+            if size <= self.max_size:
+                break
+
+            if path == keep:
+                continue
+
+            try:
+                # Maps of the file stay valid
+                os.remove(path)
+                size -= blob_size
+                evicted = True
+            except OSError:
+                log.warning('Could not evict %s from the blob cache.', path, exc_info=True)
+
+        if evicted:
+            self._prune_refs()
+
+        self._write_size(size)
+        return size
+
+    def _prune_refs(self):
+        # Remove the references to evicted files
+        for directory, _, names in os.walk(os.path.join(self.location, 'refs')):
+            for name in names:
+                path = os.path.join(directory, name)
+
+                try:
+                    with open(path, 'rb') as f:
+                        blob_path = self.blob_path(f.read().decode('ascii').strip())
+
+                    if not os.path.exists(blob_path):
+                        os.remove(path)
+                except (IOError, OSError):
+                    log.warning('Could not prune %s from the blob cache.', path, exc_info=True)
+
+    def evict(self):
+        """
+        Evict the least recently used files until the cache is within its size. The files are walked, so files removed
+        by hand are accounted for.
+
+        Returns:
+          (int): Size of the remaining files in bytes.
+        """
+        with self._lock('evict'):
+            return self._evict()
+
+    def clear(self):
+        """
+        Remove all files and references.
+        """
+        with self._lock('evict'):
+            for directory in ('blobs', 'refs'):
+                shutil.rmtree(os.path.join(self.location, directory), ignore_errors=True)
+                self._makedirs(os.path.join(self.location, directory))
+
+            self._write_size(0)
+
+    def open(self, key, download):
+        """
+        Map the file of a reference into memory read-only, downloading it if it is not cached.
+
+        Returns:
+          (mmap.mmap): The read-only map (see map_file).
+        """
+        path = self.fetch(key, download)
+
+        try:
+            return map_file(path)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        # Evicted by another process between fetching and opening
+        return map_file(self.fetch(key, download))
+
+
+_blob_cache = None
+_blob_cache_lock = threading.Lock()
+
+
+def get_blob_cache():
+    """
+    Get the process-wide blob cache configured with the TETHYS_DATASETS_BLOB_CACHE setting.
+
+    Returns:
+      (BlobCache): The blob cache, in the temporary directory unless a LOCATION is given.
+    """
+    global _blob_cache
+
+    if _blob_cache is None:
+        with _blob_cache_lock:
+            if _blob_cache is None:
+                options = getattr(settings, 'TETHYS_DATASETS_BLOB_CACHE', {})
+                location = options.get('LOCATION') or os.path.join(tempfile.gettempdir(), 'tethys_datasets_blobs')
+                _blob_cache = BlobCache(location, max_size=options.get('MAX_SIZE', 10 * 1024 ** 3))
+
+    return _blob_cache
+
+
+def _resource_download(service_name, resource_id, app_class=None):
+    # Imported here because the transfers module pulls in requests
+    from .pagination import get_result
+    from .transfers import download_resource_file
+    from .utilities import get_dataset_engine
+
+    engine = get_dataset_engine(service_name, app_class)
+    resource = get_result(engine.get_resource(resource_id), 'get_resource')
+    key = BlobCache.key(service_name, resource_id, resource_version(resource))
+
+    def download(path):
+        download_resource_file(engine, resource, path)
+
+    return key, download
+
+
+def cached_resource_path(service_name, resource_id, app_class=None):
+    """
+    Get the path of the cached file of a resource, downloading it if the current version is not cached. The file must
+    not be changed and can be evicted at any time, so use open_resource to read it safely.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      resource_id (string): Id of the resource.
+      app_class (TethysAppBase, optional): App that declares the dataset service.
+
+    Returns:
+      (string): Path of the cached file.
+    """
+    return get_blob_cache().fetch(*_resource_download(service_name, resource_id, app_class))
+
+
+def open_resource(service_name, resource_id, app_class=None):
+    """
+    Map the cached file of a resource into memory read-only, downloading it if the current version is not cached.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      resource_id (string): Id of the resource.
+      app_class (TethysAppBase, optional): App that declares the dataset service.
+
+    Returns:
+      (mmap.mmap): The read-only map, which supports slicing, find and the with statement. Close it when done.
+    """
+    return get_blob_cache().open(*_resource_download(service_name, resource_id, app_class))
@@ -0,0 +1,230 @@
+"""
+Bulk dataset and resource operations.
+
+Each item is sent as its own engine call, but the calls run on a bounded thread pool instead of one after another.
+Updates and deletions that fail with an exception or without a parseable response are retried. Creations are only
+retried when the connection to the service could not be made, since a create request that reached the service may
+have created the object even if its response was lost. The outcome of every item is reported so one bad item does not
+hide the others.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .utilities import get_dataset_engine
+
+try:
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+except ImportError:
+    from requests.packages.urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+
+class BulkItemResult(object):
+    """
+    Outcome of one item of a bulk operation.
+    """
+
+    def __init__(self, index, item, response=None, error=None, attempts=0):
+        """
+        Constructor
+
+        Args:
+          index (int): Position of the item in the list given to the bulk operation.
+          item: The item.
+          response (dict, optional): Response dictionary of the last attempt.
+          error (Exception, optional): Exception raised by the last attempt.
+          attempts (int, optional): Number of attempts made.
+        """
+        self.index = index
+        self.item = item
+        self.response = response
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def succeeded(self):
+        return self.error is None and bool(self.response) and bool(self.response.get('success'))
+
+    def __repr__(self):
+        return '<BulkItemResult: index={0}, succeeded={1}, attempts={2}>'.format(self.index, self.succeeded,
+                                                                                self.attempts)
+
+
+class BulkResult(object):
+    """
+    Outcome of a bulk operation, with one BulkItemResult per item in the order the items were given.
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def succeeded(self):
+        return [item for item in self.items if item.succeeded]
+
+    @property
+    def failed(self):
+        return [item for item in self.items if not item.succeeded]
+
+    def __repr__(self):
+        return '<BulkResult: succeeded={0}, failed={1}>'.format(len(self.succeeded), len(self.failed))
+
+
+def is_connection_error(error):
+    """
+    Whether an exception means that a request never reached the service, because the connection could not be made.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+
+    if isinstance(error, requests.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', error.args[0])
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+    return False
+
+
+def run_bulk(function, items, max_workers=4, max_attempts=3, backoff=0.5, idempotent=False):
+    """
+    Call function for every item on a thread pool.
+
+    An attempt is retried when the connection to the service could not be made. When function is idempotent, an
+    attempt is also retried when function raises any other exception or returns None, which is what engines return
+    when the response of the service can not be parsed. Responses with 'success' set to False are not retried.
+
+    Args:
+      function (callable): Called with an item, returns a response dictionary.
+      items (iterable): The items.
+      max_workers (int, optional): Maximum number of calls in flight at a time. Defaults to 4.
+      max_attempts (int, optional): Maximum number of attempts per item. Defaults to 3.
+      backoff (float, optional): Seconds to wait before the first retry, doubled for each further retry.
+        Defaults to 0.5.
+      idempotent (bool, optional): Calling function again for an item that may already have been processed is safe,
+        e.g. for updates and deletions. Defaults to False.
+
+    Returns:
+      (BulkResult): The outcome of every item.
+    """
+    def run(index, item):
+        result = BulkItemResult(index, item)
+
+        while result.attempts < max_attempts:
+            if result.attempts:
+                time.sleep(backoff * 2 ** (result.attempts - 1))
+
+            result.attempts += 1
+
+            try:
+                result.response, result.error = function(item), None
+            except Exception as e:
+                result.response, result.error = None, e
+
+                if idempotent or is_connection_error(e):
+                    continue
+
+                break
+
+            if result.response is not None or not idempotent:
+                break
+
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    try:
+        futures = [executor.submit(run, index, item) for index, item in enumerate(items)]
+        return BulkResult([future.result() for future in futures])
+    finally:
+        executor.shutdown(wait=True)
+
+
+def bulk_create_datasets(service_name, items, max_workers=4, max_attempts=3, backoff=0.5, app_class=None):
+    """
+    Create many datasets.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      items (list): Dictionaries of create_dataset arguments, each with at least a 'name'.
+      max_workers (int, optional): Maximum number of calls in flight at a time. Defaults to 4.
+      max_attempts (int, optional): Maximum number of attempts per item. Defaults to 3.
+      backoff (float, optional): Seconds to wait before the first retry, doubled for each further retry.
+        Defaults to 0.5.
+      app_class (class, optional): The app class to include in the search for dataset engines.
+
+    Returns:
+      (BulkResult): The outcome of every item.
+    """
+    engine = get_dataset_engine(service_name, app_class)
+    return run_bulk(lambda item: engine.create_dataset(**item), items, max_workers, max_attempts, backoff)
+
+
+def bulk_create_resources(service_name, dataset_id, items, max_workers=4, max_attempts=3, backoff=0.5,
+                         app_class=None):
+    """
+    Create many resources in one dataset.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      dataset_id (string): The id or name of the dataset to which the resources will be added.
+      items (list): Dictionaries of create_resource arguments (e.g.: {'url': ..., 'name': ...} or {'file': ...}).
+      max_workers (int, optional): Maximum number of calls in flight at a time. Defaults to 4.
+      max_attempts (int, optional): Maximum number of attempts per item. Defaults to 3.
+      backoff (float, optional): Seconds to wait before the first retry, doubled for each further retry.
+        Defaults to 0.5.
+      app_class (class, optional): The app class to include in the search for dataset engines.
+
+    Returns:
+      (BulkResult): The outcome of every item.
+    """
+    engine = get_dataset_engine(service_name, app_class)
+    return run_bulk(lambda item: engine.create_resource(dataset_id, **item), items, max_workers, max_attempts,
+                    backoff)
+
+
+def bulk_update_resources(service_name, items, max_workers=4, max_attempts=3, backoff=0.5, app_class=None):
+    """
+    Update many resources.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      items (list): Dictionaries of update_resource arguments, each with a 'resource_id'.
+      max_workers (int, optional): Maximum number of calls in flight at a time. Defaults to 4.
+      max_attempts (int, optional): Maximum number of attempts per item. Defaults to 3.
+      backoff (float, optional): Seconds to wait before the first retry, doubled for each further retry.
+        Defaults to 0.5.
+      app_class (class, optional): The app class to include in the search for dataset engines.
+
+    Returns:
+      (BulkResult): The outcome of every item.
+    """
+    engine = get_dataset_engine(service_name, app_class)
+    return run_bulk(lambda item: engine.update_resource(**item), items, max_workers, max_attempts, backoff,
+                    idempotent=True)
+
+
+def bulk_delete_resources(service_name, resource_ids, max_workers=4, max_attempts=3, backoff=0.5, app_class=None):
+    """
+    Delete many resources.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      resource_ids (list): The ids of the resources to delete.
+      max_workers (int, optional): Maximum number of calls in flight at a time. Defaults to 4.
+      max_attempts (int, optional): Maximum number of attempts per item. Defaults to 3.
+      backoff (float, optional): Seconds to wait before the first retry, doubled for each further retry.
+        Defaults to 0.5.
+      app_class (class, optional): The app class to include in the search for dataset engines.
+
+    Returns:
+      (BulkResult): The outcome of every item.
+    """
+    engine = get_dataset_engine(service_name, app_class)
+    return run_bulk(lambda resource_id: engine.delete_resource(resource_id=resource_id), resource_ids, max_workers,
+                    max_attempts, backoff, idempotent=True)
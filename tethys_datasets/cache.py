@@ -0,0 +1,156 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class EngineCache(object):
+    """
+    Thread-safe, size and time bounded cache of dataset engine objects.
+    """
+
+    def __init__(self, max_size=128, ttl=300, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          max_size (int): Maximum number of engine objects to keep. The least recently used object is evicted first.
+          ttl (int): Number of seconds an engine object is kept before it is rebuilt. Use 0 or None to disable expiry.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._get(key) is not None
+
+    def _get(self, key):
+        """
+        Return the live entry for key, dropping it if it has expired. Must be called with the lock held.
+        """
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        if self.ttl and self._clock() - entry[1] >= self.ttl:
+            del self._entries[key]
+            return None
+
+        # Mark as most recently used
+        self._entries.pop(key)
+        self._entries[key] = entry
+        return entry
+
+    def get_or_create(self, key, factory, tag=None):
+        """
+        Get the object cached under key, creating it with factory if it is missing or expired.
+
+        Args:
+          key (hashable): Cache key.
+          factory (callable): Function that returns a new object when called with no arguments.
+          tag (hashable, optional): Label used to invalidate a group of entries with invalidate(). An entry shared by
+            callers with different tags is removed by the invalidation of any of them.
+
+        Returns:
+          (object): The cached object.
+        """
+        if not self.max_size:
+            return factory()
+
+        with self._lock:
+            entry = self._get(key)
+
+            if entry is not None:
+                self._add_tag(entry, tag)
+                return entry[0]
+
+        # Build outside of the lock so slow constructors do not block other lookups
+        value = factory()
+
+        with self._lock:
+            # Another thread may have won the race, in which case its object is kept
+            entry = self._get(key)
+
+            if entry is not None:
+                self._add_tag(entry, tag)
+                return entry[0]
+
+            self._entries[key] = (value, self._clock(), set())
+            self._add_tag(self._entries[key], tag)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return value
+
+    @staticmethod
+    def _add_tag(entry, tag):
+        if tag is not None:
+            entry[2].add(tag)
+
+    def invalidate(self, tag):
+        """
+        Remove every entry stored with the given tag, including entries shared with other tags.
+
+        Args:
+          tag (hashable): Tag given to get_or_create().
+        """
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if tag in entry[2]]:
+                del self._entries[key]
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+def engine_cache_key(engine, endpoint, apikey=None, username=None, password=None):
+    """
+    Build the cache key of an engine object. Credentials are hashed so they are not kept in the key in plain text.
+    """
+    credentials = u'\x00'.join(u'{0}'.format(value or u'') for value in (apikey, username, password))
+    digest = hashlib.sha256(credentials.encode('utf-8')).hexdigest()
+    return engine, endpoint, digest
+
+
+def service_cache_tag(service):
+    """
+    Tag under which engines built from a DatasetService or SpatialDatasetService model instance are cached.
+    """
+    return service._meta.model_name, service.pk
+
+
+_engine_cache = None
+_engine_cache_lock = threading.Lock()
+
+
+def get_engine_cache():
+    """
+    Get the process-wide engine cache, configured from the TETHYS_DATASETS_ENGINE_CACHE setting.
+
+    Returns:
+      (EngineCache): The engine cache.
+    """
+    global _engine_cache
+
+    if _engine_cache is None:
+        from django.conf import settings
+
+        with _engine_cache_lock:
+            if _engine_cache is None:
+                options = getattr(settings, 'TETHYS_DATASETS_ENGINE_CACHE', {})
+                _engine_cache = EngineCache(max_size=options.get('MAX_SIZE', 128),
+                                            ttl=options.get('TTL', 300))
+
+    return _engine_cache
@@ -0,0 +1,259 @@
+"""
+Local search index of the catalogs of dataset services.
+
+The harvester copies the metadata of the datasets and resources of a CKAN dataset service into the CatalogDataset and
+CatalogResource tables. After the first harvest only the datasets modified since the newest copy are fetched, and the
+copies of datasets deleted since then are found like the sync finds them (see tethys_datasets.sync): in the activity
+stream of the service, or by comparing the listed names with the copies. A full harvest removes the copies of all
+datasets it did not fetch. Values longer than their column are cut down, the full metadata is kept in the data column.
+
+Searches run against the local copy and never call the service. On SQLite the tables have FTS5 full-text indexes, on
+other databases searches fall back to case-insensitive substring matching.
+"""
+import json
+import logging
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import CatalogDataset, CatalogResource, DatasetService, truncate_to_field
+from .sync import delete_copies, find_deleted_datasets, iter_modified_datasets
+from .utilities import get_dataset_engine
+
+log = logging.getLogger(__name__)
+
+DATASET_SEARCH_FIELDS = ('name', 'title', 'notes', 'tags', 'resource_text')
+RESOURCE_SEARCH_FIELDS = ('name', 'description', 'format')
+
+
+class HarvestResult(object):
+    """
+    Outcome of the harvest of one dataset service.
+    """
+
+    def __init__(self, service_name, full):
+        self.service_name = service_name
+        self.full = full
+        self.updated = 0
+        self.deleted = 0
+
+    def __repr__(self):
+        return '<HarvestResult: service={0}, full={1}, updated={2}, deleted={3}>'.format(
+            self.service_name, self.full, self.updated, self.deleted)
+
+
+def _resource_text(dataset):
+    return ' '.join(u'{0} {1} {2}'.format(resource.get('name') or '', resource.get('description') or '',
+                                          resource.get('format') or '')
+                    for resource in dataset.get('resources') or ())
+
+
+def _tags(dataset):
+    return ' '.join(tag['name'] if isinstance(tag, dict) else u'{0}'.format(tag) for tag in dataset.get('tags') or ())
+
+
+def store_dataset(service, dataset):
+    """
+    Create or update the local copy of a dataset and its resources.
+
+    Args:
+      service (DatasetService): The dataset service the dataset belongs to.
+      dataset (dict): The dataset dictionary returned by the service.
+
+    Returns:
+      (CatalogDataset): The local copy.
+    """
+    values = {
+        'name': truncate_to_field(CatalogDataset, 'name', dataset.get('name')),
+        'title': truncate_to_field(CatalogDataset, 'title', dataset.get('title')),
+        'notes': dataset.get('notes') or '',
+        'tags': _tags(dataset),
+        'resource_text': _resource_text(dataset),
+        'metadata_modified': dataset.get('metadata_modified') or '',
+        'data': json.dumps(dataset),
+    }
+
+    with transaction.atomic():
+        copy, created = CatalogDataset.objects.update_or_create(service=service, dataset_id=dataset['id'],
+                                                                defaults=values)
+
+        if not created:
+            copy.resources.all().delete()
+
+        CatalogResource.objects.bulk_create([
+            CatalogResource(dataset=copy,
+                            resource_id=resource['id'],
+                            name=truncate_to_field(CatalogResource, 'name', resource.get('name')),
+                            description=resource.get('description') or '',
+                            format=truncate_to_field(CatalogResource, 'format', resource.get('format')),
+                            url=resource.get('url') or '',
+                            data=json.dumps(resource))
+            for resource in dataset.get('resources') or ()
+        ])
+
+    return copy
+
+
+def harvest(service_name, full=False, page_size=100):
+    """
+    Copy the metadata of the datasets of a dataset service into the local search index.
+
+    Args:
+      service_name (string): Name of the site-wide dataset service.
+      full (bool, optional): Fetch all datasets instead of only the datasets modified since the last harvest.
+        Defaults to False.
+      page_size (int, optional): Number of datasets requested per call. Defaults to 100.
+
+    Returns:
+      (HarvestResult): Numbers of datasets updated and deleted.
+    """
+    service = DatasetService.objects.get(name=service_name)
+    copies = CatalogDataset.objects.filter(service=service)
+    watermark = None
+
+    if not full:
+        watermark = copies.exclude(metadata_modified='').order_by('-metadata_modified') \
+            .values_list('metadata_modified', flat=True).first()
+
+    result = HarvestResult(service_name, full=watermark is None)
+
+    seen = set()
+
+    for dataset in iter_modified_datasets(service_name, watermark, page_size):
+        store_dataset(service, dataset)
+        result.updated += 1
+
+        if result.full:
+            seen.add(dataset['id'])
+
+    if result.full:
+        deleted = set(copies.values_list('dataset_id', flat=True)) - seen
+    else:
+        deleted = find_deleted_datasets(get_dataset_engine(service_name), watermark, copies)
+
+    result.deleted = len(deleted)
+    delete_copies(copies, deleted)
+
+    log.info('Harvested dataset service "%s": %d updated, %d deleted.', service_name, result.updated, result.deleted)
+    return result
+
+
+def harvest_all(full=False):
+    """
+    Harvest every dataset service that has its local search index enabled.
+
+    Returns:
+      (list): HarvestResult of every service. Services that fail are logged and skipped.
+    """
+    results = []
+
+    for service_name in DatasetService.objects.filter(index_catalog=True).values_list('name', flat=True):
+        try:
+            results.append(harvest(service_name, full=full))
+        except Exception:
+            log.exception('Could not harvest dataset service "%s".', service_name)
+
+    return results
+
+
+_fts_tables = {}
+
+
+def _has_fts(table):
+    if table not in _fts_tables:
+        _fts_tables[table] = connection.vendor == 'sqlite' and \
+            table + '_fts' in connection.introspection.table_names()
+
+    return _fts_tables[table]
+
+
+def _terms(text):
+    return re.findall(r'\w+', text or '', re.UNICODE)
+
+
+def _text_filter(queryset, text, fields):
+    """
+    Restrict a queryset to the rows that contain every word of text in any of the fields.
+    """
+    terms = _terms(text)
+
+    if not terms:
+        return queryset
+
+    table = queryset.model._meta.db_table
+
+    if _has_fts(table):
+        # Every word must match, the last one also as a prefix so results show up while typing
+        match = ' '.join('"{0}"'.format(term) for term in terms) + '*'
+        return queryset.extra(
+            where=['{0}.id IN (SELECT rowid FROM {0}_fts WHERE {0}_fts MATCH %s)'.format(table)],
+            params=[match],
+        )
+
+    for term in terms:
+        condition = Q()
+
+        for field in fields:
+            condition |= Q(**{field + '__icontains': term})
+
+        queryset = queryset.filter(condition)
+
+    return queryset
+
+
+def search_catalog(text=None, service_name=None, limit=20, offset=0):
+    """
+    Search the local copies of the datasets.
+
+    Args:
+      text (string, optional): Words that must appear in the name, title, description, tags or resources of the
+        datasets. Defaults to all datasets.
+      service_name (string, optional): Only search the datasets of this dataset service.
+      limit (int, optional): Maximum number of datasets to return. Defaults to 20.
+      offset (int, optional): Number of matching datasets to skip. Defaults to 0.
+
+    Returns:
+      (dict): 'count' of matching datasets and 'results', the dataset dictionaries as returned by the service, like
+        the result of search_datasets.
+    """
+    queryset = CatalogDataset.objects.all()
+
+    if service_name:
+        queryset = queryset.filter(service__name=service_name)
+
+    queryset = _text_filter(queryset, text, DATASET_SEARCH_FIELDS)
+
+    return {
+        'count': queryset.count(),
+        'results': [json.loads(data) for data in
+                    queryset.order_by('name', 'id').values_list('data', flat=True)[offset:offset + limit]],
+    }
+
+
+def search_catalog_resources(text=None, service_name=None, limit=20, offset=0):
+    """
+    Search the local copies of the resources.
+
+    Args:
+      text (string, optional): Words that must appear in the name, description or format of the resources. Defaults
+        to all resources.
+      service_name (string, optional): Only search the resources of this dataset service.
+      limit (int, optional): Maximum number of resources to return. Defaults to 20.
+      offset (int, optional): Number of matching resources to skip. Defaults to 0.
+
+    Returns:
+      (dict): 'count' of matching resources and 'results', the resource dictionaries as returned by the service.
+    """
+    queryset = CatalogResource.objects.all()
+
+    if service_name:
+        queryset = queryset.filter(dataset__service__name=service_name)
+
+    queryset = _text_filter(queryset, text, RESOURCE_SEARCH_FIELDS)
+
+    return {
+        'count': queryset.count(),
+        'results': [json.loads(data) for data in
+                    queryset.order_by('name', 'id').values_list('data', flat=True)[offset:offset + limit]],
+    }
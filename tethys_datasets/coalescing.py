@@ -0,0 +1,116 @@
+"""
+Coalescing of identical concurrent reads.
+
+When several threads make the same read call on the same dataset service at the same time (e.g.: get_dataset with the
+same dataset_id), only the first call goes to the service. The others wait for it and get a copy of its response, or
+its exception. Calls are identical when they go to the same engine (the same endpoint and credentials) with the same
+method and arguments (see EngineCall.fingerprint).
+
+Coalescing is on by default and can be turned off in settings.py:
+
+    TETHYS_DATASETS_COALESCE_READS = False
+"""
+import copy
+import threading
+
+
+class _Flight(object):
+    """
+    A call in flight and its outcome.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight(object):
+    """
+    Runs at most one function per key at a time, sharing its outcome with the callers that arrive while it runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def __len__(self):
+        return len(self._flights)
+
+    def do(self, key, function):
+        """
+        Call function unless a call with the same key is in flight, in which case wait for that call instead.
+
+        Args:
+          key (hashable): Identifies identical calls.
+          function (callable): Called without arguments.
+
+        Returns:
+          (tuple): The result and True if it was shared from a call in flight. Shared results are deep copies, so
+            callers can not change each other's results.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.followers += 1
+
+        if not leader:
+            flight.done.wait()
+
+            if flight.error is not None:
+                raise flight.error
+
+            return copy.deepcopy(flight.result), True
+
+        try:
+            flight.result = function()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+            flight.done.set()
+
+        # Followers copy the result after done is set, so it must not be handed out before then
+        return (copy.deepcopy(flight.result) if flight.followers else flight.result), False
+
+
+class SingleFlightLayer(object):
+    """
+    EngineProxy layer that coalesces identical concurrent read calls.
+    """
+
+    def __init__(self, group=None):
+        """
+        Constructor
+
+        Args:
+          group (SingleFlight, optional): Group of calls in flight. Defaults to the process-wide group.
+        """
+        self.group = group if group is not None else get_single_flight()
+
+    def __call__(self, call, proceed):
+        # Console output is a side effect of the call, so those calls are never shared
+        if not call.is_read or call.kwargs.get('console'):
+            return proceed()
+
+        # Engines of apps may share the name of another service, so the engine identity keeps their results apart
+        result, call.coalesced = self.group.do((call.engine_key or call.service, call.fingerprint()), proceed)
+        return result
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    """
+    Get the process-wide group of calls in flight.
+    """
+    return _single_flight
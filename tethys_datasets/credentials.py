@@ -0,0 +1,299 @@
+"""
+Access tokens of the accounts of site-wide dataset services.
+
+Services behind an OAuth2 server (e.g. GeoServer with the OAuth2 plugin) can exchange the username and password of a
+service for an access token once and send the token on every request, instead of sending the password or logging in
+again for every new engine. Tokens are requested the first time they are needed, kept in memory only, refreshed shortly
+before they expire and shared by all engines of the account in a process. A request answered with 401 Unauthorized
+gets a new token and is sent once more.
+
+Tokens are used for the services listed in settings.py:
+
+    TETHYS_DATASETS_SERVICE_TOKENS = {
+        'geoserver': {
+            'TOKEN_URL': 'https://auth.example.com/realms/tethys/protocol/openid-connect/token',
+            'CLIENT_ID': 'client id',
+            'CLIENT_SECRET': 'client secret',
+        },
+    }
+
+Tokens are applied to the requests sent through the connection pool (see tethys_datasets.transport) with the
+username and password of the service as basic auth credentials. What this covers:
+
+- Only servers with an OAuth2 token endpoint that accepts the password grant can issue tokens.
+- Services that check basic auth on every request, like a GeoServer without the OAuth2 plugin, have no login to skip.
+  They are left out of the setting and keep sending basic auth.
+- Calls made through the geoserver-restconfig catalog use the session of the catalog and keep basic auth.
+- The HydroShare engine of tethys_dataset_services makes no API calls yet, so HydroShare services gain nothing.
+
+Each engine of an account would otherwise get a token of its own. get_credential_manager().stats() counts these
+skipped token requests as 'avoided', next to the logins and refreshes that were made.
+"""
+import hmac
+import threading
+import time
+
+from django.conf import settings
+
+from .exceptions import DatasetServiceError
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+# Seconds before the expiry of a token at which it is refreshed, unless set for the service
+REFRESH_MARGIN = 60
+
+# Lifetime in seconds of tokens whose response does not tell
+DEFAULT_EXPIRES_IN = 3600
+
+
+class AuthenticationError(DatasetServiceError):
+    """
+    Raised when a dataset service does not issue an access token.
+    """
+    pass
+
+
+class AccessToken(object):
+    """
+    OAuth2 access token of one account, obtained with the password grant and renewed with the refresh token grant.
+    """
+
+    def __init__(self, token_url, client_id, client_secret, username, password, refresh_margin=REFRESH_MARGIN,
+                 clock=time.time):
+        """
+        Constructor
+
+        Args:
+          token_url (string): URL of the token endpoint of the OAuth2 server.
+          client_id (string): Client id of the site at the OAuth2 server.
+          client_secret (string): Client secret of the site at the OAuth2 server.
+          username (string): Username of the account.
+          password (string): Password of the account.
+          refresh_margin (float): Seconds before the expiry at which the token is refreshed.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.token_url = token_url
+        self.client_id = client_id
+        self.username = username
+        self.refresh_margin = refresh_margin
+        self.authentications = 0
+        self.refreshes = 0
+        self.reused = 0  # Token requests skipped because the token was shared
+        self._client_secret = client_secret
+        self._password = password
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._access_token = None
+        self._refresh_token = None
+        self._expires_at = 0
+
+    def matches(self, token_url, client_id, client_secret, password):
+        return (token_url, client_id, client_secret, password) == (self.token_url, self.client_id,
+                                                                   self._client_secret, self._password)
+
+    def accepts(self, password):
+        """
+        Whether a request sent with password may use the token, i.e. the password is the one of the account.
+        """
+        if password is None:
+            return False
+
+        return hmac.compare_digest(u'{0}'.format(password).encode('utf-8'),
+                                   u'{0}'.format(self._password).encode('utf-8'))
+
+    @property
+    def valid(self):
+        return self._access_token is not None and self._clock() < self._expires_at - self.refresh_margin
+
+    def get(self, post):
+        """
+        Get the access token, requesting a new one if there is none or it is about to expire.
+
+        Args:
+          post (callable): Called with the token URL, the form data and the client credentials to request a token. Must
+            return the status code and the parsed JSON body of the response.
+
+        Returns:
+          (string): The access token.
+        """
+        # Reading a valid token needs no lock
+        access_token = self._access_token
+
+        if self.valid:
+            return access_token
+
+        with self._lock:
+            # Another thread may have renewed the token while this one waited, and then has no request to make
+            if self.valid:
+                self.reused += 1
+                return self._access_token
+
+            token = None
+
+            if self._refresh_token:
+                status, token = post(self.token_url, {'grant_type': 'refresh_token',
+                                                      'refresh_token': self._refresh_token},
+                                     (self.client_id, self._client_secret))
+
+                if status == 200 and token and token.get('access_token'):
+                    self.refreshes += 1
+                else:
+                    token = None
+
+            if token is None:
+                status, token = post(self.token_url, {'grant_type': 'password', 'username': self.username,
+                                                      'password': self._password},
+                                     (self.client_id, self._client_secret))
+
+                if status != 200 or not token or not token.get('access_token'):
+                    error = token.get('error_description') or token.get('error') if isinstance(token, dict) else None
+                    raise AuthenticationError('No access token for "{0}" from {1}: {2}'.format(
+                        self.username, self.token_url, error or 'status code {0}'.format(status)))
+
+                self.authentications += 1
+
+            self._access_token = token['access_token']
+            self._refresh_token = token.get('refresh_token') or self._refresh_token
+            self._expires_at = self._clock() + float(token.get('expires_in') or DEFAULT_EXPIRES_IN)
+            return self._access_token
+
+    def invalidate(self, access_token=None):
+        """
+        Drop the access token, e.g. after the service rejected it. The refresh token is kept.
+
+        Args:
+          access_token (string, optional): Only drop the token if it is still this one, so a token renewed by another
+            thread is kept.
+        """
+        with self._lock:
+            if access_token is None or access_token == self._access_token:
+                self._access_token = None
+
+    def as_dict(self):
+        return {
+            'token_url': self.token_url,
+            'username': self.username,
+            'valid': self.valid,
+            'authentications': self.authentications,
+            'refreshes': self.refreshes,
+            'avoided': self.reused,
+        }
+
+    def __repr__(self):
+        # Never show the token or the password
+        return '<AccessToken: username={0}, token_url={1}>'.format(self.username, self.token_url)
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return parts.scheme.lower(), parts.netloc.lower()
+
+
+class CredentialManager(object):
+    """
+    Access tokens of the accounts of dataset services, by host and username.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+
+    def register(self, endpoint, username, password, options):
+        """
+        Use an access token for the requests sent to the host of endpoint with username, called for every new engine
+        of the account. The token is kept and shared with the engine if the options and password did not change.
+
+        Args:
+          endpoint (string): URL of the service endpoint.
+          username (string): Username of the account.
+          password (string): Password of the account.
+          options (dict): The options of the service from the TETHYS_DATASETS_SERVICE_TOKENS setting.
+
+        Returns:
+          (AccessToken): The access token of the account.
+        """
+        key = (_host(endpoint), username)
+        token_url, client_id = options['TOKEN_URL'], options.get('CLIENT_ID', '')
+        client_secret = options.get('CLIENT_SECRET', '')
+        token = self._tokens.get(key)
+
+        with self._lock:
+            token = self._tokens.get(key)
+
+            if token is not None and token.matches(token_url, client_id, client_secret, password):
+                # The new engine would otherwise get a token of its own
+                token.reused += 1
+                return token
+
+            token = AccessToken(token_url, client_id, client_secret, username, password,
+                                refresh_margin=options.get('REFRESH_MARGIN', REFRESH_MARGIN))
+            self._tokens[key] = token
+
+        return token
+
+    def lookup(self, url, username, password):
+        """
+        Get the access token for a request.
+
+        Args:
+          url (string): The request URL.
+          username (string): Username of the basic auth credentials of the request.
+          password (string): Password of the basic auth credentials of the request.
+
+        Returns:
+          (AccessToken): The access token, None if the account does not use one or the password is not the one of the
+            account.
+        """
+        if not self._tokens or not username:
+            return None
+
+        token = self._tokens.get((_host(url), username))
+
+        # Requests of other accounts with the same username, e.g. of engines declared by apps, keep their credentials
+        if token is None or not token.accepts(password):
+            return None
+
+        return token
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def stats(self):
+        """
+        Describe the access tokens, including how many token requests sharing them avoided.
+        """
+        return [token.as_dict() for token in list(self._tokens.values())]
+
+
+_credential_manager = CredentialManager()
+
+
+def get_credential_manager():
+    """
+    Get the process-wide credential manager.
+    """
+    return _credential_manager
+
+
+def configure_service(service, endpoint):
+    """
+    Register the account of a site-wide dataset service with the credential manager if the service is listed in the
+    TETHYS_DATASETS_SERVICE_TOKENS setting.
+
+    Args:
+      service (DatasetService): DatasetService or SpatialDatasetService model instance.
+      endpoint (string): The endpoint the engine of the service talks to.
+
+    Returns:
+      (AccessToken): The access token of the account, None if the service does not use one.
+    """
+    options = getattr(settings, 'TETHYS_DATASETS_SERVICE_TOKENS', {}).get(service.name)
+
+    if not options or not service.username:
+        return None
+
+    return _credential_manager.register(endpoint, service.username, service.password, options)
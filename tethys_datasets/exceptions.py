@@ -0,0 +1,5 @@
+class DatasetServiceError(Exception):
+    """
+    Raised when a dataset service call does not succeed.
+    """
+    pass
@@ -0,0 +1,264 @@
+"""
+Federated search across the site-wide dataset services.
+
+The query is sent to every service at the same time, each call running on a shared thread pool. Every service has a
+deadline: services that have not answered by then are reported as timed out, so one slow service never holds up the
+others. The deadline is also passed down to the requests of the engine (see tethys_datasets.transport.request_deadline),
+which give up once it has passed, so calls to a hung service do not keep threads of the pool busy. With
+TETHYS_DATASETS_CONNECTION_POOLING set to False the requests do not know the deadline and a call that missed it runs
+on in the background until the service answers. Results can be consumed per service as they arrive or merged:
+
+    from tethys_datasets.federated import federated_search, iter_federated_search
+
+    for service_result in iter_federated_search('rainfall', timeout=5):
+        print(service_result.service, service_result.status, len(service_result.datasets))
+
+    merged = federated_search('rainfall', services=['ckan', 'hydroshare'], timeout={'hydroshare': 2})
+
+The merged results interleave the datasets of the services by rank and keep only the first of the datasets with the
+same name, recording the other services that have it.
+"""
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from .models import DatasetService
+from .pagination import get_result
+from .registry import get_service_registry
+from .utilities import get_dataset_engine
+
+# Seconds a service has to answer unless another deadline is given
+DEFAULT_TIMEOUT = 10
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_search_executor():
+    """
+    Get the thread pool that runs the calls of federated searches, sized by the TETHYS_DATASETS_SEARCH_WORKERS setting.
+    """
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'TETHYS_DATASETS_SEARCH_WORKERS', 16),
+                                               thread_name_prefix='tethys_datasets-search')
+
+    return _executor
+
+
+class ServiceSearchResult(object):
+    """
+    Outcome of the search of one dataset service.
+    """
+    OK = 'ok'
+    ERROR = 'error'
+    TIMEOUT = 'timeout'
+
+    def __init__(self, service, status, datasets=(), count=0, error=None, duration=None):
+        """
+        Constructor
+
+        Args:
+          service (string): Name of the dataset service.
+          status (string): ServiceSearchResult.OK, ERROR or TIMEOUT.
+          datasets (list): The dataset dictionaries returned by the service, best match first.
+          count (int): Number of datasets matching the query on the service, which can be more than returned.
+          error (string): Description of the error.
+          duration (float): Seconds the service took to answer, None if it did not answer in time.
+        """
+        self.service = service
+        self.status = status
+        self.datasets = list(datasets)
+        self.count = count
+        self.error = error
+        self.duration = duration
+
+    def as_dict(self, with_datasets=True):
+        description = {'service': self.service, 'status': self.status, 'count': self.count, 'error': self.error,
+                       'duration': self.duration}
+
+        if with_datasets:
+            description['datasets'] = self.datasets
+
+        return description
+
+    def __repr__(self):
+        return '<ServiceSearchResult: service={0}, status={1}, datasets={2}>'.format(self.service, self.status,
+                                                                                    len(self.datasets))
+
+
+def _search_service(service_name, engine, query, limit, kwargs, deadline):
+    # Imported here because the transport module pulls in requests
+    from .transport import request_deadline
+
+    start = time.time()
+
+    try:
+        # A plain string searches the catch-all text field of the CKAN search index
+        with request_deadline(deadline):
+            response = engine.search_datasets(query={'text': query} if isinstance(query, str) else query,
+                                              rows=limit, **kwargs)
+
+        result = get_result(response, 'search_datasets')
+    except NotImplementedError:
+        return ServiceSearchResult(service_name, ServiceSearchResult.ERROR, error='Search is not supported.',
+                                   duration=time.time() - start)
+    except Exception as e:
+        return ServiceSearchResult(service_name, ServiceSearchResult.ERROR, error=u'{0}'.format(e),
+                                   duration=time.time() - start)
+
+    datasets = result.get('results', []) if isinstance(result, dict) else list(result or [])
+    count = result.get('count', len(datasets)) if isinstance(result, dict) else len(datasets)
+    return ServiceSearchResult(service_name, ServiceSearchResult.OK, datasets[:limit], count,
+                               duration=time.time() - start)
+
+
+def _timed_out(service_name, seconds):
+    return ServiceSearchResult(service_name, ServiceSearchResult.TIMEOUT,
+                               error='No answer within {0:g} seconds.'.format(seconds))
+
+
+def iter_federated_search(query, services=None, timeout=DEFAULT_TIMEOUT, limit=20, **kwargs):
+    """
+    Search several dataset services in parallel and yield the result of each service as soon as it is known.
+
+    Args:
+      query (string or dict): Text to search for, or key value pairs of fields and values as for search_datasets.
+      services (list, optional): Names of the dataset services. Defaults to all site-wide dataset services.
+      timeout (float or dict, optional): Seconds every service has to answer, or the seconds per service name.
+        Services missing from the dict get DEFAULT_TIMEOUT. Defaults to DEFAULT_TIMEOUT.
+      limit (int, optional): Maximum number of datasets requested from each service. Defaults to 20.
+      **kwargs: Other arguments of search_datasets.
+
+    Returns:
+      (generator): ServiceSearchResult objects in the order the services answered. Services that miss their deadline
+        come as TIMEOUT results once the deadline has passed.
+    """
+    if services is None:
+        services = get_service_registry(DatasetService).names()
+
+    start = time.time()
+    executor = get_search_executor()
+    pending = {}
+    failed = []
+
+    for service_name in services:
+        seconds = timeout.get(service_name, DEFAULT_TIMEOUT) if isinstance(timeout, dict) else timeout
+
+        # Engines are looked up here, since a lookup may query the database and the threads of the pool would keep
+        # their database connections open
+        try:
+            engine = get_dataset_engine(service_name)
+        except Exception as e:
+            failed.append(ServiceSearchResult(service_name, ServiceSearchResult.ERROR, error=u'{0}'.format(e)))
+            continue
+
+        future = executor.submit(_search_service, service_name, engine, query, limit, kwargs, start + seconds)
+        pending[future] = (service_name, start + seconds)
+
+    try:
+        for result in failed:
+            yield result
+
+        while pending:
+            wait_for = max(0, min(deadline for _, deadline in pending.values()) - time.time())
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                service_name, deadline = pending.pop(future)
+                result = future.result()
+
+                # The requests of the engine gave up at the deadline
+                if result.status == ServiceSearchResult.ERROR and time.time() >= deadline:
+                    result = _timed_out(service_name, deadline - start)
+
+                yield result
+
+            now = time.time()
+
+            for future, (service_name, deadline) in list(pending.items()):
+                if deadline <= now and not future.done():
+                    # Calls still waiting for a thread are dropped, the requests of running ones time out
+                    future.cancel()
+                    del pending[future]
+                    yield _timed_out(service_name, deadline - start)
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def dataset_key(dataset):
+    """
+    Key under which datasets of different services are considered the same: the name, as kept by CKAN harvesters,
+    or the id for datasets without a name.
+    """
+    return (dataset.get('name') or dataset.get('id') or '').lower()
+
+
+def merge_results(service_results):
+    """
+    Interleave the datasets of several services by rank, keeping only the first dataset with a given key.
+
+    Args:
+      service_results (list): ServiceSearchResult objects. Their order decides which service wins ties.
+
+    Returns:
+      (list): Dictionaries with the 'service' and the 'dataset', and the other services that have the same dataset in
+        'duplicates'.
+    """
+    merged = []
+    seen = {}
+    rank = 0
+
+    while True:
+        found = False
+
+        for service_result in service_results:
+            if rank >= len(service_result.datasets):
+                continue
+
+            found = True
+            dataset = service_result.datasets[rank]
+            key = dataset_key(dataset)
+
+            if key and key in seen:
+                seen[key]['duplicates'].append(service_result.service)
+                continue
+
+            entry = {'service': service_result.service, 'dataset': dataset, 'duplicates': []}
+            merged.append(entry)
+
+            if key:
+                seen[key] = entry
+
+        if not found:
+            return merged
+
+        rank += 1
+
+
+def federated_search(query, services=None, timeout=DEFAULT_TIMEOUT, limit=20, **kwargs):
+    """
+    Search several dataset services in parallel and merge their results. Takes the arguments of
+    iter_federated_search.
+
+    Returns:
+      (dict): The merged 'results' (see merge_results) and the outcome of every service in 'services', in the order
+        the services were given.
+    """
+    if services is None:
+        services = get_service_registry(DatasetService).names()
+
+    by_service = dict((result.service, result) for result in
+                      iter_federated_search(query, services, timeout=timeout, limit=limit, **kwargs))
+    service_results = [by_service[service_name] for service_name in services]
+
+    return {
+        'results': merge_results(service_results),
+        'services': [result.as_dict(with_datasets=False) for result in service_results],
+    }
@@ -0,0 +1,406 @@
+"""
+Circuit breakers, health checks and routing between the endpoints of a dataset service.
+
+Every endpoint of a site-wide dataset service, the main endpoint and its mirrors, has a circuit breaker. After
+failure_threshold consecutive failed calls the breaker opens and calls to the endpoint fail right away with a
+CircuitOpenError instead of waiting for a network timeout. Once breaker_cooldown seconds have passed, one call is let
+through to test the endpoint: the breaker closes if it succeeds and opens again if it fails. Requests sent through the
+connection pool time out after TETHYS_DATASETS_REQUEST_TIMEOUT (see tethys_datasets.transport), so the calls to a hung
+endpoint fail as well.
+
+A call fails when it raises an I/O error (which includes the connection errors and timeouts of requests) or when the
+engine could not parse the response of the service. Responses with 'success' set to False are answers of a working
+service and do not count as failures.
+
+get_dataset_engine and get_spatial_dataset_engine return the engine of the endpoint that is available and fastest. The
+latency of an endpoint is measured on the calls made to it and, when enabled, by a background health checker:
+
+    TETHYS_DATASETS_HEALTH_CHECK = {
+        'INTERVAL': 30,
+        'TIMEOUT': 5,
+    }
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .exceptions import DatasetServiceError
+
+log = logging.getLogger(__name__)
+
+# Weight of the newest measurement in the moving average of the latency of an endpoint
+LATENCY_SMOOTHING = 0.3
+
+
+class CircuitOpenError(DatasetServiceError):
+    """
+    Raised instead of calling an endpoint whose circuit breaker is open.
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of one endpoint.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, cooldown=30, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          failure_threshold (int): Consecutive failures that open the breaker. 0 disables the breaker.
+          cooldown (float): Seconds the breaker stays open before a test call is let through.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def failures(self):
+        """
+        Number of consecutive failures.
+        """
+        return self._failures
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+
+        if self._probing or self._clock() - self._opened_at >= self.cooldown:
+            return self.HALF_OPEN
+
+        return self.OPEN
+
+    def available(self):
+        """
+        Whether a call to the endpoint would be let through now. Unlike allow, this does not start a test call.
+        """
+        return self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self._probing)
+
+    def allow(self):
+        """
+        Decide whether a call may go to the endpoint. When the breaker is half-open only one test call is let through
+        at a time.
+
+        Returns:
+          (bool): True if the call may go ahead.
+        """
+        with self._lock:
+            state = self.state
+
+            if state == self.CLOSED:
+                return True
+
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+
+            return False
+
+    def release(self):
+        """
+        End a test call without a verdict, so the next call is let through as a test call instead.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+
+            # A failed test call opens the breaker for another cooldown
+            if self._probing or (self.failure_threshold and self._failures >= self.failure_threshold):
+                self._opened_at = self._clock()
+
+            self._probing = False
+
+    def __repr__(self):
+        return '<CircuitBreaker: state={0}, failures={1}>'.format(self.state, self._failures)
+
+
+class EndpointHealth(object):
+    """
+    Availability and latency of one endpoint of a dataset service.
+    """
+
+    def __init__(self, endpoint, breaker):
+        """
+        Constructor
+
+        Args:
+          endpoint (string): URL of the endpoint.
+          breaker (CircuitBreaker): The circuit breaker of the endpoint.
+        """
+        self.endpoint = endpoint
+        self.breaker = breaker
+        self.latency = None
+        self.last_error = None
+        self.last_checked = None
+
+    def record_success(self, latency):
+        """
+        Record a successful call or health check that took latency seconds.
+        """
+        self.breaker.record_success()
+        self.last_error = None
+
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+    def record_failure(self, error=None):
+        """
+        Record a failed call or health check.
+        """
+        self.breaker.record_failure()
+        self.last_error = error
+
+    def __repr__(self):
+        return '<EndpointHealth: endpoint={0}, state={1}, latency={2}>'.format(self.endpoint, self.breaker.state,
+                                                                               self.latency)
+
+
+class CircuitBreakerLayer(object):
+    """
+    EngineProxy layer that passes calls through the circuit breaker of the endpoint of the engine and measures them.
+    """
+
+    def __init__(self, health, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          health (EndpointHealth): Health of the endpoint of the engine.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.health = health
+        self._clock = clock
+
+    def __call__(self, call, proceed):
+        if not self.health.breaker.allow():
+            raise CircuitOpenError('The endpoint "{0}" of dataset service "{1}" is not available.'.format(
+                self.health.endpoint, call.service))
+
+        start = self._clock()
+
+        try:
+            response = proceed()
+        except (IOError, OSError) as e:
+            self.health.record_failure(e)
+            raise
+        except Exception:
+            # Not a problem of the endpoint, but a half-open breaker must not wait for a test call forever
+            self.health.breaker.release()
+            raise
+
+        if response is None:
+            self.health.record_failure()
+        else:
+            self.health.record_success(self._clock() - start)
+
+        return response
+
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+def get_endpoint_health(endpoint, failure_threshold=5, cooldown=30):
+    """
+    Get the process-wide health record of an endpoint for the given breaker settings. Services that call the same
+    endpoint with the same settings share a record, services with other settings get their own, so the settings of one
+    service never change the breaker of another.
+
+    Args:
+      endpoint (string): URL of the endpoint.
+      failure_threshold (int): Consecutive failures that open the breaker. 0 disables the breaker.
+      cooldown (float): Seconds the breaker stays open before a test call is let through.
+
+    Returns:
+      (EndpointHealth): The health record.
+    """
+    key = (endpoint, failure_threshold, cooldown)
+    health = _endpoints.get(key)
+
+    if health is None:
+        with _endpoints_lock:
+            health = _endpoints.get(key)
+
+            if health is None:
+                health = EndpointHealth(endpoint, CircuitBreaker(failure_threshold, cooldown))
+                _endpoints[key] = health
+
+    return health
+
+
+def service_endpoints(service):
+    """
+    Get the endpoints of a site-wide dataset service, the main endpoint first.
+
+    Args:
+      service (DatasetService): DatasetService or SpatialDatasetService model instance.
+
+    Returns:
+      (list): The endpoint URLs.
+    """
+    endpoints = [service.endpoint]
+
+    for line in (getattr(service, 'mirrors', '') or '').splitlines():
+        mirror = line.strip()
+
+        if mirror and mirror not in endpoints:
+            endpoints.append(mirror)
+
+    return endpoints
+
+
+def service_health(service):
+    """
+    Get the health records of all endpoints of a site-wide dataset service, the main endpoint first.
+    """
+    return [get_endpoint_health(endpoint, service.failure_threshold, service.breaker_cooldown)
+            for endpoint in service_endpoints(service)]
+
+
+def choose_endpoint(service):
+    """
+    Choose the endpoint of a site-wide dataset service that calls should go to: of the endpoints whose circuit breaker
+    lets calls through, the one with the fewest consecutive failures and then the lowest latency. Endpoints that have
+    not been measured yet come after the measured ones, in the order of the mirrors, so a new mirror only gets calls
+    once the health checker has measured it or the measured endpoints fail. When no endpoint is available the main
+    endpoint is chosen, so its calls fail fast.
+
+    Args:
+      service (DatasetService): DatasetService or SpatialDatasetService model instance.
+
+    Returns:
+      (EndpointHealth): The health record of the chosen endpoint.
+    """
+    healths = service_health(service)
+    available = [(health.breaker.failures, health.latency is None, health.latency or 0.0, index)
+                 for index, health in enumerate(healths) if health.breaker.available()]
+
+    if not available:
+        return healths[0]
+
+    return healths[min(available)[-1]]
+
+
+class HealthChecker(object):
+    """
+    Background thread that periodically checks every endpoint of the site-wide dataset services. An endpoint is
+    available when it answers a GET request with a status code below 500.
+    """
+
+    def __init__(self, interval=30, timeout=5):
+        """
+        Constructor
+
+        Args:
+          interval (float): Seconds between checks.
+          timeout (float): Seconds to wait for an endpoint to answer.
+        """
+        self.interval = interval
+        self.timeout = timeout
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='tethys_datasets-health-checker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        from django.db import connection
+
+        while not self._stopped.wait(self.interval):
+            try:
+                self.check_all()
+            except Exception:
+                log.warning('Health check of the dataset services failed.', exc_info=True)
+            finally:
+                connection.close()
+
+    def check_all(self):
+        """
+        Check every endpoint of all site-wide dataset services once.
+        """
+        from .models import DatasetService, SpatialDatasetService
+        from .registry import get_service_registry
+
+        for model in (DatasetService, SpatialDatasetService):
+            registry = get_service_registry(model)
+
+            for name in registry.names():
+                service = registry.get(name)
+
+                if service is not None:
+                    for health in service_health(service):
+                        self.check(health)
+
+    def check(self, health):
+        """
+        Check one endpoint and record the result.
+
+        Args:
+          health (EndpointHealth): The health record of the endpoint.
+        """
+        from .transport import get_session_pool
+
+        start = time.time()
+        health.last_checked = start
+
+        try:
+            response = get_session_pool().request('get', health.endpoint, timeout=self.timeout, stream=True)
+            response.close()
+        except (IOError, OSError) as e:
+            health.record_failure(e)
+            return
+
+        if response.status_code >= 500:
+            health.record_failure(DatasetServiceError('Status code {0}.'.format(response.status_code)))
+        else:
+            health.record_success(time.time() - start)
+
+
+_health_checker = None
+
+
+def start_health_checker():
+    """
+    Start the background health checker if the TETHYS_DATASETS_HEALTH_CHECK setting is given.
+
+    Returns:
+      (HealthChecker): The health checker or None.
+    """
+    global _health_checker
+
+    options = getattr(settings, 'TETHYS_DATASETS_HEALTH_CHECK', None)
+
+    if options and _health_checker is None:
+        _health_checker = HealthChecker(interval=options.get('INTERVAL', 30), timeout=options.get('TIMEOUT', 5))
+        _health_checker.start()
+
+    return _health_checker
@@ -0,0 +1,441 @@
+"""
+Background jobs for long uploads to dataset services.
+
+Uploading a large file blocks the thread that makes the engine call for the whole transfer. Instead of calling the
+engine in a view, submit a job and answer right away with its status URL:
+
+    from tethys_datasets.jobs import submit_job
+
+    job = submit_job('ckan', 'upload_resource', dataset_id='rainfall', path='/data/rainfall.nc', name='Rainfall')
+    job = submit_job('geoserver', 'create_shapefile_resource', spatial=True, store_id='topp:roads',
+                     shapefile_zip='/data/roads.zip', overwrite=True)
+
+Jobs are stored in the database (DatasetJob) and run by a pool of worker threads, which can run in the web processes or
+in a separate process (python manage.py run_dataset_jobs). Any number of pools can share the queue: a job is claimed
+with a single conditional UPDATE, so it runs only once. At most job_concurrency jobs of a service run at the same time
+across all pools: a pool counts the running jobs of a service and claims its job while holding a lock on the row of the
+service (SELECT ... FOR UPDATE, which SQLite does without by locking the whole database). Jobs of update_* methods that
+raise an exception or get no parseable response from the service are retried with exponential backoff. Jobs of other
+methods, which create objects, are only retried when the connection to the service could not be made, since the service
+may have created the object even if its response was lost. Responses with 'success' set to False are final. Running
+update_* jobs whose pool stopped sending heartbeats are queued again, unless they used up their attempts; running jobs
+of other methods fail.
+
+The status of a job (see tethys_datasets.views.job_status) is shown to the user who submitted it and to staff users:
+
+    job = submit_job('ckan', 'upload_resource', owner=request.user, dataset_id='rainfall', path=path)
+
+The pool of the web processes is configured in settings.py:
+
+    TETHYS_DATASETS_JOBS = {
+        'WORKERS': 4,
+        'POLL_INTERVAL': 1.0,
+        'AUTOSTART': True,
+    }
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DatasetJob, DatasetService, SpatialDatasetService
+from .registry import get_service_registry
+
+log = logging.getLogger(__name__)
+
+# Jobs of dataset services that call the streaming helpers of tethys_datasets.transfers, which report progress
+TRANSFER_METHODS = ('upload_resource', 'update_resource_file')
+
+# Other engine methods a job of a dataset service may call
+DATASET_METHODS = ('create_resource', 'update_resource')
+
+# Prefixes of the engine methods a job of a spatial dataset service may call
+SPATIAL_METHOD_PREFIXES = ('create_', 'update_')
+
+# Prefix of the job methods that can be called again after a call that may have reached the service
+IDEMPOTENT_PREFIX = 'update_'
+
+# Seconds between the heartbeats of a pool, and without heartbeat after which a running job is queued again
+HEARTBEAT_INTERVAL = 10
+STALE_AFTER = 60
+
+# Seconds between progress updates written to the database
+PROGRESS_INTERVAL = 0.5
+
+# Seconds before the first retry, doubled for every further retry
+RETRY_DELAY = 5
+
+
+def submit_job(service_name, method, spatial=False, max_attempts=3, owner=None, **kwargs):
+    """
+    Queue a job that calls a method on the engine of a site-wide dataset service.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      method (string): 'upload_resource' or 'update_resource_file' (see tethys_datasets.transfers), 'create_resource'
+        or 'update_resource' for dataset services, or any create_* or update_* engine method for spatial dataset
+        services.
+      spatial (bool, optional): The service is a spatial dataset service. Defaults to False.
+      max_attempts (int, optional): Number of times the job is tried. Defaults to 3.
+      owner (User, optional): User who may see the status of the job, besides staff users.
+      **kwargs: Keyword arguments of the method. They must be JSON serializable, so files are given by path.
+
+    Returns:
+      (DatasetJob): The queued job.
+    """
+    if spatial:
+        allowed = method.startswith(SPATIAL_METHOD_PREFIXES)
+    else:
+        allowed = method in TRANSFER_METHODS + DATASET_METHODS
+
+    if not allowed:
+        raise ValueError('Method "{0}" can not be run as a job.'.format(method))
+
+    # Anonymous users have no primary key
+    if owner is not None and owner.pk is None:
+        owner = None
+
+    job = DatasetJob.objects.create(service_name=service_name, spatial=spatial, method=method,
+                                    arguments=json.dumps(kwargs), max_attempts=max_attempts, owner=owner)
+
+    pool = _job_pool
+
+    if pool is not None:
+        pool.wake()
+
+    return job
+
+
+def get_job(job_id):
+    """
+    Get a job by its job_id, None if there is no such job.
+    """
+    return DatasetJob.objects.filter(job_id=job_id).first()
+
+
+def can_see_job(user, job):
+    """
+    Whether a user may see the status of a job: staff users and the user who submitted it may.
+    """
+    return user.is_staff or (job.owner_id is not None and job.owner_id == user.pk)
+
+
+def is_idempotent(method):
+    """
+    Whether calling a job method again after a call that may have reached the service is safe.
+    """
+    return method.startswith(IDEMPOTENT_PREFIX)
+
+
+def describe_job(job):
+    """
+    Describe the status and progress of a job.
+
+    Args:
+      job (DatasetJob): The job.
+
+    Returns:
+      (dict): JSON serializable description of the job.
+    """
+    percent = None
+
+    if job.status == DatasetJob.SUCCEEDED:
+        percent = 100.0
+    elif job.total:
+        percent = min(100.0, job.progress * 100.0 / job.total)
+
+    return {
+        'job_id': job.job_id,
+        'service': job.service_name,
+        'method': job.method,
+        'status': job.status,
+        'done': job.done,
+        'attempts': job.attempts,
+        'progress': job.progress,
+        'total': job.total,
+        'percent': percent,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error or None,
+    }
+
+
+class ProgressReporter(object):
+    """
+    Progress callback for the transfers of a job that writes the progress to the database at most every
+    PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, job, clock=time.time):
+        self.job = job
+        self._clock = clock
+        self._last_update = 0
+
+    def __call__(self, transferred, total):
+        now = self._clock()
+
+        if now - self._last_update < PROGRESS_INTERVAL and transferred != total:
+            return
+
+        self._last_update = now
+        DatasetJob.objects.filter(pk=self.job.pk).update(progress=transferred, total=total,
+                                                         heartbeat_at=timezone.now())
+
+
+def run_job(job, progress=None):
+    """
+    Make the engine call of a job.
+
+    Args:
+      job (DatasetJob): The job.
+      progress (callable, optional): Progress callback for the jobs of the streaming transfers.
+
+    Returns:
+      (dict): The response dictionary of the call.
+    """
+    from .utilities import get_dataset_engine, get_spatial_dataset_engine
+
+    kwargs = json.loads(job.arguments)
+
+    if job.spatial:
+        return getattr(get_spatial_dataset_engine(job.service_name), job.method)(**kwargs)
+
+    if job.method in TRANSFER_METHODS:
+        # Imported here because the transfers module pulls in requests
+        from . import transfers
+        return getattr(transfers, job.method)(job.service_name, progress=progress, **kwargs)
+
+    return getattr(get_dataset_engine(job.service_name), job.method)(**kwargs)
+
+
+def _json_result(response):
+    return json.dumps(response, default=repr)
+
+
+class JobWorkerPool(object):
+    """
+    Threads that claim queued jobs from the database and run them.
+    """
+
+    def __init__(self, workers=4, poll_interval=1.0):
+        """
+        Constructor
+
+        Args:
+          workers (int): Number of worker threads.
+          poll_interval (float): Seconds an idle worker waits before it looks for new jobs.
+        """
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.token = uuid.uuid4().hex
+        self._claim_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            self._start_thread(self._work, 'tethys_datasets-job-worker-{0}'.format(index))
+
+        self._start_thread(self._beat, 'tethys_datasets-job-heartbeat')
+        return self
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self, wait=False):
+        """
+        Stop the workers after their current jobs.
+        """
+        self._stopped.set()
+        self._wake.set()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def wake(self):
+        """
+        Let idle workers look for new jobs right away.
+        """
+        self._wake.set()
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                job = self.claim()
+
+                if job is None:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+                else:
+                    self.run(job)
+            except Exception:
+                log.exception('Dataset job worker failed.')
+                self._stopped.wait(self.poll_interval)
+            finally:
+                connection.close()
+
+    def _beat(self):
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                DatasetJob.objects.filter(status=DatasetJob.RUNNING, worker=self.token) \
+                    .update(heartbeat_at=timezone.now())
+            except Exception:
+                log.warning('Could not update the heartbeat of the dataset jobs.', exc_info=True)
+            finally:
+                connection.close()
+
+    @staticmethod
+    def _limit(job):
+        model = SpatialDatasetService if job.spatial else DatasetService
+        service = get_service_registry(model).get(job.service_name)
+        return service.job_concurrency if service is not None else None
+
+    def requeue_stale(self):
+        """
+        Queue the running update_* jobs of pools that stopped sending heartbeats again. Jobs that used up their attempts
+        fail, and so do the jobs of other methods, which may have created their object before the pool stopped.
+
+        Returns:
+          (int): Number of jobs queued again.
+        """
+        now = timezone.now()
+        stale = DatasetJob.objects.filter(status=DatasetJob.RUNNING,
+                                          heartbeat_at__lt=now - timedelta(seconds=STALE_AFTER))
+        error = 'The worker running the job stopped sending heartbeats.'
+        stale.filter(attempts__gte=F('max_attempts')).update(status=DatasetJob.FAILED, worker='', finished_at=now,
+                                                             error=error)
+        stale.exclude(method__startswith=IDEMPOTENT_PREFIX).update(status=DatasetJob.FAILED, worker='',
+                                                                   finished_at=now, error=error)
+        return stale.update(status=DatasetJob.QUEUED, worker='')
+
+    def claim(self):
+        """
+        Claim the oldest queued job whose service has not reached its concurrency limit.
+
+        Returns:
+          (DatasetJob): The claimed job, now running, or None if no job can run.
+        """
+        with self._claim_lock:
+            now = timezone.now()
+            self.requeue_stale()
+            running = Counter(DatasetJob.objects.filter(status=DatasetJob.RUNNING).values_list('spatial',
+                                                                                               'service_name'))
+            candidates = DatasetJob.objects.filter(status=DatasetJob.QUEUED, run_after__lte=now) \
+                .order_by('run_after', 'id')[:50]
+
+            for job in candidates:
+                limit = self._limit(job)
+
+                if limit is None:
+                    self._finish(job, DatasetJob.FAILED, worker='',
+                                 error='No dataset service named "{0}".'.format(job.service_name))
+                    continue
+
+                if running[(job.spatial, job.service_name)] >= limit:
+                    continue
+
+                if self._claim_job(job, limit, now):
+                    return DatasetJob.objects.get(pk=job.pk)
+
+        return None
+
+    def _claim_job(self, job, limit, now):
+        model = SpatialDatasetService if job.spatial else DatasetService
+
+        with transaction.atomic():
+            # Pools in other processes claiming jobs of the service wait for the lock on its row, so they count the jobs
+            # claimed here
+            list(model.objects.select_for_update().filter(name=job.service_name).values_list('pk', flat=True))
+
+            if DatasetJob.objects.filter(status=DatasetJob.RUNNING, spatial=job.spatial,
+                                         service_name=job.service_name).count() >= limit:
+                return False
+
+            # Only one pool wins the job, whichever process it runs in
+            return DatasetJob.objects.filter(pk=job.pk, status=DatasetJob.QUEUED).update(
+                status=DatasetJob.RUNNING, worker=self.token, attempts=F('attempts') + 1, started_at=now,
+                heartbeat_at=now) > 0
+
+    def _finish(self, job, status, worker=None, **fields):
+        fields.update(status=status, finished_at=timezone.now())
+        return DatasetJob.objects.filter(pk=job.pk, worker=self.token if worker is None else worker).update(**fields)
+
+    def run(self, job):
+        """
+        Run a claimed job and record its outcome.
+        """
+        try:
+            response = run_job(job, ProgressReporter(job))
+            error = None
+        except Exception as e:
+            log.warning('Dataset job %s failed.', job.job_id, exc_info=True)
+            response, error = None, e
+
+        if response is not None:
+            if isinstance(response, dict) and response.get('success') is False:
+                self._finish(job, DatasetJob.FAILED, result=_json_result(response),
+                             error=u'{0}'.format(response.get('error') or 'The service did not succeed.'))
+            else:
+                self._finish(job, DatasetJob.SUCCEEDED, result=_json_result(response), error='')
+
+            return
+
+        # Imported here because the bulk module pulls in requests
+        from .bulk import is_connection_error
+
+        message = u'{0}'.format(error) if error is not None else 'The response of the service could not be parsed.'
+        retry = is_idempotent(job.method) or (error is not None and is_connection_error(error))
+
+        if retry and job.attempts < job.max_attempts:
+            run_after = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+            DatasetJob.objects.filter(pk=job.pk, worker=self.token).update(status=DatasetJob.QUEUED, worker='',
+                                                                           run_after=run_after, error=message)
+        else:
+            self._finish(job, DatasetJob.FAILED, error=message)
+
+
+_job_pool = None
+_job_pool_lock = threading.Lock()
+
+
+def start_job_workers(workers=None, poll_interval=None):
+    """
+    Start the process-wide job worker pool, sized by the TETHYS_DATASETS_JOBS setting unless given.
+
+    Returns:
+      (JobWorkerPool): The running pool.
+    """
+    global _job_pool
+
+    options = getattr(settings, 'TETHYS_DATASETS_JOBS', {})
+
+    with _job_pool_lock:
+        if _job_pool is None:
+            _job_pool = JobWorkerPool(workers=workers or options.get('WORKERS', 4),
+                                      poll_interval=poll_interval or options.get('POLL_INTERVAL', 1.0)).start()
+
+    return _job_pool
+
+
+def stop_job_workers(wait=False):
+    """
+    Stop the process-wide job worker pool.
+    """
+    global _job_pool
+
+    with _job_pool_lock:
+        if _job_pool is not None:
+            _job_pool.stop(wait=wait)
+            _job_pool = None
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from tethys_datasets.catalog import harvest, harvest_all
+
+
+class Command(BaseCommand):
+    help = 'Copy the metadata of dataset service catalogs into the local search index.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('service_names', nargs='*',
+                            help='Names of the dataset services to harvest. Defaults to all services with the local '
+                                 'search index enabled.')
+        parser.add_argument('--full', action='store_true', default=False,
+                            help='Fetch all datasets instead of the ones modified since the last harvest.')
+
+    def handle(self, *args, **options):
+        if options['service_names']:
+            results = [harvest(name, full=options['full']) for name in options['service_names']]
+        else:
+            results = harvest_all(full=options['full'])
+
+        for result in results:
+            self.stdout.write('{0}: {1} updated, {2} deleted'.format(result.service_name, result.updated,
+                                                                     result.deleted))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tethys_datasets.jobs import start_job_workers, stop_job_workers
+
+
+class Command(BaseCommand):
+    help = 'Run the background jobs of the dataset services until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Number of jobs to run at the same time. Defaults to the TETHYS_DATASETS_JOBS setting.')
+
+    def handle(self, *args, **options):
+        pool = start_job_workers(workers=options['workers'])
+        self.stdout.write('Running dataset jobs with {0} workers.'.format(pool.workers))
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after the running jobs.')
+            stop_job_workers(wait=True)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from tethys_datasets.sync import sync_all, sync_catalog
+
+
+class Command(BaseCommand):
+    help = 'Find the datasets of dataset services that changed since the last sync and send catalog_changed signals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('service_names', nargs='*',
+                            help='Names of the dataset services to sync. Defaults to all CKAN services.')
+        parser.add_argument('--full', action='store_true', default=False,
+                            help='Fetch all datasets instead of the ones modified since the last sync.')
+
+    def handle(self, *args, **options):
+        if options['service_names']:
+            results = [sync_catalog(name, full=options['full']) for name in options['service_names']]
+        else:
+            results = sync_all(full=options['full'])
+
+        for result in results:
+            self.stdout.write('{0}: {1} fetched, {2} added, {3} updated, {4} deleted'.format(
+                result.service_name, result.fetched, result.added, result.updated, result.deleted))
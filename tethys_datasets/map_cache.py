@@ -0,0 +1,493 @@
+"""
+Disk cache of the map responses of GeoServer spatial dataset services.
+
+The map proxy view (see tethys_datasets.views.map_proxy) passes WMS, WFS and tile requests to the GeoServer of a
+site-wide spatial dataset service. When the cache is enabled, successful responses are stored on local disk and later
+requests with the same parameters are answered from the stored files. The least recently used files are evicted when
+the cache grows beyond MAX_SIZE bytes, and files older than TIMEOUT seconds are fetched again.
+
+Files are kept in one directory per service and set of requested layers. Any create_*, update_* or delete_* call made
+through an engine of the service removes the directories of the layers it changes, or of the whole service when the
+changed layers can not be told from the call. Layer groups are cached under their own name, so changes to the layers
+of a group only reach the cached group after TIMEOUT seconds.
+
+The cache is enabled by giving a location in settings.py:
+
+    TETHYS_DATASETS_MAP_CACHE = {
+        'LOCATION': '/var/cache/tethys_datasets/maps',
+        'MAX_SIZE': 1024 ** 3,
+        'TIMEOUT': 24 * 3600,
+    }
+
+Cached files are served with FileResponse, which lets the WSGI server send them with sendfile. Behind nginx, an internal
+location that aliases LOCATION can serve them instead when ACCEL_REDIRECT gives its URL prefix.
+"""
+import errno
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+
+try:
+    from urllib.parse import quote, unquote, urlsplit
+except ImportError:
+    from urllib import quote, unquote
+    from urlparse import urlsplit
+
+log = logging.getLogger(__name__)
+
+# Query parameters that name the layers of OGC requests, lower case
+LAYER_PARAMETERS = ('layers', 'layer', 'query_layers', 'typename', 'typenames')
+
+# Argument that names the changed layer of the GeoServer engine methods that change a single layer
+LAYER_ARGUMENTS = {
+    'update_layer': 'layer_id',
+    'update_layer_styles': 'layer_id',
+    'delete_layer': 'layer_id',
+    'update_resource': 'resource_id',
+    'delete_resource': 'resource_id',
+    'create_layer_group': 'layer_group_id',
+    'update_layer_group': 'layer_group_id',
+    'delete_layer_group': 'layer_group_id',
+}
+
+# Directory of the responses that do not name any layer (e.g.: GetCapabilities), removed on every change
+SERVICE_DIRECTORY = '_service'
+
+# Directory of the responses that name too many layers for a directory name, removed on every change
+MANY_LAYERS_DIRECTORY = '_many'
+
+MAX_DIRECTORY_NAME = 200
+
+CHUNK_SIZE = 64 * 1024
+
+# Paths of the OGC services of GeoServer, optionally of a workspace (other than rest, the REST API), and of the WMS,
+# WMTS and TMS tile services of GeoWebCache, the only parts of GeoServer the map proxy passes requests to
+MAP_SERVICE_PATH = re.compile(r'(?:(?!rest/)(?:[\w-][\w.-]*/)?(?:wms|wfs|ows)'
+                              r'|gwc/service/(?:wms|wmts|tms)(?:/[\w.@:,+~-]+)*)\Z')
+
+
+def geoserver_root(endpoint):
+    """
+    Get the root URL of a GeoServer from the endpoint of its REST API (e.g.: 'http://host/geoserver' for
+    'http://host/geoserver/rest/').
+    """
+    root = endpoint.rstrip('/')
+    return root[:-len('/rest')] if root.endswith('/rest') else root
+
+
+def map_service_url(endpoint, path):
+    """
+    Get the URL of GeoServer that a map proxy request goes to.
+
+    Args:
+      endpoint (string): The endpoint of the REST API of the GeoServer.
+      path (string): The path requested from the map proxy, e.g. 'topp/wms' or 'gwc/service/wmts'.
+
+    Returns:
+      (string): The URL, None if path is not a path of the map services. Paths with empty, '.' or '..' segments or
+        with percent-encoded characters are refused, so requests can not reach other parts of GeoServer such as its
+        REST API.
+    """
+    if any(segment in ('', '.', '..') for segment in path.split('/')) or not MAP_SERVICE_PATH.match(path):
+        return None
+
+    root = geoserver_root(endpoint)
+    url = '{0}/{1}'.format(root, path)
+
+    # Checked again on the normalized URL, in case the root itself is not normalized
+    normalized = posixpath.normpath(urlsplit(url).path)
+    relative = normalized[len(posixpath.normpath(urlsplit(root).path or '/')):].lstrip('/')
+
+    if normalized != urlsplit(url).path or not MAP_SERVICE_PATH.match(relative):
+        return None
+
+    return url
+
+
+def layer_name(identifier):
+    """
+    Name of a layer without its workspace (e.g.: 'roads' for 'topp:roads').
+    """
+    return identifier.rsplit(':', 1)[-1]
+
+
+def request_layers(path, params):
+    """
+    Get the names of the layers a map request is for.
+
+    Args:
+      path (string): Path of the request below the GeoServer root (e.g.: 'wms' or 'gwc/service/tms/1.0.0/...').
+      params (dict): Query parameters of the request.
+
+    Returns:
+      (list): Sorted layer names without workspaces.
+    """
+    names = set()
+
+    for key, value in params.items():
+        if key.lower() in LAYER_PARAMETERS:
+            names.update(layer_name(name) for name in value.split(',') if name)
+
+    # TMS tiles name the layer in the path: gwc/service/tms/1.0.0/<layer>@<grid>@<format>/<z>/<x>/<y>.<format>
+    parts = path.split('/')
+
+    if parts[:3] == ['gwc', 'service', 'tms'] and len(parts) > 4:
+        names.add(layer_name(parts[4].split('@')[0]))
+
+    return sorted(names)
+
+
+def layers_directory(layers):
+    """
+    Name of the directory that holds the responses for a set of layers.
+    """
+    if not layers:
+        return SERVICE_DIRECTORY
+
+    name = quote(','.join(layers), safe='')
+    return name if len(name) <= MAX_DIRECTORY_NAME else MANY_LAYERS_DIRECTORY
+
+
+class MapCacheEntry(object):
+    """
+    A cached response, open for reading.
+    """
+
+    def __init__(self, path, relative_path, content_type, size, file_object):
+        self.path = path
+        self.relative_path = relative_path
+        self.content_type = content_type
+        self.size = size
+        self.file = file_object
+
+
+class MapCache(object):
+    """
+    Size-bounded LRU store of map responses on local disk.
+    """
+
+    def __init__(self, location, max_size=1024 ** 3, timeout=24 * 3600, max_entry_size=None, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          location (string): Directory of the cache. Created if missing.
+          max_size (int): Maximum total size of the cached responses in bytes. The least recently used responses are
+            evicted first.
+          timeout (int): Seconds a response is served from the cache. 0 or None to keep responses until evicted.
+          max_entry_size (int, optional): Larger responses are not cached. Defaults to a sixteenth of max_size.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.location = location
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_entry_size = max_entry_size if max_entry_size is not None else max_size // 16
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = None
+        self._size = 0
+
+    @property
+    def size(self):
+        """
+        Total size of the cached responses in bytes, as known to this process.
+        """
+        return self._size
+
+    @staticmethod
+    def key(service, path, params):
+        """
+        Key of a map request. Parameter order and the case of parameter names do not change the key, as for OGC
+        services.
+        """
+        normalized = sorted((name.lower(), value) for name, value in params.items())
+        return hashlib.sha1(json.dumps([service, path, normalized]).encode('utf-8')).hexdigest()
+
+    def _relative_path(self, service, layers, key):
+        return os.path.join(quote(service, safe=''), layers_directory(layers), key[:2], key)
+
+    def _load(self):
+        """
+        Index the files already in the cache, least recently modified first. Must be called with the lock held.
+        """
+        if self._entries is not None:
+            return
+
+        found = []
+
+        for directory, subdirectories, files in os.walk(self.location):
+            # Skip the directories being removed by invalidate
+            subdirectories[:] = [name for name in subdirectories if not name.startswith('.')]
+
+            for name in files:
+                if name.endswith('.json') or name.startswith('.'):
+                    continue
+
+                path = os.path.join(directory, name)
+
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                found.append((stat.st_mtime, path, stat.st_size))
+
+        self._entries = OrderedDict()
+        self._size = 0
+
+        for _, path, size in sorted(found):
+            self._entries[path] = size
+            self._size += size
+
+    def get(self, service, path, params):
+        """
+        Open the cached response of a map request.
+
+        Args:
+          service (string): Name of the spatial dataset service.
+          path (string): Path of the request below the GeoServer root.
+          params (dict): Query parameters of the request.
+
+        Returns:
+          (MapCacheEntry): The open response, None if it is not cached. The caller must close its file.
+        """
+        relative_path = self._relative_path(service, request_layers(path, params), self.key(service, path, params))
+        full_path = os.path.join(self.location, relative_path)
+
+        try:
+            file_object = open(full_path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            stat = os.fstat(file_object.fileno())
+
+            if self.timeout and self._clock() - stat.st_mtime >= self.timeout:
+                file_object.close()
+                return None
+
+            with open(full_path + '.json') as f:
+                content_type = json.load(f)['content_type']
+        except (IOError, OSError, ValueError, KeyError):
+            file_object.close()
+            return None
+
+        with self._lock:
+            self._load()
+
+            # Mark as most recently used. Responses stored by other processes join the index on their first hit.
+            size = self._entries.pop(full_path, None)
+
+            if size is None:
+                self._size += stat.st_size
+
+            self._entries[full_path] = stat.st_size
+
+        return MapCacheEntry(full_path, relative_path, content_type, stat.st_size, file_object)
+
+    def set(self, service, path, params, content_type, chunks):
+        """
+        Store the response of a map request.
+
+        Args:
+          service (string): Name of the spatial dataset service.
+          path (string): Path of the request below the GeoServer root.
+          params (dict): Query parameters of the request.
+          content_type (string): Content type of the response.
+          chunks (iterable): The body of the response as byte strings.
+
+        Returns:
+          (MapCacheEntry): The stored response, open for reading. Responses larger than max_entry_size are not kept
+            in the cache, but can still be read from the returned file until it is closed.
+        """
+        relative_path = self._relative_path(service, request_layers(path, params), self.key(service, path, params))
+        full_path = os.path.join(self.location, relative_path)
+        directory = os.path.dirname(full_path)
+
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        size = 0
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.')
+        file_object = os.fdopen(descriptor, 'w+b')
+
+        try:
+            for chunk in chunks:
+                file_object.write(chunk)
+                size += len(chunk)
+
+            file_object.flush()
+            file_object.seek(0)
+
+            if size > self.max_entry_size:
+                os.remove(temporary_path)
+                return MapCacheEntry(None, None, content_type, size, file_object)
+
+            with open(full_path + '.json', 'w') as f:
+                json.dump({'content_type': content_type}, f)
+
+            # Readers never see a partly written response
+            os.rename(temporary_path, full_path)
+        except BaseException:
+            file_object.close()
+
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+            raise
+
+        with self._lock:
+            self._load()
+            self._size += size - self._entries.pop(full_path, 0)
+            self._entries[full_path] = size
+            self._evict()
+
+        return MapCacheEntry(full_path, relative_path, content_type, size, file_object)
+
+    def _evict(self):
+        """
+        Remove the least recently used responses until the cache fits max_size. Must be called with the lock held.
+        """
+        while self._size > self.max_size and self._entries:
+            path, size = self._entries.popitem(last=False)
+            self._size -= size
+
+            for name in (path, path + '.json'):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+
+    def invalidate(self, service, layers=None):
+        """
+        Remove the cached responses of a service.
+
+        Args:
+          service (string): Name of the spatial dataset service.
+          layers (list, optional): Only remove the responses for these layers. Defaults to all responses.
+        """
+        service_path = os.path.join(self.location, quote(service, safe=''))
+
+        if layers is None:
+            directories = [service_path]
+        else:
+            names = set(layer_name(layer) for layer in layers)
+
+            try:
+                listing = os.listdir(service_path)
+            except OSError:
+                return
+
+            directories = [os.path.join(service_path, directory) for directory in listing
+                           if directory in (SERVICE_DIRECTORY, MANY_LAYERS_DIRECTORY) or
+                           names.intersection(unquote(directory).split(','))]
+
+        for directory in directories:
+            # Move the directory out of the way first, so requests never read from a half removed directory
+            trash = os.path.join(self.location, '.trash-{0}'.format(uuid.uuid4().hex))
+
+            try:
+                os.rename(directory, trash)
+            except OSError:
+                continue
+
+            shutil.rmtree(trash, ignore_errors=True)
+
+            with self._lock:
+                if self._entries is not None:
+                    prefix = directory + os.sep
+
+                    for path in [p for p in self._entries if p.startswith(prefix)]:
+                        self._size -= self._entries.pop(path)
+
+    def clear(self):
+        """
+        Remove all cached responses.
+        """
+        with self._lock:
+            shutil.rmtree(self.location, ignore_errors=True)
+            self._entries = OrderedDict()
+            self._size = 0
+
+
+class MapCacheInvalidationLayer(object):
+    """
+    EngineProxy layer that removes the cached map responses of the layers changed by write calls.
+    """
+
+    def __init__(self, cache):
+        """
+        Constructor
+
+        Args:
+          cache (MapCache): The map cache.
+        """
+        self.cache = cache
+
+    @staticmethod
+    def changed_layers(call):
+        """
+        Get the layers changed by a write call, or None when they can not be told from the call.
+        """
+        argument = LAYER_ARGUMENTS.get(call.method)
+
+        if argument is None:
+            return None
+
+        identifier = call.kwargs.get(argument, call.args[0] if call.args else None)
+        return [identifier] if identifier else None
+
+    def __call__(self, call, proceed):
+        if not call.is_write:
+            return proceed()
+
+        try:
+            return proceed()
+        finally:
+            try:
+                self.cache.invalidate(call.service, self.changed_layers(call))
+            except Exception:
+                log.exception('Could not invalidate the map cache of service "%s".', call.service)
+
+
+_map_cache = None
+_map_cache_lock = threading.Lock()
+
+
+def get_map_cache():
+    """
+    Get the process-wide map cache configured with the TETHYS_DATASETS_MAP_CACHE setting.
+
+    Returns:
+      (MapCache): The map cache, None if the cache is disabled.
+    """
+    global _map_cache
+
+    options = getattr(settings, 'TETHYS_DATASETS_MAP_CACHE', None)
+
+    if not options or not options.get('LOCATION'):
+        return None
+
+    if _map_cache is None:
+        with _map_cache_lock:
+            if _map_cache is None:
+                _map_cache = MapCache(options['LOCATION'],
+                                      max_size=options.get('MAX_SIZE', 1024 ** 3),
+                                      timeout=options.get('TIMEOUT', 24 * 3600),
+                                      max_entry_size=options.get('MAX_ENTRY_SIZE'))
+
+    return _map_cache
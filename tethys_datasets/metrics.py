@@ -0,0 +1,340 @@
+"""
+Instrumentation of engine calls.
+
+When enabled, every call to an engine of a site-wide dataset service is timed and reported to the configured sinks
+with the number of bytes sent and received by the requests it made. A call counts as an error when it raises an
+exception or when the response of the service is missing or has 'success' set to False.
+
+Sinks are configured with the TETHYS_DATASETS_METRICS setting. Instrumentation is off when no sinks are configured:
+
+    TETHYS_DATASETS_METRICS = {
+        'SINKS': [
+            {'BACKEND': 'tethys_datasets.metrics.PrometheusSink'},
+            {'BACKEND': 'tethys_datasets.metrics.LogSink', 'OPTIONS': {'logger': 'tethys_datasets.metrics'}},
+        ],
+    }
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class CallSample(namedtuple('CallSample', ('service', 'method', 'duration', 'error', 'bytes_sent',
+                                          'bytes_received', 'coalesced'))):
+    """
+    Measurements of one engine call.
+
+    Attributes:
+      service (string): Name of the dataset service.
+      method (string): Name of the engine method.
+      duration (float): Duration of the call in seconds.
+      error (bool): True if the call failed.
+      bytes_sent (int): Bytes of the request bodies sent by the call.
+      bytes_received (int): Bytes of the response bodies received by the call.
+      coalesced (bool): True if the result was shared from an identical call in flight (see tethys_datasets.coalescing).
+    """
+
+    def __new__(cls, service, method, duration, error, bytes_sent, bytes_received, coalesced=False):
+        return super(CallSample, cls).__new__(cls, service, method, duration, error, bytes_sent, bytes_received,
+                                              coalesced)
+
+
+class MethodStats(object):
+    """
+    Aggregated measurements of the calls to one method of one dataset service.
+    """
+
+    def __init__(self, service, method, buckets=DEFAULT_BUCKETS):
+        self.service = service
+        self.method = method
+        self.buckets = buckets
+        self.calls = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.total_duration = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        # The last bucket counts the calls slower than the largest bound
+        self.bucket_counts = [0] * (len(buckets) + 1)
+
+    def add(self, sample):
+        self.calls += 1
+        self.errors += int(sample.error)
+        self.coalesced += int(sample.coalesced)
+        self.total_duration += sample.duration
+        self.bytes_sent += sample.bytes_sent
+        self.bytes_received += sample.bytes_received
+        self.bucket_counts[bisect.bisect_left(self.buckets, sample.duration)] += 1
+
+    @property
+    def error_rate(self):
+        return float(self.errors) / self.calls if self.calls else 0.0
+
+    @property
+    def mean_duration(self):
+        return self.total_duration / self.calls if self.calls else 0.0
+
+    def quantile(self, fraction):
+        """
+        Estimate a latency quantile as the upper bound of the histogram bucket it falls in.
+
+        Args:
+          fraction (float): The quantile (e.g.: 0.95).
+
+        Returns:
+          (float): Latency in seconds, infinity if the quantile is beyond the largest bucket.
+        """
+        rank = fraction * self.calls
+        seen = 0
+
+        for bound, count in zip(self.buckets, self.bucket_counts):
+            seen += count
+
+            if seen >= rank:
+                return bound
+
+        return float('inf')
+
+    def copy(self):
+        stats = MethodStats(self.service, self.method, self.buckets)
+        stats.__dict__.update(self.__dict__, bucket_counts=list(self.bucket_counts))
+        return stats
+
+    def __repr__(self):
+        return '<MethodStats: service={0}, method={1}, calls={2}>'.format(self.service, self.method, self.calls)
+
+
+class BaseMetricsSink(object):
+    """
+    Base class for metrics sinks.
+    """
+
+    def record(self, sample):
+        """
+        Record the measurements of one engine call.
+
+        Args:
+          sample (CallSample): The measurements.
+        """
+        raise NotImplementedError()
+
+
+class LogSink(BaseMetricsSink):
+    """
+    Writes one log record per engine call.
+    """
+
+    def __init__(self, logger='tethys_datasets.metrics', level='DEBUG'):
+        """
+        Constructor
+
+        Args:
+          logger (string): Name of the logger.
+          level (string): Level of the log records.
+        """
+        self.logger = logging.getLogger(logger)
+        self.level = logging.getLevelName(level)
+
+    def record(self, sample):
+        self.logger.log(self.level, '%s.%s %.1f ms error=%s coalesced=%s sent=%d received=%d', sample.service,
+                        sample.method, sample.duration * 1000, sample.error, sample.coalesced, sample.bytes_sent,
+                        sample.bytes_received)
+
+
+class InMemorySink(BaseMetricsSink):
+    """
+    Aggregates the measurements per service and method in memory.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Constructor
+
+        Args:
+          buckets (tuple): Upper bounds of the latency histogram buckets in seconds, in increasing order.
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, sample):
+        key = (sample.service, sample.method)
+
+        with self._lock:
+            stats = self._stats.get(key)
+
+            if stats is None:
+                stats = self._stats[key] = MethodStats(sample.service, sample.method, self.buckets)
+
+            stats.add(sample)
+
+    def snapshot(self):
+        """
+        Get a copy of the aggregated measurements.
+
+        Returns:
+          (list): MethodStats objects sorted by service and method.
+        """
+        with self._lock:
+            return [self._stats[key].copy() for key in sorted(self._stats)]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class PrometheusSink(InMemorySink):
+    """
+    In-memory sink that can render the aggregated measurements in the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='tethys_datasets'):
+        """
+        Constructor
+
+        Args:
+          buckets (tuple): Upper bounds of the latency histogram buckets in seconds, in increasing order.
+          prefix (string): Prefix of the metric names.
+        """
+        super(PrometheusSink, self).__init__(buckets)
+        self.prefix = prefix
+
+    @staticmethod
+    def _labels(stats, **extra):
+        labels = [('service', stats.service), ('method', stats.method)] + sorted(extra.items())
+        return ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                        for name, value in labels)
+
+    def render(self):
+        """
+        Render the aggregated measurements.
+
+        Returns:
+          (string): The metrics in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            name = '{0}_{1}'.format(self.prefix, name)
+            lines.append('# HELP {0} {1}'.format(name, help_text))
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+
+            for suffix, labels, value in samples:
+                lines.append('{0}{1}{{{2}}} {3}'.format(name, suffix, labels, value))
+
+        histogram = []
+
+        for stats in snapshot:
+            cumulative = 0
+
+            for bound, count in zip(stats.buckets + ('+Inf',), stats.bucket_counts):
+                cumulative += count
+                histogram.append(('_bucket', self._labels(stats, le=bound), cumulative))
+
+            histogram.append(('_sum', self._labels(stats), repr(stats.total_duration)))
+            histogram.append(('_count', self._labels(stats), stats.calls))
+
+        family('call_duration_seconds', 'histogram', 'Duration of dataset engine calls.', histogram)
+        family('call_errors_total', 'counter', 'Failed dataset engine calls.',
+               [('', self._labels(stats), stats.errors) for stats in snapshot])
+        family('coalesced_calls_total', 'counter', 'Dataset engine calls answered by an identical call in flight.',
+               [('', self._labels(stats), stats.coalesced) for stats in snapshot])
+        family('sent_bytes_total', 'counter', 'Bytes of the request bodies sent by dataset engine calls.',
+               [('', self._labels(stats), stats.bytes_sent) for stats in snapshot])
+        family('received_bytes_total', 'counter', 'Bytes of the response bodies received by dataset engine calls.',
+               [('', self._labels(stats), stats.bytes_received) for stats in snapshot])
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsLayer(object):
+    """
+    EngineProxy layer that measures every call and reports it to the metrics sinks.
+    """
+
+    def __init__(self, sinks, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          sinks (list): The BaseMetricsSink objects to report to.
+          clock (callable): Function returning the current time in seconds.
+        """
+        # Imported here so that loading the settings of the sinks does not import requests
+        from .transport import track_transfers
+
+        self.sinks = sinks
+        self._clock = clock
+        self._track_transfers = track_transfers
+
+    def __call__(self, call, proceed):
+        error = True
+        start = self._clock()
+
+        with self._track_transfers() as counter:
+            try:
+                response = proceed()
+                error = not isinstance(response, dict) or response.get('success') is False
+                return response
+            finally:
+                sample = CallSample(call.service, call.method, self._clock() - start, error, counter.bytes_sent,
+                                    counter.bytes_received, call.coalesced)
+
+                for sink in self.sinks:
+                    try:
+                        sink.record(sample)
+                    except Exception:
+                        # Instrumentation must never break engine calls
+                        log.exception('Metrics sink %r failed.', sink)
+
+
+_sinks = None
+_sinks_lock = threading.Lock()
+
+
+def get_metrics_sinks():
+    """
+    Get the process-wide metrics sinks configured with the TETHYS_DATASETS_METRICS setting.
+
+    Returns:
+      (list): The BaseMetricsSink objects, empty if instrumentation is off.
+    """
+    global _sinks
+
+    if _sinks is None:
+        with _sinks_lock:
+            if _sinks is None:
+                options = getattr(settings, 'TETHYS_DATASETS_METRICS', {})
+                _sinks = [import_string(sink['BACKEND'])(**sink.get('OPTIONS', {}))
+                          for sink in options.get('SINKS', ())]
+
+    return _sinks
+
+
+def find_metrics_sink(sink_class=InMemorySink):
+    """
+    Get the first configured sink of a class.
+
+    Args:
+      sink_class (class, optional): The sink class. Defaults to InMemorySink, which includes its subclasses.
+
+    Returns:
+      (BaseMetricsSink): The sink or None.
+    """
+    for sink in get_metrics_sinks():
+        if isinstance(sink, sink_class):
+            return sink
+
+    return None
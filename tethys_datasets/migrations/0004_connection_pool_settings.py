@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethys_datasets', '0003_spatialdatasetservice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetservice',
+            name='pool_maxsize',
+            field=models.PositiveIntegerField(default=10, verbose_name=b'connection pool size'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='datasetservice',
+            name='max_retries',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='datasetservice',
+            name='retry_backoff',
+            field=models.FloatField(default=0.0, help_text=b'Backoff factor in seconds between retries.'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='pool_maxsize',
+            field=models.PositiveIntegerField(default=10, verbose_name=b'connection pool size'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='max_retries',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='retry_backoff',
+            field=models.FloatField(default=0.0, help_text=b'Backoff factor in seconds between retries.'),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethys_datasets', '0004_connection_pool_settings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetservice',
+            name='cache_ttl',
+            field=models.PositiveIntegerField(default=0, help_text=b'Seconds that read responses are cached. 0 disables caching.', verbose_name=b'cache TTL'),
+            preserve_default=True,
+        ),
+    ]
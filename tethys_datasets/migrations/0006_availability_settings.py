@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethys_datasets', '0005_datasetservice_cache_ttl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetservice',
+            name='mirrors',
+            field=models.TextField(help_text=b'Other endpoints serving the same catalog, one per line. Requests are routed to the healthiest endpoint.', blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='datasetservice',
+            name='failure_threshold',
+            field=models.PositiveIntegerField(default=5, help_text=b'Consecutive failures that open the circuit breaker of an endpoint. 0 disables it.'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='datasetservice',
+            name='breaker_cooldown',
+            field=models.PositiveIntegerField(default=30, help_text=b'Seconds before a request is let through to an endpoint with an open circuit breaker.', verbose_name=b'circuit breaker cooldown'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='mirrors',
+            field=models.TextField(help_text=b'Other endpoints serving the same catalog, one per line. Requests are routed to the healthiest endpoint.', blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='failure_threshold',
+            field=models.PositiveIntegerField(default=5, help_text=b'Consecutive failures that open the circuit breaker of an endpoint. 0 disables it.'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='breaker_cooldown',
+            field=models.PositiveIntegerField(default=30, help_text=b'Seconds before a request is let through to an endpoint with an open circuit breaker.', verbose_name=b'circuit breaker cooldown'),
+            preserve_default=True,
+        ),
+    ]
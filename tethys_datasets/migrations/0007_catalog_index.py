@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# Full-text indexes kept in sync with the catalog tables by triggers. Only created on SQLite, other databases fall back
+# to plain LIKE queries (see tethys_datasets.catalog).
+FTS_TABLES = (
+    ('tethys_datasets_catalogdataset', ('name', 'title', 'notes', 'tags', 'resource_text')),
+    ('tethys_datasets_catalogresource', ('name', 'description', 'format')),
+)
+
+
+def fts_statements(table, columns):
+    fts = table + '_fts'
+    names = ', '.join(columns)
+    new = ', '.join('new.' + column for column in columns)
+    old = ', '.join('old.' + column for column in columns)
+
+    return (
+        "CREATE VIRTUAL TABLE {fts} USING fts5({names}, content='{table}', content_rowid='id')",
+        "CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN "
+        "INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+        "CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+        "CREATE TRIGGER {fts}_update AFTER UPDATE ON {table} BEGIN "
+        "INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+        "INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+    ), dict(fts=fts, table=table, names=names, new=new, old=old)
+
+
+def create_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    cursor = schema_editor.connection.cursor()
+
+    for table, columns in FTS_TABLES:
+        statements, names = fts_statements(table, columns)
+
+        try:
+            cursor.execute(statements[0].format(**names))
+        except Exception:
+            # SQLite was built without FTS5
+            return
+
+        for statement in statements[1:]:
+            cursor.execute(statement.format(**names))
+
+
+def drop_fts_tables(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    cursor = schema_editor.connection.cursor()
+
+    for table, columns in FTS_TABLES:
+        fts = table + '_fts'
+
+        for suffix in ('_insert', '_delete', '_update'):
+            cursor.execute('DROP TRIGGER IF EXISTS {0}{1}'.format(fts, suffix))
+
+        cursor.execute('DROP TABLE IF EXISTS {0}'.format(fts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethys_datasets', '0006_availability_settings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetservice',
+            name='index_catalog',
+            field=models.BooleanField(default=False, help_text=b'Mirror the metadata of the catalog into a local search index.', verbose_name=b'local search index'),
+            preserve_default=True,
+        ),
+        migrations.CreateModel(
+            name='CatalogDataset',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('dataset_id', models.CharField(max_length=100)),
+                ('name', models.CharField(max_length=200)),
+                ('title', models.CharField(max_length=1024, blank=True)),
+                ('notes', models.TextField(blank=True)),
+                ('tags', models.TextField(blank=True)),
+                ('resource_text', models.TextField(blank=True)),
+                ('metadata_modified', models.CharField(db_index=True, max_length=50, blank=True)),
+                ('data', models.TextField()),
+                ('service', models.ForeignKey(related_name='catalog_datasets', on_delete=models.CASCADE, to='tethys_datasets.DatasetService')),
+            ],
+            options={
+                'verbose_name': 'Catalog Dataset',
+                'verbose_name_plural': 'Catalog Datasets',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='catalogdataset',
+            unique_together=set([('service', 'dataset_id')]),
+        ),
+        migrations.CreateModel(
+            name='CatalogResource',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('resource_id', models.CharField(max_length=100, db_index=True)),
+                ('name', models.CharField(max_length=1024, blank=True)),
+                ('description', models.TextField(blank=True)),
+                ('format', models.CharField(max_length=100, blank=True)),
+                ('url', models.TextField(blank=True)),
+                ('data', models.TextField()),
+                ('dataset', models.ForeignKey(related_name='resources', on_delete=models.CASCADE, to='tethys_datasets.CatalogDataset')),
+            ],
+            options={
+                'verbose_name': 'Catalog Resource',
+                'verbose_name_plural': 'Catalog Resources',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.RunPython(create_fts_tables, drop_fts_tables),
+    ]
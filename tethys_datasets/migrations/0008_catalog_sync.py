@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethys_datasets', '0007_catalog_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetSyncState',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('watermark', models.CharField(help_text=b'Newest metadata_modified time seen by the last sync.', max_length=50, blank=True)),
+                ('synced_at', models.DateTimeField(null=True, blank=True)),
+                ('service', models.OneToOneField(related_name='sync_state', on_delete=models.CASCADE, to='tethys_datasets.DatasetService')),
+            ],
+            options={
+                'verbose_name': 'Dataset Sync State',
+                'verbose_name_plural': 'Dataset Sync States',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='SyncedDataset',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('dataset_id', models.CharField(max_length=100)),
+                ('name', models.CharField(max_length=200)),
+                ('content_hash', models.CharField(max_length=40)),
+                ('metadata_modified', models.CharField(max_length=50, blank=True)),
+                ('service', models.ForeignKey(related_name='synced_datasets', on_delete=models.CASCADE, to='tethys_datasets.DatasetService')),
+            ],
+            options={
+                'verbose_name': 'Synced Dataset',
+                'verbose_name_plural': 'Synced Datasets',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='synceddataset',
+            unique_together=set([('service', 'dataset_id')]),
+        ),
+    ]
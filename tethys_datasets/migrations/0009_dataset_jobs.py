@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+import tethys_datasets.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethys_datasets', '0008_catalog_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetservice',
+            name='job_concurrency',
+            field=models.PositiveIntegerField(default=2, help_text=b'Background jobs of the service that may run at the same time.', verbose_name=b'concurrent jobs'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='job_concurrency',
+            field=models.PositiveIntegerField(default=2, help_text=b'Background jobs of the service that may run at the same time.', verbose_name=b'concurrent jobs'),
+            preserve_default=True,
+        ),
+        migrations.CreateModel(
+            name='DatasetJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('job_id', models.CharField(default=tethys_datasets.models.new_job_id, unique=True, max_length=32)),
+                ('service_name', models.CharField(max_length=30)),
+                ('spatial', models.BooleanField(default=False)),
+                ('method', models.CharField(max_length=100)),
+                ('arguments', models.TextField(default=b'{}')),
+                ('status', models.CharField(default=b'queued', max_length=10, db_index=True, choices=[(b'queued', b'Queued'), (b'running', b'Running'), (b'succeeded', b'Succeeded'), (b'failed', b'Failed')])),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('max_attempts', models.PositiveIntegerField(default=3)),
+                ('progress', models.BigIntegerField(default=0, help_text=b'Bytes transferred so far.')),
+                ('total', models.BigIntegerField(help_text=b'Bytes to transfer, if known.', null=True, blank=True)),
+                ('result', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('worker', models.CharField(max_length=32, blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(null=True, blank=True)),
+                ('heartbeat_at', models.DateTimeField(null=True, blank=True)),
+                ('finished_at', models.DateTimeField(null=True, blank=True)),
+            ],
+            options={
+                'verbose_name': 'Dataset Job',
+                'verbose_name_plural': 'Dataset Jobs',
+            },
+            bases=(models.Model,),
+        ),
+    ]
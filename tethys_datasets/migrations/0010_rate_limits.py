@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethys_datasets', '0009_dataset_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetservice',
+            name='rate_limit',
+            field=models.FloatField(default=0.0, help_text=b'Requests per second sent to the service. 0 disables rate limiting.'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='datasetservice',
+            name='rate_burst',
+            field=models.PositiveIntegerField(default=10, help_text=b'Requests that may be sent at once after an idle period.', verbose_name=b'rate limit burst'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='datasetservice',
+            name='max_concurrency',
+            field=models.PositiveIntegerField(default=0, help_text=b'Most requests in flight to the service. The limit is lowered while the service is slow or throttles requests. 0 disables it.', verbose_name=b'concurrent requests'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='rate_limit',
+            field=models.FloatField(default=0.0, help_text=b'Requests per second sent to the service. 0 disables rate limiting.'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='rate_burst',
+            field=models.PositiveIntegerField(default=10, help_text=b'Requests that may be sent at once after an idle period.', verbose_name=b'rate limit burst'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='max_concurrency',
+            field=models.PositiveIntegerField(default=0, help_text=b'Most requests in flight to the service. The limit is lowered while the service is slow or throttles requests. 0 disables it.', verbose_name=b'concurrent requests'),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethys_datasets', '0010_rate_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetservice',
+            name='profile_rate',
+            field=models.FloatField(default=0.0, help_text=b'Share of the calls to the service profiled with cProfile, from 0 to 1. 0 disables profiling.', verbose_name=b'profiling sample rate'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='spatialdatasetservice',
+            name='profile_rate',
+            field=models.FloatField(default=0.0, help_text=b'Share of the calls to the service profiled with cProfile, from 0 to 1. 0 disables profiling.', verbose_name=b'profiling sample rate'),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('tethys_datasets', '0011_profile_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasetjob',
+            name='owner',
+            field=models.ForeignKey(related_name='dataset_jobs', on_delete=django.db.models.deletion.SET_NULL, blank=True, to=settings.AUTH_USER_MODEL, help_text=b'User who may see the status of the job.', null=True),
+            preserve_default=True,
+        ),
+    ]
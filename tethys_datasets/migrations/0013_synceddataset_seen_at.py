@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tethys_datasets', '0012_datasetjob_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='synceddataset',
+            name='seen_at',
+            field=models.DateTimeField(help_text=b'Start of the last sync that fetched the dataset.', null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
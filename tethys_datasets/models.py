@@ -1,4 +1,8 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from tethys_dataset_services.valid_engines import VALID_ENGINES, VALID_SPATIAL_ENGINES
 
 
@@ -23,6 +27,34 @@ class DatasetService(models.Model):
     apikey = models.CharField(max_length=100, blank=True)
     username = models.CharField(max_length=100, blank=True)
     password = models.CharField(max_length=100, blank=True)
+    pool_maxsize = models.PositiveIntegerField('connection pool size', default=10)
+    max_retries = models.PositiveIntegerField(default=0)
+    retry_backoff = models.FloatField(default=0.0, help_text='Backoff factor in seconds between retries.')
+    cache_ttl = models.PositiveIntegerField('cache TTL', default=0,
+                                            help_text='Seconds that read responses are cached. 0 disables caching.')
+    index_catalog = models.BooleanField('local search index', default=False,
+                                        help_text='Mirror the metadata of the catalog into a local search index.')
+    mirrors = models.TextField(blank=True, help_text='Other endpoints serving the same catalog, one per line. Requests '
+                                                     'are routed to the healthiest endpoint.')
+    failure_threshold = models.PositiveIntegerField(default=5, help_text='Consecutive failures that open the circuit '
+                                                                         'breaker of an endpoint. 0 disables it.')
+    breaker_cooldown = models.PositiveIntegerField('circuit breaker cooldown', default=30,
+                                                   help_text='Seconds before a request is let through to an endpoint '
+                                                             'with an open circuit breaker.')
+    job_concurrency = models.PositiveIntegerField('concurrent jobs', default=2,
+                                                  help_text='Background jobs of the service that may run at the same '
+                                                            'time.')
+    rate_limit = models.FloatField(default=0.0, help_text='Requests per second sent to the service. 0 disables rate '
+                                                          'limiting.')
+    rate_burst = models.PositiveIntegerField('rate limit burst', default=10,
+                                             help_text='Requests that may be sent at once after an idle period.')
+    max_concurrency = models.PositiveIntegerField('concurrent requests', default=0,
+                                                  help_text='Most requests in flight to the service. The limit is '
+                                                            'lowered while the service is slow or throttles requests. '
+                                                            '0 disables it.')
+    profile_rate = models.FloatField('profiling sample rate', default=0.0,
+                                     help_text='Share of the calls to the service profiled with cProfile, from 0 to '
+                                               '1. 0 disables profiling.')
 
     class Meta:
         verbose_name = 'Dataset Service'
@@ -48,6 +80,30 @@ class SpatialDatasetService(models.Model):
     apikey = models.CharField(max_length=100, blank=True)
     username = models.CharField(max_length=100, blank=True)
     password = models.CharField(max_length=100, blank=True)
+    pool_maxsize = models.PositiveIntegerField('connection pool size', default=10)
+    max_retries = models.PositiveIntegerField(default=0)
+    retry_backoff = models.FloatField(default=0.0, help_text='Backoff factor in seconds between retries.')
+    mirrors = models.TextField(blank=True, help_text='Other endpoints serving the same catalog, one per line. Requests '
+                                                     'are routed to the healthiest endpoint.')
+    failure_threshold = models.PositiveIntegerField(default=5, help_text='Consecutive failures that open the circuit '
+                                                                         'breaker of an endpoint. 0 disables it.')
+    breaker_cooldown = models.PositiveIntegerField('circuit breaker cooldown', default=30,
+                                                   help_text='Seconds before a request is let through to an endpoint '
+                                                             'with an open circuit breaker.')
+    job_concurrency = models.PositiveIntegerField('concurrent jobs', default=2,
+                                                  help_text='Background jobs of the service that may run at the same '
+                                                            'time.')
+    rate_limit = models.FloatField(default=0.0, help_text='Requests per second sent to the service. 0 disables rate '
+                                                          'limiting.')
+    rate_burst = models.PositiveIntegerField('rate limit burst', default=10,
+                                             help_text='Requests that may be sent at once after an idle period.')
+    max_concurrency = models.PositiveIntegerField('concurrent requests', default=0,
+                                                  help_text='Most requests in flight to the service. The limit is '
+                                                            'lowered while the service is slow or throttles requests. '
+                                                            '0 disables it.')
+    profile_rate = models.FloatField('profiling sample rate', default=0.0,
+                                     help_text='Share of the calls to the service profiled with cProfile, from 0 to '
+                                               '1. 0 disables profiling.')
 
     class Meta:
         verbose_name = 'Spatial Dataset Service'
@@ -55,3 +111,146 @@ class SpatialDatasetService(models.Model):
 
     def __unicode__(self):
         return self.name
+
+
+class CatalogDataset(models.Model):
+    """
+    ORM for the local copy of the metadata of a dataset of a Dataset Service (see tethys_datasets.catalog).
+    """
+    service = models.ForeignKey(DatasetService, related_name='catalog_datasets', on_delete=models.CASCADE)
+    dataset_id = models.CharField(max_length=100)
+    name = models.CharField(max_length=200)
+    title = models.CharField(max_length=1024, blank=True)
+    notes = models.TextField(blank=True)
+    tags = models.TextField(blank=True)
+    resource_text = models.TextField(blank=True)
+    metadata_modified = models.CharField(max_length=50, blank=True, db_index=True)
+    data = models.TextField()
+
+    class Meta:
+        verbose_name = 'Catalog Dataset'
+        verbose_name_plural = 'Catalog Datasets'
+        unique_together = ('service', 'dataset_id')
+
+    def __unicode__(self):
+        return self.name
+
+
+class CatalogResource(models.Model):
+    """
+    ORM for the local copy of the metadata of a resource of a Dataset Service (see tethys_datasets.catalog).
+    """
+    dataset = models.ForeignKey(CatalogDataset, related_name='resources', on_delete=models.CASCADE)
+    resource_id = models.CharField(max_length=100, db_index=True)
+    name = models.CharField(max_length=1024, blank=True)
+    description = models.TextField(blank=True)
+    format = models.CharField(max_length=100, blank=True)
+    url = models.TextField(blank=True)
+    data = models.TextField()
+
+    class Meta:
+        verbose_name = 'Catalog Resource'
+        verbose_name_plural = 'Catalog Resources'
+
+    def __unicode__(self):
+        return self.name
+
+
+class DatasetSyncState(models.Model):
+    """
+    ORM for the progress of the catalog sync of a Dataset Service (see tethys_datasets.sync).
+    """
+    service = models.OneToOneField(DatasetService, related_name='sync_state', on_delete=models.CASCADE)
+    watermark = models.CharField(max_length=50, blank=True,
+                                 help_text='Newest metadata_modified time seen by the last sync.')
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Dataset Sync State'
+        verbose_name_plural = 'Dataset Sync States'
+
+    def __unicode__(self):
+        return self.service.name
+
+
+class SyncedDataset(models.Model):
+    """
+    ORM for the last known version of a dataset of a Dataset Service (see tethys_datasets.sync).
+    """
+    service = models.ForeignKey(DatasetService, related_name='synced_datasets', on_delete=models.CASCADE)
+    dataset_id = models.CharField(max_length=100)
+    name = models.CharField(max_length=200)
+    content_hash = models.CharField(max_length=40)
+    metadata_modified = models.CharField(max_length=50, blank=True)
+    seen_at = models.DateTimeField(null=True, blank=True, help_text='Start of the last sync that fetched the dataset.')
+
+    class Meta:
+        verbose_name = 'Synced Dataset'
+        verbose_name_plural = 'Synced Datasets'
+        unique_together = ('service', 'dataset_id')
+
+    def __unicode__(self):
+        return self.name
+
+
+def truncate_to_field(model, field_name, value):
+    """
+    Cut a string value of a dataset service down to the max_length of a CharField, e.g. a long title, which would
+    otherwise fail to save on databases that enforce the length. None becomes an empty string.
+    """
+    max_length = model._meta.get_field(field_name).max_length
+    value = value or ''
+    return value[:max_length] if max_length else value
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+class DatasetJob(models.Model):
+    """
+    ORM for a background job, such as a long upload, run by the job workers (see tethys_datasets.jobs).
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    job_id = models.CharField(max_length=32, unique=True, default=new_job_id)
+    service_name = models.CharField(max_length=30)
+    spatial = models.BooleanField(default=False)
+    method = models.CharField(max_length=100)
+    arguments = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    progress = models.BigIntegerField(default=0, help_text='Bytes transferred so far.')
+    total = models.BigIntegerField(null=True, blank=True, help_text='Bytes to transfer, if known.')
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=32, blank=True)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, related_name='dataset_jobs',
+                              on_delete=models.SET_NULL, help_text='User who may see the status of the job.')
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Dataset Job'
+        verbose_name_plural = 'Dataset Jobs'
+
+    @property
+    def done(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    def __unicode__(self):
+        return self.job_id
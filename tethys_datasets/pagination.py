@@ -0,0 +1,143 @@
+"""
+Generators that walk through the datasets of a service one page at a time, so memory use does not grow with the size
+of the catalog. While the items of one page are consumed, the next page can be fetched in the background.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from .exceptions import DatasetServiceError
+from .utilities import get_dataset_engine
+
+# Most items a page can hold, the rows limit of CKAN searches (ckan.search.rows_max). Larger page sizes are lowered to it,
+# since the service would return shorter pages than requested.
+MAX_PAGE_SIZE = 1000
+
+
+def get_result(response, method):
+    """
+    Get the result of an engine response, raising DatasetServiceError if the call did not succeed.
+
+    Args:
+      response (dict): Response dictionary returned by an engine method.
+      method (string): Name of the engine method, for the error message.
+
+    Returns:
+      The 'result' item of the response.
+    """
+    if not response or not response.get('success'):
+        error = response.get('error') if response else None
+        raise DatasetServiceError('Call to {0} failed: {1}'.format(method, error))
+
+    return response['result']
+
+
+def iter_pages(fetch, page_size, prefetch=True, counted=False):
+    """
+    Iterate over the items of a paged API.
+
+    Args:
+      fetch (callable): Function called with an offset that returns the list of items of the page at that offset.
+      page_size (int): Number of items requested per page. A shorter page is taken as the last one, unless counted.
+      prefetch (bool, optional): Fetch the next page in a background thread while the current page is consumed.
+        Defaults to True.
+      counted (bool, optional): fetch returns the items of the page and the total number of items, and the pages end
+        when all items have been fetched or a page is empty. Use it for APIs that may return shorter pages than
+        requested. Defaults to False.
+
+    Returns:
+      (generator): The items of all pages.
+    """
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    offset = 0
+    pending = None
+
+    try:
+        while True:
+            if pending is not None:
+                page = pending.result()
+            else:
+                page = fetch(offset)
+
+            if counted:
+                items, count = page
+                offset += len(items)
+                last_page = not items or offset >= count
+            else:
+                items = page
+                offset += len(items)
+                last_page = len(items) < page_size
+
+            page = None
+
+            if executor and not last_page:
+                pending = executor.submit(fetch, offset)
+            else:
+                pending = None
+
+            for item in items:
+                yield item
+
+            if last_page:
+                return
+
+            # Drop the reference so at most one page is held while the next one is fetched
+            items = None
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+def iter_datasets(service_name, page_size=100, with_resources=False, prefetch=True, app_class=None, **kwargs):
+    """
+    Iterate over all datasets of a dataset service.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      page_size (int, optional): Number of datasets requested per call to list_datasets, at most MAX_PAGE_SIZE.
+        Defaults to 100.
+      with_resources (bool, optional): Yield dataset dictionaries including resources instead of dataset names.
+        Defaults to False.
+      prefetch (bool, optional): Fetch the next page in the background. Defaults to True.
+      app_class (class, optional): The app class to include in the search for dataset engines.
+      **kwargs: Any other arguments for list_datasets.
+
+    Returns:
+      (generator): Dataset names or dataset dictionaries.
+    """
+    engine = get_dataset_engine(service_name, app_class)
+    page_size = min(page_size, MAX_PAGE_SIZE)
+
+    def fetch(offset):
+        response = engine.list_datasets(with_resources=with_resources, limit=page_size, offset=offset, **kwargs)
+        return get_result(response, 'list_datasets')
+
+    return iter_pages(fetch, page_size, prefetch)
+
+
+def iter_search_results(service_name, query=None, filtered_query=None, page_size=100, prefetch=True,
+                        app_class=None, **kwargs):
+    """
+    Iterate over all datasets of a dataset service that match a search.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      query (dict, optional): Key value pairs representing field and values to search for.
+      filtered_query (dict, optional): Key value pairs representing field and values to filter by.
+      page_size (int, optional): Number of datasets requested per call to search_datasets, at most MAX_PAGE_SIZE.
+        Defaults to 100.
+      prefetch (bool, optional): Fetch the next page in the background. Defaults to True.
+      app_class (class, optional): The app class to include in the search for dataset engines.
+      **kwargs: Any other arguments for search_datasets (e.g.: sort).
+
+    Returns:
+      (generator): Dataset dictionaries.
+    """
+    engine = get_dataset_engine(service_name, app_class)
+    page_size = min(page_size, MAX_PAGE_SIZE)
+
+    def fetch(offset):
+        response = engine.search_datasets(query=query, filtered_query=filtered_query, rows=page_size, start=offset,
+                                          **kwargs)
+        result = get_result(response, 'search_datasets')
+        return result['results'], result['count']
+
+    return iter_pages(fetch, page_size, prefetch, counted=True)
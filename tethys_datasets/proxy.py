@@ -0,0 +1,165 @@
+import hashlib
+import json
+
+from .cache import engine_cache_key
+
+READ_METHODS = frozenset(('list_datasets', 'search_datasets', 'search_resources', 'get_dataset', 'get_resource'))
+WRITE_METHOD_PREFIXES = ('create_', 'update_', 'delete_')
+
+
+class EngineCall(object):
+    """
+    A call to a method of a dataset engine as seen by the layers of an EngineProxy.
+    """
+
+    def __init__(self, service, method, args, kwargs, engine_key=None):
+        """
+        Constructor
+
+        Args:
+          service (string): Name of the dataset service the engine belongs to.
+          method (string): Name of the engine method.
+          args (tuple): Positional arguments of the call.
+          kwargs (dict): Keyword arguments of the call.
+          engine_key (tuple, optional): Identity of the engine: its class, endpoint and a digest of its credentials (see
+            engine_identity). Engines of apps can share the name of another service, but not their identity.
+        """
+        self.service = service
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.engine_key = engine_key
+
+        # Set by the single-flight layer when the result was shared from an identical call already in flight
+        self.coalesced = False
+
+    @property
+    def is_read(self):
+        return self.method in READ_METHODS
+
+    @property
+    def is_write(self):
+        return self.method.startswith(WRITE_METHOD_PREFIXES)
+
+    def fingerprint(self):
+        """
+        Digest of the method and arguments of the call. Keyword argument order does not change the digest.
+        """
+        normalized = json.dumps([self.method, self.args, self.kwargs], sort_keys=True, default=repr)
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def __repr__(self):
+        return '<EngineCall: service={0}, method={1}>'.format(self.service, self.method)
+
+
+def engine_identity(engine):
+    """
+    Identity of an engine object: its class, endpoint and a digest of its credentials, as in the keys of the engine
+    cache.
+    """
+    engine_class = type(engine)
+    return engine_cache_key('{0}.{1}'.format(engine_class.__module__, engine_class.__name__),
+                            getattr(engine, 'endpoint', None), getattr(engine, 'apikey', None),
+                            getattr(engine, 'username', None), getattr(engine, 'password', None))
+
+
+class EngineProxy(object):
+    """
+    Wraps a dataset engine so that calls to its public methods pass through a chain of layers.
+
+    A layer is a callable taking an EngineCall and a proceed function. It returns the result of the call, usually by
+    returning proceed(), which calls the next layer or, after the last layer, the engine method itself. The first layer
+    is the outermost one.
+    """
+
+    def __init__(self, engine, service, layers):
+        """
+        Constructor
+
+        Args:
+          engine (DatasetEngine): The engine to wrap.
+          service (string): Name of the dataset service the engine belongs to.
+          layers (list): Layers that calls pass through, outermost first.
+        """
+        self._engine = engine
+        self._service = service
+        self._layers = tuple(layers)
+        self._engine_key = engine_identity(engine)
+
+    @property
+    def engine(self):
+        """
+        The wrapped engine.
+        """
+        return self._engine
+
+    def __getattr__(self, name):
+        attribute = getattr(self._engine, name)
+
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        def method(*args, **kwargs):
+            return self._call(EngineCall(self._service, name, args, kwargs, self._engine_key), attribute)
+
+        method.__name__ = name
+        method.__doc__ = attribute.__doc__
+        return method
+
+    def call_through(self, method, function, *args, **kwargs):
+        """
+        Call a function as if it were the engine method with the given name, passing through the layers. Used by
+        helpers that talk to the dataset service directly instead of through an engine method.
+
+        Args:
+          method (string): Name of the engine method the call stands for (e.g.: 'create_resource').
+          function (callable): The function to call.
+          *args: Positional arguments for function.
+          **kwargs: Keyword arguments for function.
+
+        Returns:
+          The result of function.
+        """
+        return self._call(EngineCall(self._service, method, args, kwargs, self._engine_key), function)
+
+    def _call(self, call, function):
+        layers = self._layers
+
+        def proceed(index=0):
+            if index == len(layers):
+                return function(*call.args, **call.kwargs)
+
+            return layers[index](call, lambda: proceed(index + 1))
+
+        return proceed()
+
+    def __repr__(self):
+        return repr(self._engine)
+
+
+def call_through(engine, method, function, *args, **kwargs):
+    """
+    Call a function on behalf of an engine, through its layers if the engine is an EngineProxy.
+    """
+    if isinstance(engine, EngineProxy):
+        return engine.call_through(method, function, *args, **kwargs)
+
+    return function(*args, **kwargs)
+
+
+def wrap_engine(engine, service, layers):
+    """
+    Wrap an engine in an EngineProxy if there are any layers to apply.
+
+    Args:
+      engine (DatasetEngine): The engine to wrap.
+      service (string): Name of the dataset service the engine belongs to.
+      layers (list): Layers that calls pass through, outermost first.
+
+    Returns:
+      (object): The EngineProxy or the engine itself if there are no layers.
+    """
+    if not layers:
+        return engine
+
+    return EngineProxy(engine, service, layers)
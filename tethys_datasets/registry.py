@@ -0,0 +1,182 @@
+import threading
+import time
+
+from django.conf import settings
+
+
+class ServiceRegistry(object):
+    """
+    In-memory index of dataset service settings by name, so engine lookups do not have to query the database.
+
+    The registry is loaded on first use, updated by the model signal handlers in tethys_datasets.signals and reloaded
+    after ttl seconds so that changes made by other processes are picked up as well.
+    """
+
+    def __init__(self, model, ttl=60, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          model (class): DatasetService or SpatialDatasetService model class.
+          ttl (int): Number of seconds before the registry is reloaded from the database. Use 0 or None to never reload.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.model = model
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._services = None
+        self._loaded_at = None
+
+        # Names looked up in the database and not found there since the last load, e.g. the names of app services
+        self._missing = set()
+
+    def load(self):
+        """
+        Load all services from the database, replacing the current contents of the registry.
+
+        Returns:
+          (dict): The services by name.
+        """
+        services = dict((service.name, service) for service in self.model.objects.all())
+
+        with self._lock:
+            self._services = services
+            self._loaded_at = self._clock()
+            self._missing = set()
+
+        return services
+
+    def _is_stale(self):
+        if self._services is None:
+            return True
+
+        return bool(self.ttl) and self._clock() - self._loaded_at >= self.ttl
+
+    def _current(self):
+        """
+        Get the services by name, loading them if the registry is empty or stale. The dict returned is never changed
+        in place, so it can be read without the lock.
+        """
+        with self._lock:
+            services = None if self._is_stale() else self._services
+
+        if services is None:
+            services = self.load()
+
+        return services
+
+    def get(self, name):
+        """
+        Get the service with the given name.
+
+        Args:
+          name (string): Name of the service.
+
+        Returns:
+          (DatasetService): The model instance or None if there is no service with that name.
+        """
+        services = self._current()
+        service = services.get(name)
+
+        if service is not None:
+            return service
+
+        with self._lock:
+            if name in self._missing:
+                return None
+
+        # Services created in another process since the last load are found with a single indexed query. Names that
+        # are not found are not queried again until the next load.
+        service = self.model.objects.filter(name=name).first()
+
+        if service is not None:
+            self.update(service)
+        else:
+            with self._lock:
+                if self._services is services:
+                    self._missing.add(name)
+
+        return service
+
+    def names(self):
+        """
+        Names of all registered services.
+        """
+        return sorted(self._current())
+
+    def update(self, service):
+        """
+        Add or replace a service, handling renames.
+
+        Args:
+          service (DatasetService): The saved model instance.
+        """
+        with self._lock:
+            if self._services is None:
+                return
+
+            # Copied, so readers holding the previous dict are not affected
+            services = dict(self._services)
+            self._discard(services, service)
+            services[service.name] = service
+            self._services = services
+            self._missing.discard(service.name)
+
+    def remove(self, service):
+        """
+        Remove a service.
+
+        Args:
+          service (DatasetService): The deleted model instance.
+        """
+        with self._lock:
+            if self._services is not None:
+                services = dict(self._services)
+                self._discard(services, service)
+                self._services = services
+
+    @staticmethod
+    def _discard(services, service):
+        """
+        Remove the entries of services for the same database row as service.
+        """
+        for name in [n for n, s in services.items() if s.pk == service.pk or n == service.name]:
+            del services[name]
+
+    def clear(self):
+        """
+        Empty the registry. It is reloaded on next use.
+        """
+        with self._lock:
+            self._services = None
+            self._loaded_at = None
+            self._missing = set()
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_service_registry(model):
+    """
+    Get the process-wide registry for a service model, configured from the TETHYS_DATASETS_SERVICE_REGISTRY_TTL
+    setting.
+
+    Args:
+      model (class): DatasetService or SpatialDatasetService model class.
+
+    Returns:
+      (ServiceRegistry): The registry for the model.
+    """
+    registry = _registries.get(model)
+
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(model)
+
+            if registry is None:
+                registry = ServiceRegistry(model, ttl=getattr(settings, 'TETHYS_DATASETS_SERVICE_REGISTRY_TTL', 60))
+                _registries[model] = registry
+
+    return registry
@@ -0,0 +1,290 @@
+"""
+Opt-in caching of read-only engine calls.
+
+Responses of list_datasets, search_datasets, search_resources, get_dataset and get_resource are cached per service for
+the number of seconds given by the cache_ttl field of the DatasetService. Any create_*, update_* or delete_* call made
+through an engine of the same service invalidates all cached responses of that service. Stale responses of CKAN services
+are revalidated instead of fetched again when possible (see tethys_datasets.revalidation).
+
+The backend is configured with the TETHYS_DATASETS_RESPONSE_CACHE setting:
+
+    TETHYS_DATASETS_RESPONSE_CACHE = {
+        'BACKEND': 'tethys_datasets.response_cache.DjangoCacheBackend',
+        'OPTIONS': {'alias': 'default'},
+    }
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .health import CircuitOpenError
+
+# Seconds stale responses are kept for revalidation
+STALE_LIFETIME = 24 * 3600
+
+
+def response_cache_key(call, generation):
+    """
+    Build the cache key of an engine call. Keyword argument order does not change the key.
+
+    Args:
+      call (EngineCall): The engine call.
+      generation (int): Current generation of the service (see BaseCacheBackend.invalidate).
+
+    Returns:
+      (string): The cache key.
+    """
+    return 'tethys_datasets:response:{0}:{1}:{2}'.format(call.service, generation, call.fingerprint())
+
+
+class BaseCacheBackend(object):
+    """
+    Base class for response cache backends. Entries are invalidated by service by moving the service to a new
+    generation, so stale entries are never read again and age out of the backend on their own.
+    """
+
+    def get(self, key):
+        """
+        Get the value stored under key or None.
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl):
+        """
+        Store value under key for ttl seconds.
+        """
+        raise NotImplementedError()
+
+    def generation(self, service):
+        """
+        Current generation of a service.
+        """
+        raise NotImplementedError()
+
+    def invalidate(self, service):
+        """
+        Invalidate all entries of a service.
+        """
+        raise NotImplementedError()
+
+
+class LocalMemoryBackend(BaseCacheBackend):
+    """
+    Per-process LRU cache. Values are pickled so callers can not modify the cached responses.
+    """
+
+    def __init__(self, max_entries=1024, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          max_entries (int): Maximum number of responses to keep. The least recently used response is evicted first.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generations = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None:
+                return None
+
+            if entry[1] <= self._clock():
+                return None
+
+            # Mark as most recently used
+            self._entries[key] = entry
+
+        return pickle.loads(entry[0])
+
+    def set(self, key, value, ttl):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (data, self._clock() + ttl)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def generation(self, service):
+        return self._generations.get(service, 0)
+
+    def invalidate(self, service):
+        with self._lock:
+            self._generations[service] = self._generations.get(service, 0) + 1
+            prefix = 'tethys_datasets:response:{0}:'.format(service)
+
+            # Free the memory right away rather than waiting for eviction
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+
+class DjangoCacheBackend(BaseCacheBackend):
+    """
+    Shares cached responses between processes through one of the caches in the CACHES setting.
+    """
+
+    def __init__(self, alias='default'):
+        """
+        Constructor
+
+        Args:
+          alias (string): Name of the cache in the CACHES setting.
+        """
+        from django.core.cache import caches
+
+        self.cache = caches[alias]
+
+    @staticmethod
+    def _generation_key(service):
+        return 'tethys_datasets:generation:{0}'.format(service)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def generation(self, service):
+        return self.cache.get(self._generation_key(service), 0)
+
+    def invalidate(self, service):
+        key = self._generation_key(service)
+
+        # The generation must never expire, otherwise old entries could become visible again
+        self.cache.add(key, 0, None)
+
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, None)
+
+
+class ResponseCacheLayer(object):
+    """
+    EngineProxy layer that caches successful read responses and invalidates them on writes.
+    """
+
+    def __init__(self, ttl, backend=None, revalidator=None, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          ttl (int): Number of seconds responses are cached.
+          backend (BaseCacheBackend, optional): Cache backend. Defaults to the backend from the settings.
+          revalidator (CkanRevalidator, optional): Checks whether stale responses can be reused (see
+            tethys_datasets.revalidation). Responses it supports are kept for STALE_LIFETIME seconds after they
+            become stale, and served stale while the circuit breaker of the service is open.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.ttl = ttl
+        self.backend = backend if backend is not None else get_response_cache_backend()
+        self.revalidator = revalidator
+        self._clock = clock
+
+    def __call__(self, call, proceed):
+        if call.is_write:
+            try:
+                return proceed()
+            finally:
+                self.backend.invalidate(call.service)
+
+        # Console output is a side effect of the call, so those calls are never answered from the cache
+        if not call.is_read or call.kwargs.get('console'):
+            return proceed()
+
+        key = response_cache_key(call, self.backend.generation(call.service))
+
+        if self.revalidator is not None and self.revalidator.supports(call):
+            return self._revalidated(call, key, proceed)
+
+        response = self.backend.get(key)
+
+        if response is None:
+            response = proceed()
+
+            if response and response.get('success'):
+                self.backend.set(key, response, self.ttl)
+
+        return response
+
+    def _revalidated(self, call, key, proceed):
+        # Imported here so that building the layers does not import requests
+        from .revalidation import get_revalidation_stats
+        from .transport import track_transfers
+
+        now = self._clock()
+        entry = self.backend.get(key)
+        validator = None
+
+        # Entries stored without revalidation by other versions are ignored
+        if isinstance(entry, tuple):
+            fresh_until, stored_validator, size, response = entry
+
+            if now < fresh_until:
+                return response
+
+            if stored_validator is not None:
+                try:
+                    with track_transfers() as counter:
+                        validator = self.revalidator.revalidate(call, response)
+                except CircuitOpenError:
+                    # The service is down, a stale response is better than none
+                    return response
+
+                unchanged = validator == stored_validator
+                get_revalidation_stats().record(self.revalidator.source, unchanged, size - counter.bytes_received)
+
+                if unchanged:
+                    self.backend.set(key, (now + self.ttl, validator, size, response), self.ttl + STALE_LIFETIME)
+                    return response
+
+        # Validators of datasets come with the response, those of catalogs must be read before it
+        if call.method != 'get_dataset' and validator is None:
+            validator = self.revalidator.validator(call)
+
+        with track_transfers() as counter:
+            response = proceed()
+
+        if response and response.get('success'):
+            if call.method == 'get_dataset':
+                validator = self.revalidator.validator(call, response)
+
+            self.backend.set(key, (now + self.ttl, validator, counter.bytes_received, response),
+                             self.ttl + STALE_LIFETIME)
+
+        return response
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_response_cache_backend():
+    """
+    Get the process-wide response cache backend configured with the TETHYS_DATASETS_RESPONSE_CACHE setting.
+    """
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                options = getattr(settings, 'TETHYS_DATASETS_RESPONSE_CACHE', {})
+                backend_class = import_string(options.get('BACKEND',
+                                                          'tethys_datasets.response_cache.LocalMemoryBackend'))
+                _backend = backend_class(**options.get('OPTIONS', {}))
+
+    return _backend
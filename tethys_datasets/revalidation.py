@@ -0,0 +1,148 @@
+"""
+Revalidation of stale cached responses.
+
+Cached responses usually outlive their freshness without the remote data having changed. Instead of downloading the
+whole payload again, a stale response is checked against a validator of the remote data and reused if it is unchanged:
+
+* Responses of CKAN services with a cache TTL (see tethys_datasets.response_cache) keep the metadata_modified time of
+  the dataset, for get_dataset, or the number of datasets and the newest metadata_modified time of the catalog, for
+  list_datasets and search_datasets. A stale response is checked with a package_search for one row.
+* GET requests sent through the connection pool (see tethys_datasets.transport), which include the REST requests of
+  the GeoServer catalog, keep the ETag and Last-Modified headers of their responses. Later identical requests are sent
+  with If-None-Match and If-Modified-Since and a 304 Not Modified answer gets the stored body.
+
+The bodies kept for conditional requests are limited in settings.py (False disables conditional requests):
+
+    TETHYS_DATASETS_CONDITIONAL_REQUESTS = {
+        'MAX_SIZE': 32 * 1024 ** 2,
+        'MAX_ENTRY_SIZE': 4 * 1024 ** 2,
+    }
+
+get_revalidation_stats() reports how many responses were revalidated and the bytes that were not downloaded again.
+"""
+import threading
+
+# Fields returned by the probes of CKAN services, which ignore the parameter before CKAN 2.9
+PROBE_FIELDS = 'id,metadata_modified'
+
+
+class RevalidationStats(object):
+    """
+    Counts of the revalidated responses and the bytes they saved, by source ('ckan' or 'http').
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, source, unchanged, bytes_saved=0):
+        """
+        Record a revalidation.
+
+        Args:
+          source (string): What was revalidated.
+          unchanged (bool): The stored response was reused.
+          bytes_saved (int): Bytes of the stored response minus the bytes of the revalidation request.
+        """
+        with self._lock:
+            counts = self._counts.setdefault(source, {'revalidated': 0, 'unchanged': 0, 'bytes_saved': 0})
+            counts['revalidated'] += 1
+
+            if unchanged:
+                counts['unchanged'] += 1
+                counts['bytes_saved'] += max(0, bytes_saved)
+
+    def as_dict(self):
+        with self._lock:
+            return dict((source, dict(counts)) for source, counts in self._counts.items())
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+_stats = RevalidationStats()
+
+
+def get_revalidation_stats():
+    """
+    Get the process-wide revalidation statistics.
+    """
+    return _stats
+
+
+class CkanRevalidator(object):
+    """
+    Validators of the responses of a CKAN engine, based on the metadata_modified times of its datasets.
+    """
+    source = 'ckan'
+
+    def __init__(self, engine):
+        """
+        Constructor
+
+        Args:
+          engine (CkanDatasetEngine): The engine used to fetch the current validators, wrapped only in the rate limit
+            and circuit breaker layers of the service, so the probes are limited and fail fast like other calls.
+        """
+        self.engine = engine
+
+    def supports(self, call):
+        return call.method in ('get_dataset', 'list_datasets', 'search_datasets')
+
+    def _search(self, **kwargs):
+        response = self.engine.execute_api_method('package_search', rows=1, fl=PROBE_FIELDS, **kwargs)
+
+        if not response or not response.get('success'):
+            return None
+
+        return response['result']
+
+    def validator(self, call, response=None):
+        """
+        Get the current validator of the data of a call.
+
+        Args:
+          call (EngineCall): The call.
+          response (dict, optional): A successful response of the call, from which validators of single datasets are
+            taken instead of asking the service.
+
+        Returns:
+          (string): The validator, None if it can not be told.
+        """
+        if call.method == 'get_dataset':
+            if response is not None:
+                return response['result'].get('metadata_modified') or None
+
+            return None
+
+        result = self._search(q='*:*', sort='metadata_modified desc',
+                              include_private=bool(call.kwargs.get('include_private')))
+
+        if result is None:
+            return None
+
+        newest = result['results'][0].get('metadata_modified', '') if result.get('results') else ''
+        return u'{0}:{1}'.format(result.get('count', 0), newest)
+
+    def revalidate(self, call, response):
+        """
+        Get the current validator of the data of a stored response.
+
+        Args:
+          call (EngineCall): The call.
+          response (dict): The stored response of the call.
+
+        Returns:
+          (string): The current validator, None if it can not be told.
+        """
+        if call.method != 'get_dataset':
+            return self.validator(call)
+
+        # Looked up by id, which stays the same when the dataset is renamed
+        result = self._search(fq=u'id:"{0}"'.format(response['result']['id']), include_private=True)
+
+        if not result or not result.get('results'):
+            return None
+
+        return result['results'][0].get('metadata_modified') or None
@@ -0,0 +1,27 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache import get_engine_cache, service_cache_tag
+from .models import DatasetService, SpatialDatasetService
+from .registry import get_service_registry
+
+
+@receiver(post_save, sender=DatasetService, dispatch_uid='tethys_datasets_dataset_service_saved')
+@receiver(post_save, sender=SpatialDatasetService, dispatch_uid='tethys_datasets_spatial_dataset_service_saved')
+def service_saved(sender, instance, **kwargs):
+    """
+    Refresh the registry and drop cached engine objects of a dataset service when it is changed, so admin edits apply
+    immediately.
+    """
+    get_engine_cache().invalidate(service_cache_tag(instance))
+    get_service_registry(sender).update(instance)
+
+
+@receiver(post_delete, sender=DatasetService, dispatch_uid='tethys_datasets_dataset_service_deleted')
+@receiver(post_delete, sender=SpatialDatasetService, dispatch_uid='tethys_datasets_spatial_dataset_service_deleted')
+def service_deleted(sender, instance, **kwargs):
+    """
+    Remove a deleted dataset service from the registry and drop its cached engine objects.
+    """
+    get_engine_cache().invalidate(service_cache_tag(instance))
+    get_service_registry(sender).remove(instance)
@@ -0,0 +1,380 @@
+"""
+Incremental sync of the catalog of a CKAN dataset service.
+
+The sync keeps the last known version of every dataset of a service: its id, name, metadata_modified time and a hash
+of its content. Each run fetches only the datasets modified since the newest metadata_modified time seen so far (the
+watermark), compares their hashes with the known versions and sends a catalog_changed signal for every dataset that was
+added, updated or deleted since the last run. The datasets are fetched in pages keyed by their metadata_modified time
+(see iter_modified_datasets). Each page is compared with the known versions of its datasets, written and signaled
+before the next page is fetched, and incremental runs move the watermark forward after every page, so a run holds one
+page in memory and an interrupted run resumes where it stopped.
+
+Deleted datasets are found in the activity stream of the service (recently_changed_packages_activity_list), which also
+scales with the amount of change, before the pages are fetched. Services without an activity stream fall back to
+comparing the names returned by list_datasets with the known datasets, one request for the whole catalog. Full runs
+delete the known datasets they did not fetch at the end.
+
+Subscribe to the changes with a signal receiver:
+
+    from django.dispatch import receiver
+    from tethys_datasets.sync import catalog_changed
+
+    @receiver(catalog_changed)
+    def on_catalog_changed(sender, event, **kwargs):
+        if event.kind == event.DELETED:
+            ...
+"""
+import hashlib
+import json
+import logging
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import DatasetService, DatasetSyncState, SyncedDataset, truncate_to_field
+from .pagination import MAX_PAGE_SIZE, get_result, iter_pages
+from .utilities import get_dataset_engine
+
+log = logging.getLogger(__name__)
+
+# Sent with sender=DatasetService and event=ChangeEvent for every change found by sync_catalog
+catalog_changed = Signal()
+
+ACTIVITY_PAGE_SIZE = 100
+
+# Most ids in one IN query
+ID_CHUNK_SIZE = 500
+
+# Order of the pages of modified datasets, the id breaks the ties between datasets modified at the same time
+KEYSET_SORT = 'metadata_modified asc, id asc'
+
+
+class ChangeEvent(namedtuple('ChangeEvent', ('kind', 'service_name', 'dataset_id', 'dataset'))):
+    """
+    A change of one dataset of a dataset service.
+
+    Attributes:
+      kind (string): ChangeEvent.ADDED, ChangeEvent.UPDATED or ChangeEvent.DELETED.
+      service_name (string): Name of the dataset service.
+      dataset_id (string): The id of the dataset.
+      dataset (dict): The dataset dictionary returned by the service, None for deleted datasets.
+    """
+    ADDED = 'added'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+
+
+class SyncResult(object):
+    """
+    Outcome of the sync of one dataset service.
+    """
+
+    def __init__(self, service_name, full):
+        self.service_name = service_name
+        self.full = full
+        self.fetched = 0
+        self.added = 0
+        self.updated = 0
+        self.deleted = 0
+
+    def count(self, event):
+        setattr(self, event.kind, getattr(self, event.kind) + 1)
+
+    def __repr__(self):
+        return '<SyncResult: service={0}, fetched={1}, added={2}, updated={3}, deleted={4}>'.format(
+            self.service_name, self.fetched, self.added, self.updated, self.deleted)
+
+
+def content_hash(dataset):
+    """
+    Hash of the content of a dataset dictionary. Key order does not change the hash.
+    """
+    return hashlib.sha1(json.dumps(dataset, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def solr_date(timestamp):
+    """
+    Convert a CKAN metadata_modified time to a date for Solr range queries.
+
+    CKAN stores microseconds, but Solr range queries need whole seconds and a time zone. Ranges are inclusive, so
+    datasets modified in the same second as the timestamp are matched again.
+    """
+    return timestamp[:19] + 'Z'
+
+
+def iter_modified_datasets(service_name, since=None, page_size=100):
+    """
+    Iterate over the datasets of a dataset service modified at or after a time, oldest first.
+
+    The pages are fetched by key rather than by offset: each page asks for the datasets modified at or after the second
+    of the newest dataset seen so far, sorted by metadata_modified and id, and the datasets of that second that were
+    already yielded are skipped. A dataset modified during the iteration moves to the end and is yielded again instead
+    of shifting the pages and making other datasets be skipped. Only when more datasets than fit in a page share one
+    second are the pages of that second fetched by offset.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      since (string, optional): A CKAN metadata_modified time. Defaults to all datasets.
+      page_size (int, optional): Number of datasets requested per call, at most MAX_PAGE_SIZE. Defaults to 100.
+
+    Returns:
+      (generator): Dataset dictionaries.
+    """
+    engine = get_dataset_engine(service_name)
+    page_size = min(page_size, MAX_PAGE_SIZE)
+    key = solr_date(since) if since else None
+    key_ids = set()
+    start = 0
+
+    while True:
+        if key is None:
+            response = engine.search_datasets(query={'*': '*'}, rows=page_size, start=start, sort=KEYSET_SORT)
+        else:
+            response = engine.search_datasets(filtered_query={'metadata_modified': '[{0} TO *]'.format(key)},
+                                              rows=page_size, start=start, sort=KEYSET_SORT)
+
+        datasets = get_result(response, 'search_datasets')['results']
+        previous_key = key
+
+        for dataset in datasets:
+            second = solr_date(dataset.get('metadata_modified') or '')
+
+            if second == key and dataset['id'] in key_ids:
+                continue
+
+            if second != key:
+                key, key_ids = second, set()
+
+            key_ids.add(dataset['id'])
+            yield dataset
+
+        if len(datasets) < page_size:
+            return
+
+        # A full page of one second that was already seen, the rest of the second is fetched by offset
+        start = start + len(datasets) if key == previous_key else 0
+
+
+def _deleted_from_activity(engine, since):
+    """
+    Ids of the datasets deleted at or after since according to the activity stream, or None if the service has no
+    activity stream.
+    """
+    def fetch(offset):
+        response = engine.execute_api_method(method='recently_changed_packages_activity_list',
+                                             limit=ACTIVITY_PAGE_SIZE, offset=offset)
+
+        if not response or not response.get('success'):
+            raise LookupError()
+
+        return response['result']
+
+    deleted = set()
+
+    try:
+        # Activities come newest first
+        for activity in iter_pages(fetch, ACTIVITY_PAGE_SIZE, prefetch=False):
+            if activity.get('timestamp', '') < since[:19]:
+                break
+
+            if activity.get('activity_type') == 'deleted package':
+                deleted.add(activity['object_id'])
+    except LookupError:
+        return None
+
+    return deleted
+
+
+def _deleted_from_listing(engine, copies):
+    """
+    Ids of the copies whose names are no longer listed by the service.
+    """
+    names = set(get_result(engine.list_datasets(), 'list_datasets'))
+    return set(dataset_id for dataset_id, name in copies.values_list('dataset_id', 'name').iterator()
+               if name not in names)
+
+
+def _chunks(iterable, size):
+    """
+    Split an iterable into lists of at most size items.
+    """
+    chunk = []
+
+    for item in iterable:
+        chunk.append(item)
+
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _known_ids(copies, dataset_ids):
+    """
+    Ids of the given datasets that have a copy, queried in chunks so the queries stay within the parameter limits of
+    the database.
+    """
+    known = set()
+
+    for chunk in _chunks(dataset_ids, ID_CHUNK_SIZE):
+        known.update(copies.filter(dataset_id__in=chunk).values_list('dataset_id', flat=True))
+
+    return known
+
+
+def find_deleted_datasets(engine, since, copies):
+    """
+    Find the datasets deleted from a service at or after a time, in the activity stream of the service. Services
+    without an activity stream fall back to comparing the names returned by list_datasets with the names of the copies.
+
+    Args:
+      engine (DatasetEngine): The engine of the CKAN dataset service.
+      since (string): A CKAN metadata_modified time.
+      copies (QuerySet): The local copies of the datasets of the service, SyncedDataset or CatalogDataset rows.
+
+    Returns:
+      (set): Ids of the deleted datasets that have a copy.
+    """
+    deleted = _deleted_from_activity(engine, since)
+
+    if deleted is None:
+        return _deleted_from_listing(engine, copies)
+
+    return _known_ids(copies, deleted)
+
+
+def delete_copies(copies, dataset_ids):
+    """
+    Delete the copies of the given datasets, in chunks of ids.
+    """
+    for chunk in _chunks(dataset_ids, ID_CHUNK_SIZE):
+        copies.filter(dataset_id__in=chunk).delete()
+
+
+def _send(result, events):
+    for event in events:
+        result.count(event)
+        catalog_changed.send(sender=DatasetService, event=event)
+
+
+def _delete(service, result, dataset_ids):
+    """
+    Delete the copies of the given datasets and signal their deletion.
+    """
+    with transaction.atomic():
+        delete_copies(SyncedDataset.objects.filter(service=service), dataset_ids)
+
+    _send(result, [ChangeEvent(ChangeEvent.DELETED, service.name, dataset_id, None) for dataset_id in dataset_ids])
+
+
+def _sync_page(service, result, page, started):
+    """
+    Compare a page of datasets with their known versions, write the changed versions and signal the changes.
+    """
+    ids = [dataset['id'] for dataset in page]
+    known = dict(SyncedDataset.objects.filter(service=service, dataset_id__in=ids)
+                 .values_list('dataset_id', 'content_hash'))
+    events = []
+
+    with transaction.atomic():
+        for dataset in page:
+            digest = content_hash(dataset)
+            previous = known.get(dataset['id'])
+
+            if previous is None:
+                events.append(ChangeEvent(ChangeEvent.ADDED, service.name, dataset['id'], dataset))
+            elif previous != digest:
+                events.append(ChangeEvent(ChangeEvent.UPDATED, service.name, dataset['id'], dataset))
+            else:
+                continue
+
+            # Datasets modified during the sync come again and are then compared with this version
+            known[dataset['id']] = digest
+            SyncedDataset.objects.update_or_create(service=service, dataset_id=dataset['id'], defaults={
+                'name': truncate_to_field(SyncedDataset, 'name', dataset.get('name')),
+                'content_hash': digest,
+                'metadata_modified': dataset.get('metadata_modified') or '',
+            })
+
+        SyncedDataset.objects.filter(service=service, dataset_id__in=ids).update(seen_at=started)
+
+    _send(result, events)
+
+
+def sync_catalog(service_name, full=False, page_size=100):
+    """
+    Find the datasets of a dataset service that were added, updated or deleted since the last sync and send a
+    catalog_changed signal for each of them. The datasets are compared, written and signaled one page at a time.
+
+    Args:
+      service_name (string): Name of the site-wide CKAN dataset service.
+      full (bool, optional): Fetch all datasets instead of the ones modified since the last sync. Defaults to False.
+      page_size (int, optional): Number of datasets requested per call. Defaults to 100.
+
+    Returns:
+      (SyncResult): The number of changes found.
+    """
+    service = DatasetService.objects.get(name=service_name)
+    state, _ = DatasetSyncState.objects.get_or_create(service=service)
+    since = None if full else state.watermark
+    result = SyncResult(service_name, full=not since)
+    started = timezone.now()
+
+    # Found before the watermark moves, so deletions are not missed if the run is interrupted
+    if not result.full:
+        deleted = find_deleted_datasets(get_dataset_engine(service_name), since,
+                                        SyncedDataset.objects.filter(service=service))
+        _delete(service, result, sorted(deleted))
+
+    watermark = state.watermark
+
+    for page in _chunks(iter_modified_datasets(service_name, since, page_size), min(page_size, ID_CHUNK_SIZE)):
+        result.fetched += len(page)
+        _sync_page(service, result, page, started)
+        watermark = max([watermark] + [dataset.get('metadata_modified') or '' for dataset in page])
+
+        # A full run only ends with the removal of the datasets it did not fetch, so it resumes from the start
+        if not result.full:
+            DatasetSyncState.objects.filter(pk=state.pk).update(watermark=watermark)
+
+    if result.full:
+        unseen = SyncedDataset.objects.filter(Q(seen_at__isnull=True) | Q(seen_at__lt=started), service=service)
+
+        while True:
+            dataset_ids = list(unseen.values_list('dataset_id', flat=True)[:ID_CHUNK_SIZE])
+
+            if not dataset_ids:
+                break
+
+            _delete(service, result, dataset_ids)
+
+    state.watermark = watermark
+    state.synced_at = timezone.now()
+    state.save()
+
+    log.info('Synced dataset service "%s": %d fetched, %d added, %d updated, %d deleted.', service_name,
+             result.fetched, result.added, result.updated, result.deleted)
+    return result
+
+
+def sync_all(full=False):
+    """
+    Sync every CKAN dataset service.
+
+    Returns:
+      (list): SyncResult of every service. Services that fail are logged and skipped.
+    """
+    results = []
+
+    for service_name in DatasetService.objects.filter(engine=DatasetService.CKAN).values_list('name', flat=True):
+        try:
+            results.append(sync_catalog(service_name, full=full))
+        except Exception:
+            log.exception('Could not sync dataset service "%s".', service_name)
+
+    return results
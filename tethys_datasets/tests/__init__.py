@@ -1 +1,24 @@
 __author__ = 'swainn'
+
+import os
+
+from django.conf import settings
+
+# The tests run without a Django project, and then create their own database (see fakes.DatabaseTestCase)
+STANDALONE = not settings.configured and not os.environ.get('DJANGO_SETTINGS_MODULE')
+
+if STANDALONE:
+    import django
+
+    settings.configure(
+        SECRET_KEY='tethys_datasets tests',
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'tethys_datasets'],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    )
+    django.setup()
+
+
+def load_tests(loader, tests, pattern):
+    # The test modules are named *_tests.py, which the default pattern of unittest (test*.py) does not match
+    here = os.path.dirname(os.path.abspath(__file__))
+    return loader.discover(here, pattern='*_tests.py', top_level_dir=os.path.dirname(os.path.dirname(here)))
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .. import aio
+from ..aio import AsyncDatasetEngine, aget_dataset_engine, run_concurrently
+
+
+class SleepingEngine(object):
+
+    def __init__(self, name, seconds=0.2):
+        self.name = name
+        self.seconds = seconds
+
+    def list_datasets(self, **kwargs):
+        time.sleep(self.seconds)
+        return {'success': True, 'result': [self.name]}
+
+    def get_dataset(self, dataset_id, **kwargs):
+        raise IOError('{0} is down'.format(self.name))
+
+
+class TestRunConcurrently(unittest.TestCase):
+
+    def test_calls_run_together(self):
+        start = time.time()
+        results = run_concurrently(AsyncDatasetEngine(SleepingEngine('ckan')).list_datasets(),
+                                   AsyncDatasetEngine(SleepingEngine('hydroshare')).list_datasets())
+
+        self.assertLess(time.time() - start, 0.35)
+        self.assertEqual([['ckan'], ['hydroshare']], [result['result'] for result in results])
+
+    def test_exceptions(self):
+        engine = AsyncDatasetEngine(SleepingEngine('ckan', seconds=0))
+
+        with self.assertRaises(IOError):
+            run_concurrently(engine.get_dataset('a'))
+
+        results = run_concurrently(engine.list_datasets(), engine.get_dataset('a'), return_exceptions=True)
+        self.assertEqual(['ckan'], results[0]['result'])
+        self.assertIsInstance(results[1], IOError)
+
+        # Options are keyword-only and checked
+        with self.assertRaises(TypeError):
+            run_concurrently(timeout=1)
+
+    def test_inside_running_loop(self):
+        async def view():
+            return run_concurrently(AsyncDatasetEngine(SleepingEngine('ckan', seconds=0)).list_datasets())
+
+        self.assertEqual(['ckan'], asyncio.run(view())[0]['result'])
+
+    def test_lookups_run_in_calling_thread(self):
+        threads = []
+
+        def get_dataset_engine(name, app_class=None):
+            threads.append(threading.current_thread())
+            return SleepingEngine(name, seconds=0)
+
+        with mock.patch.object(aio, 'get_dataset_engine', get_dataset_engine):
+            engine, = run_concurrently(aget_dataset_engine('ckan'))
+
+        # The thread of the caller looks after its database connection, the threads of the engine pool do not
+        self.assertEqual([threading.current_thread()], threads)
+        self.assertEqual('ckan', engine.engine.name)
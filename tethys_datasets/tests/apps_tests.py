@@ -0,0 +1,118 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from django.apps import apps
+from django.test import override_settings
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .. import apps as tethys_apps, utilities
+from ..apps import serves_requests
+from ..models import DatasetService
+from .mock_server import MockServer, SuccessApp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeService(object):
+
+    def __init__(self, name, endpoint):
+        self.name = name
+        self.endpoint = endpoint
+
+
+class FakeRegistry(object):
+
+    def __init__(self, services):
+        self.services = dict((service.name, service) for service in services)
+
+    def names(self):
+        return sorted(self.services)
+
+    def get(self, name):
+        return self.services.get(name)
+
+
+class TestServesRequests(unittest.TestCase):
+
+    def test_servers(self):
+        self.assertTrue(serves_requests(['/venv/bin/gunicorn', 'portal.wsgi'], {}))
+        self.assertTrue(serves_requests(['manage.py', 'runserver', '--noreload'], {}))
+        self.assertTrue(serves_requests(['manage.py', 'runserver'], {'RUN_MAIN': 'true'}))
+
+    def test_management_commands(self):
+        self.assertFalse(serves_requests(['manage.py', 'migrate'], {}))
+        self.assertFalse(serves_requests(['/venv/bin/django-admin', 'shell'], {}))
+        self.assertFalse(serves_requests([os.path.join('lib', 'django', '__main__.py'), 'collectstatic'], {}))
+        self.assertFalse(serves_requests(['manage.py'], {}))
+
+        # The process that reloads runserver serves no requests
+        self.assertFalse(serves_requests(['manage.py', 'runserver'], {}))
+
+
+class TestWarmUp(unittest.TestCase):
+
+    def test_ready_starts_the_background_threads_only_when_serving_requests(self):
+        config = apps.get_app_config('tethys_datasets')
+
+        for serving in (False, True):
+            with override_settings(TETHYS_DATASETS_WARM_UP=True, TETHYS_DATASETS_JOBS={'AUTOSTART': True}), \
+                    mock.patch.object(tethys_apps, 'serves_requests', lambda: serving), \
+                    mock.patch.object(tethys_apps.threading, 'Thread') as thread, \
+                    mock.patch('tethys_datasets.health.start_health_checker') as start_health_checker, \
+                    mock.patch('tethys_datasets.jobs.start_job_workers') as start_job_workers:
+                config.ready()
+
+            self.assertEqual([serving] * 3, [thread.called, start_health_checker.called, start_job_workers.called])
+
+    def test_engines_are_created(self):
+        received = []
+
+        def app(request):
+            received.append(request.method)
+            return SuccessApp()(request)
+
+        with MockServer(app) as server:
+            services = [FakeService('broken', server.url), FakeService('ckan', server.url)]
+            created = []
+
+            def get_service_engine(service):
+                if service.name == 'broken':
+                    raise ImportError('No module named broken_engine')
+
+                created.append(service.name)
+
+            with mock.patch.object(utilities, 'get_service_registry',
+                                   lambda model: FakeRegistry(services if model is DatasetService else [])), \
+                    mock.patch.object(utilities, 'get_service_engine', get_service_engine), \
+                    self.assertLogs('tethys_datasets.utilities') as logs:
+                utilities.warm_up(connect=True)
+
+        # A broken service does not keep the others from warming up
+        self.assertEqual(['ckan'], created)
+        self.assertEqual(['HEAD'], received)
+        self.assertIn('"broken"', logs.output[0])
+
+
+class TestLazyImport(unittest.TestCase):
+
+    def test_engine_modules_are_imported_when_needed(self):
+        script = (
+            'import sys\n'
+            'import tethys_datasets.tests\n'
+            'from tethys_datasets.utilities import get_engine_class\n'
+            'print(sorted(name for name in ("requests", "tethys_dataset_services.engines.ckan_engine") '
+            'if name in sys.modules))\n'
+            'get_engine_class("tethys_dataset_services.engines.CkanDatasetEngine")\n'
+            'print("tethys_dataset_services.engines.ckan_engine" in sys.modules)\n'
+        )
+        environ = dict(os.environ)
+        environ.pop('DJANGO_SETTINGS_MODULE', None)
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT, env=environ)
+
+        self.assertEqual(['[]', 'True'], output.decode('utf-8').split())
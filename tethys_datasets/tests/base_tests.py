@@ -0,0 +1,50 @@
+import pickle
+import unittest
+
+from ..base import DatasetService, EngineRegistry, SpatialDatasetService
+
+
+class TestServiceDeclarations(unittest.TestCase):
+
+    def test_engine_resolved_from_type(self):
+        service = DatasetService('ckan', 'ckan', 'http://localhost/api/3/action', apikey='secret')
+        self.assertEqual('tethys_dataset_services.engines.CkanDatasetEngine', service.engine)
+        self.assertEqual('secret', service.apikey)
+
+    def test_identical_declarations_interned(self):
+        first = DatasetService('ckan', 'ckan', 'http://localhost/api/3/action', apikey='secret')
+        second = DatasetService('ckan', 'ckan', 'http://localhost/api/3/action', apikey='secret')
+        other = DatasetService('ckan', 'ckan', 'http://localhost/api/3/action', apikey='other')
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertIsNot(first, SpatialDatasetService('ckan', 'geoserver', 'http://localhost/api/3/action'))
+        self.assertIs(first, pickle.loads(pickle.dumps(first)))
+
+    def test_declarations_immutable(self):
+        service = SpatialDatasetService('geoserver', 'geoserver', 'http://localhost/geoserver/rest/')
+
+        with self.assertRaises(AttributeError):
+            service.endpoint = 'http://example.com/geoserver/rest/'
+
+        with self.assertRaises(AttributeError):
+            service.extra = True
+
+    def test_invalid_type(self):
+        with self.assertRaises(ValueError) as context:
+            DatasetService('ckan', 'nope', 'http://localhost/api/3/action')
+
+        self.assertIn('"ckan" and "hydroshare"', str(context.exception))
+
+        with self.assertRaises(ValueError) as context:
+            SpatialDatasetService('geoserver', 'nope', 'http://localhost/geoserver/rest/')
+
+        self.assertIn('include "geoserver".', str(context.exception))
+
+    def test_registry_description(self):
+        registry = EngineRegistry([('a', 'x.A'), ('b', 'x.B'), ('c', 'x.C')])
+        self.assertEqual('"a", "b", and "c"', registry.description)
+        self.assertEqual('x.B', registry['b'])
+
+        with self.assertRaises(TypeError):
+            registry.engines['d'] = 'x.D'
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from ..blob_cache import BlobCache, resource_version
+
+
+class TestBlobCache(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.cache = BlobCache(self.location, max_size=100)
+        self.downloads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def downloader(self, data):
+        def download(path):
+            self.downloads.append(data)
+
+            with open(path, 'wb') as f:
+                f.write(data)
+
+        return download
+
+    def age(self, key, seconds):
+        path = self.cache.get(key)
+        mtime = os.stat(path).st_mtime - seconds
+        os.utime(path, (mtime, mtime))
+
+    def test_resource_version(self):
+        resource = {'url': 'http://host/a.nc', 'size': 10, 'last_modified': '2020-01-01', 'hash': 'abc'}
+        self.assertEqual(u'http://host/a.nc\n10\nhash:abc', resource_version(resource))
+        self.assertNotEqual(resource_version(resource), resource_version(dict(resource, hash='def')))
+        self.assertNotEqual(resource_version({'url': 'http://host/a.nc'}), resource_version(dict(resource, hash='')))
+
+    def test_downloaded_once_and_mapped_read_only(self):
+        for _ in range(2):
+            data = self.cache.open('a', self.downloader(b'x' * 10))
+
+            with data:
+                self.assertEqual(b'x' * 10, data[:])
+                self.assertRaises(TypeError, data.__setitem__, 0, 121)
+
+        self.assertEqual(1, len(self.downloads))
+
+    def test_same_content_stored_once(self):
+        first = self.cache.fetch('a', self.downloader(b'x' * 10))
+        second = self.cache.fetch('b', self.downloader(b'x' * 10))
+        self.assertEqual(first, second)
+        self.assertEqual(1, sum(len(names) for _, _, names in os.walk(os.path.join(self.location, 'blobs'))))
+
+    def test_least_recently_used_evicted(self):
+        self.cache.fetch('a', self.downloader(b'a' * 40))
+        self.cache.fetch('b', self.downloader(b'b' * 40))
+        self.age('a', 20)
+        self.age('b', 30)
+        self.cache.fetch('a', self.downloader(b'a' * 40))
+
+        self.cache.fetch('c', self.downloader(b'c' * 40))
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertEqual(80, self.cache.evict())
+
+        # The reference to the evicted file is removed
+        self.assertFalse(os.path.exists(self.cache._ref_path('b')))
+
+    def test_files_are_walked_only_beyond_the_size(self):
+        self.cache.fetch('a', self.downloader(b'a' * 40))
+
+        with mock.patch.object(self.cache, '_evict', wraps=self.cache._evict) as evict:
+            self.cache.fetch('b', self.downloader(b'b' * 40))
+            self.cache.fetch('c', self.downloader(b'b' * 40))
+            self.assertFalse(evict.called)
+
+            self.cache.fetch('d', self.downloader(b'd' * 40))
+            self.assertTrue(evict.called)
+
+        self.assertEqual(80, self.cache._read_size())
+
+    def test_failed_download_leaves_nothing(self):
+        def download(path):
+            with open(path + '.part', 'wb') as f:
+                f.write(b'partial')
+
+            raise IOError('Connection reset.')
+
+        self.assertRaises(IOError, self.cache.fetch, 'a', download)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual([], os.listdir(os.path.join(self.location, 'tmp')))
@@ -0,0 +1,108 @@
+import socket
+import threading
+import time
+import unittest
+
+import requests
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .. import bulk
+from ..bulk import bulk_delete_resources, is_connection_error, run_bulk
+
+
+def refused_error():
+    """
+    Get the error raised by requests for a port nothing listens on.
+    """
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+
+    try:
+        requests.get('http://127.0.0.1:{0}/'.format(port), timeout=1)
+    except requests.ConnectionError as e:
+        return e
+
+
+class FlakyFunction(object):
+    """
+    Raises or returns the given outcomes for each item, one per call, then succeeds.
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, item):
+        with self._lock:
+            self.calls.append(item)
+            outcomes = self.outcomes.get(item, [])
+            outcome = outcomes.pop(0) if outcomes else {'success': True, 'result': item}
+
+        if isinstance(outcome, Exception):
+            raise outcome
+
+        return outcome
+
+
+class TestRunBulk(unittest.TestCase):
+
+    def test_results_keep_the_order_of_the_items(self):
+        def function(item):
+            time.sleep(0.01 * (5 - item))
+            return {'success': item != 3, 'result': item}
+
+        result = run_bulk(function, range(6), max_workers=3)
+
+        self.assertEqual(list(range(6)), [item.item for item in result])
+        self.assertEqual([0, 1, 2, 4, 5], [item.index for item in result.succeeded])
+        self.assertEqual([3], [item.index for item in result.failed])
+
+        # Unsuccessful responses are answers of the service and are not retried
+        self.assertEqual(1, result.items[3].attempts)
+
+    def test_connection_errors_are_retried(self):
+        function = FlakyFunction({'a': [refused_error(), refused_error()], 'b': [requests.ReadTimeout()],
+                                  'c': [None], 'd': [ValueError('bad item')]})
+        result = run_bulk(function, ['a', 'b', 'c', 'd'], backoff=0)
+
+        self.assertEqual([True, False, False, False], [item.succeeded for item in result])
+        self.assertEqual([3, 1, 1, 1], [item.attempts for item in result])
+
+        # The request of a create that timed out may have reached the service
+        self.assertIsInstance(result.items[1].error, requests.ReadTimeout)
+        self.assertIsNone(result.items[2].response)
+
+    def test_idempotent_calls_are_retried(self):
+        function = FlakyFunction({'a': [requests.ReadTimeout()], 'b': [None, None, None], 'c': [ValueError()]})
+        result = run_bulk(function, ['a', 'b', 'c'], max_attempts=3, backoff=0, idempotent=True)
+
+        self.assertEqual([True, False, True], [item.succeeded for item in result])
+        self.assertEqual([2, 3, 2], [item.attempts for item in result])
+
+    def test_connection_errors(self):
+        self.assertTrue(is_connection_error(refused_error()))
+        self.assertTrue(is_connection_error(requests.ConnectTimeout()))
+        self.assertFalse(is_connection_error(requests.ConnectionError('Connection aborted.')))
+        self.assertFalse(is_connection_error(requests.ReadTimeout()))
+        self.assertFalse(is_connection_error(ValueError()))
+
+    def test_backoff(self):
+        class Engine(object):
+            def delete_resource(self, resource_id):
+                raise requests.ReadTimeout()
+
+        sleeps = []
+
+        with mock.patch.object(bulk, 'get_dataset_engine', lambda name, app_class=None: Engine()), \
+                mock.patch.object(bulk.time, 'sleep', sleeps.append):
+            result = bulk_delete_resources('ckan', ['r'], max_attempts=4, backoff=0.25)
+
+        self.assertEqual(4, result.items[0].attempts)
+        self.assertEqual([0.25, 0.5, 1.0], sleeps)
@@ -0,0 +1,95 @@
+import threading
+import unittest
+
+from ..cache import EngineCache, engine_cache_key
+from .fakes import FakeClock
+
+
+class TestEngineCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = EngineCache(max_size=2, ttl=10, clock=self.clock)
+
+    def test_get_or_create_returns_same_object(self):
+        # Execute
+        first = self.cache.get_or_create('a', object)
+        second = self.cache.get_or_create('a', object)
+
+        # Verify
+        self.assertIs(first, second)
+
+    def test_expired_entries_are_rebuilt(self):
+        # Setup
+        first = self.cache.get_or_create('a', object)
+
+        # Execute
+        self.clock.now = 10
+        second = self.cache.get_or_create('a', object)
+
+        # Verify
+        self.assertIsNot(first, second)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        # Setup
+        self.cache.get_or_create('a', object)
+        self.cache.get_or_create('b', object)
+        self.cache.get_or_create('a', object)
+
+        # Execute
+        self.cache.get_or_create('c', object)
+
+        # Verify
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('c', self.cache)
+
+    def test_invalidate_by_tag(self):
+        # Setup
+        self.cache.get_or_create('a', object, tag=('datasetservice', 1))
+        self.cache.get_or_create('b', object, tag=('datasetservice', 2))
+
+        # Execute
+        self.cache.invalidate(('datasetservice', 1))
+
+        # Verify
+        self.assertNotIn('a', self.cache)
+        self.assertIn('b', self.cache)
+
+    def test_shared_entry_is_invalidated_by_every_tag(self):
+        # Setup: two services with the same engine, endpoint and credentials share the engine
+        engine = self.cache.get_or_create('a', object, tag=('datasetservice', 1))
+        self.assertIs(engine, self.cache.get_or_create('a', object, tag=('datasetservice', 2)))
+
+        # Execute: the second service is saved
+        self.cache.invalidate(('datasetservice', 2))
+
+        # Verify
+        self.assertNotIn('a', self.cache)
+
+    def test_concurrent_get_or_create_shares_one_object(self):
+        # Setup
+        cache = EngineCache(max_size=10, ttl=None)
+        results = []
+
+        def worker():
+            results.append(cache.get_or_create('a', object))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+
+        # Execute
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Verify
+        self.assertEqual(len(set(id(result) for result in results)), 1)
+
+    def test_cache_key_hides_credentials(self):
+        # Execute
+        key = engine_cache_key('engines.CkanDatasetEngine', 'http://example.com/api', password='s3cret')
+
+        # Verify
+        self.assertNotIn('s3cret', repr(key))
+        self.assertNotEqual(key, engine_cache_key('engines.CkanDatasetEngine', 'http://example.com/api'))
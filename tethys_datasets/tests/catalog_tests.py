@@ -0,0 +1,123 @@
+from .. import catalog
+from ..catalog import harvest, search_catalog, search_catalog_resources
+from ..models import CatalogDataset, CatalogResource, DatasetService
+from ..registry import get_service_registry
+from .fakes import DatabaseTestCase
+from .mock_server import MockCkanApp, MockServer
+
+
+class CatalogTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        self.app = MockCkanApp()
+        self.server = MockServer(self.app)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        get_service_registry(DatasetService).clear()
+        self.addCleanup(get_service_registry(DatasetService).clear)
+        DatasetService.objects.create(name='ckan', endpoint=self.server.url + '/api/3/action/', index_catalog=True)
+
+    def add(self, name, **values):
+        package = self.app.package_create(dict(values, name=name))
+
+        for resource in values.get('resources', ()):
+            self.app.resource_create(dict(resource, package_id=package['id']))
+
+        return package
+
+    def names(self):
+        return sorted(CatalogDataset.objects.values_list('name', flat=True))
+
+
+class TestHarvest(CatalogTestCase):
+
+    def test_incremental_harvest_removes_deleted_datasets(self):
+        rainfall = self.add('rainfall', title='Rainfall')
+        self.add('streamflow', title='Streamflow')
+
+        result = harvest('ckan')
+        self.assertEqual((True, 2, 0), (result.full, result.updated, result.deleted))
+
+        self.app.package_delete({'id': rainfall['id']})
+        self.add('snowpack')
+
+        result = harvest('ckan')
+        self.assertFalse(result.full)
+        self.assertEqual(1, result.deleted)
+        self.assertEqual(['snowpack', 'streamflow'], self.names())
+
+    def test_deleted_datasets_without_activity_stream(self):
+        rainfall = self.add('rainfall')
+        self.add('streamflow')
+        harvest('ckan')
+
+        # Services without an activity stream answer the action with an error
+        self.app.recently_changed_packages_activity_list = None
+        self.app.package_delete({'id': rainfall['id']})
+
+        self.assertEqual(1, harvest('ckan').deleted)
+        self.assertEqual(['streamflow'], self.names())
+
+    def test_full_harvest_removes_unseen_copies(self):
+        rainfall = self.add('rainfall')
+        self.add('streamflow')
+        harvest('ckan')
+
+        # Deleted without an activity, e.g. purged
+        del self.app.packages[rainfall['id']]
+
+        result = harvest('ckan', full=True)
+        self.assertEqual((True, 1, 1), (result.full, result.updated, result.deleted))
+        self.assertEqual(['streamflow'], self.names())
+
+    def test_long_values_are_cut_down(self):
+        title = 'Rainfall ' * 200
+        self.add('rainfall', title=title, resources=[{'name': 'x' * 2000, 'format': 'f' * 200}])
+        harvest('ckan')
+
+        copy = CatalogDataset.objects.get()
+        self.assertEqual(title[:1024], copy.title)
+        self.assertEqual((1024, 100), (len(copy.resources.get().name), len(copy.resources.get().format)))
+
+        # The full metadata is kept
+        self.assertEqual(title, search_catalog('rainfall')['results'][0]['title'])
+
+
+class TestSearchCatalog(CatalogTestCase):
+
+    def setUp(self):
+        super(TestSearchCatalog, self).setUp()
+        self.add('rainfall', title='Daily rainfall', notes='Gauges in the Provo river basin', tags=['weather'],
+                 resources=[{'name': 'Gauge readings', 'format': 'CSV'}])
+        self.add('streamflow', title='Streamflow', notes='Provo river discharge',
+                 resources=[{'name': 'Discharge', 'format': 'NetCDF'}])
+        harvest('ckan')
+
+    @staticmethod
+    def page(result):
+        return result['count'], [dataset['name'] for dataset in result['results']]
+
+    def search(self):
+        self.assertEqual(['rainfall', 'streamflow'],
+                         [dataset['name'] for dataset in search_catalog('provo river')['results']])
+        self.assertEqual(['rainfall'], [dataset['name'] for dataset in search_catalog('weather')['results']])
+        self.assertEqual(['rainfall'], [dataset['name'] for dataset in search_catalog('readings csv')['results']])
+        self.assertEqual((2, ['streamflow']), self.page(search_catalog('provo', limit=1, offset=1)))
+        self.assertEqual(['Discharge'], [resource['name'] for resource in
+                                         search_catalog_resources('netcdf', service_name='ckan')['results']])
+        self.assertEqual(0, search_catalog('provo', service_name='other')['count'])
+
+    def test_full_text_search(self):
+        self.assertTrue(catalog._has_fts(CatalogDataset._meta.db_table))
+        self.search()
+
+        # The last word also matches as a prefix
+        self.assertEqual(['streamflow'], [dataset['name'] for dataset in search_catalog('disch')['results']])
+
+    def test_substring_search(self):
+        tables = dict(catalog._fts_tables)
+        self.addCleanup(setattr, catalog, '_fts_tables', tables)
+        catalog._fts_tables = dict((model._meta.db_table, False) for model in (CatalogDataset, CatalogResource))
+
+        self.search()
@@ -3,15 +3,37 @@ import random
 import string
 import unittest
 
-from ..engines import CkanDatasetEngine
+from tethys_dataset_services.engines import CkanDatasetEngine
+
+from .mock_server import MockServer, MockCkanApp
 
 try:
     from .test_config import TEST_CKAN_DATASET_SERVICE
 
 except ImportError:
-    print('ERROR: To perform tests, you must create a file in the "tests" package called "test_config.py". In this file'
-          'provide a dictionary called "TEST_CKAN_DATASET_SERVICE" with keys "API_ENDPOINT" and "APIKEY".')
-    exit(1)
+    # Without a test_config.py, run against an in-process stand-in for the CKAN action API. To test against a live CKAN,
+    # create a file in the "tests" package called "test_config.py" and provide a dictionary called
+    # "TEST_CKAN_DATASET_SERVICE" with keys "ENDPOINT" and "APIKEY".
+    TEST_CKAN_DATASET_SERVICE = None
+
+mock_server = None
+
+
+def setUpModule():
+    global TEST_CKAN_DATASET_SERVICE, mock_server
+
+    if TEST_CKAN_DATASET_SERVICE is None:
+        mock_server = MockServer(MockCkanApp()).start()
+        TEST_CKAN_DATASET_SERVICE = {'ENDPOINT': mock_server.url + '/api/3/action', 'APIKEY': 'mock-api-key'}
+
+
+def tearDownModule():
+    global TEST_CKAN_DATASET_SERVICE, mock_server
+
+    if mock_server is not None:
+        mock_server.stop()
+        mock_server = None
+        TEST_CKAN_DATASET_SERVICE = None
 
 
 def random_string_generator(size):
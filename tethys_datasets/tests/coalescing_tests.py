@@ -0,0 +1,125 @@
+import threading
+import unittest
+
+from ..coalescing import SingleFlight, SingleFlightLayer
+from ..metrics import InMemorySink, MetricsLayer
+from ..proxy import EngineProxy
+
+
+class BlockingEngine(object):
+    """
+    Engine whose calls wait until released, so identical calls overlap.
+    """
+
+    def __init__(self, endpoint='http://localhost/api/3/action/'):
+        self.endpoint = endpoint
+        self.release = threading.Event()
+        self.calls = 0
+
+    def get_dataset(self, dataset_id, **kwargs):
+        self.calls += 1
+        self.release.wait(5)
+
+        if dataset_id == 'missing':
+            raise IOError('connection reset')
+
+        return {'success': True, 'result': {'id': dataset_id, 'tags': [], 'endpoint': self.endpoint}}
+
+    def delete_dataset(self, dataset_id, **kwargs):
+        self.calls += 1
+        self.release.wait(5)
+        return {'success': True}
+
+
+class TestSingleFlightLayer(unittest.TestCase):
+
+    def setUp(self):
+        self.group = SingleFlight()
+        self.sink = InMemorySink()
+        self.engine = BlockingEngine()
+        self.proxy = EngineProxy(self.engine, 'ckan', [MetricsLayer([self.sink]), SingleFlightLayer(self.group)])
+
+    def run_concurrently(self, function, count=5):
+        results = [None] * count
+
+        def run(index):
+            try:
+                results[index] = function()
+            except Exception as e:
+                results[index] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+
+        for thread in threads:
+            thread.start()
+
+        # Wait until the first call is in flight and the others are waiting for it
+        while self.engine.calls < 1 or (len(self.group) and
+                                        list(self.group._flights.values())[0].followers < count - 1):
+            threading.Event().wait(0.001)
+
+        self.engine.release.set()
+
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_identical_reads_are_coalesced(self):
+        # Execute
+        results = self.run_concurrently(lambda: self.proxy.get_dataset('a'))
+
+        # Verify
+        self.assertEqual(self.engine.calls, 1)
+        self.assertTrue(all(result['result']['id'] == 'a' for result in results))
+        self.assertEqual(len(set(id(result) for result in results)), 5)
+        stats = self.sink.snapshot()[0]
+        self.assertEqual((stats.calls, stats.coalesced), (5, 4))
+
+    def test_exceptions_are_shared(self):
+        # Execute
+        results = self.run_concurrently(lambda: self.proxy.get_dataset('missing'), count=3)
+
+        # Verify
+        self.assertEqual(self.engine.calls, 1)
+        self.assertTrue(all(isinstance(result, IOError) for result in results))
+
+    def test_writes_are_not_coalesced(self):
+        # Setup
+        self.engine.release.set()
+
+        # Execute
+        self.proxy.delete_dataset('a')
+        self.proxy.delete_dataset('a')
+
+        # Verify
+        self.assertEqual(self.engine.calls, 2)
+
+    def test_engines_with_the_same_name_are_kept_apart(self):
+        # Setup: an app declares an engine with the name of the site-wide service
+        other = BlockingEngine(endpoint='http://other/api/3/action/')
+        other_proxy = EngineProxy(other, 'ckan', [SingleFlightLayer(self.group)])
+        results = {}
+
+        def run(name, proxy):
+            results[name] = proxy.get_dataset('a')
+
+        threads = [threading.Thread(target=run, args=('site', self.proxy)),
+                   threading.Thread(target=run, args=('app', other_proxy))]
+
+        for thread in threads:
+            thread.start()
+
+        # Execute: both calls are in flight at the same time
+        while self.engine.calls < 1 or other.calls < 1:
+            threading.Event().wait(0.001)
+
+        self.engine.release.set()
+        other.release.set()
+
+        for thread in threads:
+            thread.join()
+
+        # Verify
+        self.assertEqual(self.engine.endpoint, results['site']['result']['endpoint'])
+        self.assertEqual(other.endpoint, results['app']['result']['endpoint'])
@@ -0,0 +1,133 @@
+import threading
+import time
+import unittest
+
+from django.test import override_settings
+from requests.auth import HTTPBasicAuth
+
+from ..credentials import AccessToken, AuthenticationError, CredentialManager, configure_service, \
+    get_credential_manager
+from ..transport import _access_token
+from .fakes import FakeClock
+
+
+class TokenServer(object):
+
+    def __init__(self):
+        self.requests = []
+        self.refresh_works = True
+        self.issued = 0
+
+    def __call__(self, token_url, data, client_auth):
+        self.requests.append(data['grant_type'])
+
+        if data['grant_type'] == 'password' and data['password'] != 'secret':
+            return 400, {'error': 'invalid_grant', 'error_description': 'Wrong password.'}
+
+        if data['grant_type'] == 'refresh_token' and not self.refresh_works:
+            return 400, {'error': 'invalid_grant'}
+
+        self.issued += 1
+        return 200, {'access_token': 'token{0}'.format(self.issued), 'expires_in': 100, 'refresh_token': 'refresh'}
+
+
+class TestAccessToken(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(now=1000.0)
+        self.server = TokenServer()
+        self.token = AccessToken('https://host/o/token/', 'client', 'client secret', 'user', 'secret',
+                                 refresh_margin=10, clock=self.clock)
+
+    def test_token_reused_until_it_is_about_to_expire(self):
+        self.assertEqual(['token1'] * 3, [self.token.get(self.server) for _ in range(3)])
+
+        self.clock.now += 91
+        self.assertEqual('token2', self.token.get(self.server))
+        self.assertEqual(['password', 'refresh_token'], self.server.requests)
+        self.assertEqual({'authentications': 1, 'refreshes': 1, 'avoided': 0},
+                         dict((key, self.token.as_dict()[key]) for key in ('authentications', 'refreshes', 'avoided')))
+
+    def test_threads_waiting_for_a_token_share_it(self):
+        requested = threading.Event()
+        release = threading.Event()
+
+        def slow_server(*args):
+            requested.set()
+            release.wait(5)
+            return self.server(*args)
+
+        first = threading.Thread(target=self.token.get, args=(slow_server,))
+        first.start()
+        requested.wait(5)
+
+        second = threading.Thread(target=self.token.get, args=(self.server,))
+        second.start()
+
+        # Let the second thread reach the lock held by the first
+        time.sleep(0.1)
+        release.set()
+        first.join()
+        second.join()
+
+        self.assertEqual(['password'], self.server.requests)
+        self.assertEqual(1, self.token.as_dict()['avoided'])
+
+    def test_failed_refresh_logs_in_again(self):
+        self.token.get(self.server)
+        self.server.refresh_works = False
+        self.token.invalidate('token1')
+
+        self.assertEqual('token2', self.token.get(self.server))
+        self.assertEqual(['password', 'refresh_token', 'password'], self.server.requests)
+
+        # Tokens renewed by another thread are kept
+        self.token.invalidate('token1')
+        self.assertEqual('token2', self.token.get(self.server))
+
+    def test_wrong_password(self):
+        token = AccessToken('https://host/o/token/', 'client', 'client secret', 'user', 'wrong')
+        self.assertRaises(AuthenticationError, token.get, self.server)
+        self.assertNotIn('wrong', repr(token))
+
+
+class TestCredentialManager(unittest.TestCase):
+
+    def test_tokens_by_host_and_username(self):
+        manager = CredentialManager()
+        options = {'TOKEN_URL': 'https://host/o/token/', 'CLIENT_ID': 'client'}
+        token = manager.register('https://Host/geoserver/rest/', 'user', 'secret', options)
+
+        self.assertIs(token, manager.register('https://host/geoserver/rest/', 'user', 'secret', options))
+        self.assertEqual(1, token.as_dict()['avoided'])
+        self.assertIs(token, manager.lookup('https://host/geoserver/wms', 'user', 'secret'))
+        self.assertIsNone(manager.lookup('https://host/geoserver/wms', 'other', 'secret'))
+        self.assertIsNone(manager.lookup('https://other/geoserver/wms', 'user', 'secret'))
+
+        # Another account with the same username does not get the token
+        self.assertIsNone(manager.lookup('https://host/geoserver/wms', 'user', 'wrong'))
+        self.assertIsNone(manager.lookup('https://host/geoserver/wms', 'user', None))
+
+        # A new password gets a new token
+        self.assertIsNot(token, manager.register('https://host/geoserver/rest/', 'user', 'changed', options))
+
+    @override_settings(TETHYS_DATASETS_SERVICE_TOKENS={'oauth': {'TOKEN_URL': 'https://host/o/token/'}})
+    def test_only_listed_services_use_tokens(self):
+        self.addCleanup(get_credential_manager().clear)
+
+        class Service(object):
+            def __init__(self, name):
+                self.name, self.username, self.password = name, 'admin', 'geoserver'
+
+        # Services using basic auth keep sending it
+        self.assertIsNone(configure_service(Service('geoserver'), 'https://basic/geoserver/rest/'))
+        self.assertIsNotNone(configure_service(Service('oauth'), 'https://host/geoserver/rest/'))
+
+    def test_requests_need_the_password_of_the_account(self):
+        self.addCleanup(get_credential_manager().clear)
+        token = get_credential_manager().register('https://gs.example.com/geoserver/rest/', 'admin', 'secret',
+                                                  {'TOKEN_URL': 'https://gs.example.com/o/token/'})
+
+        self.assertIs(token, _access_token('https://gs.example.com/geoserver/wms', ('admin', 'secret')))
+        self.assertIs(token, _access_token('https://gs.example.com/geoserver/wms', HTTPBasicAuth('admin', 'secret')))
+        self.assertIsNone(_access_token('https://gs.example.com/geoserver/wms', ('admin', 'WRONG')))
@@ -0,0 +1,55 @@
+"""
+Stand-ins shared by the tests.
+"""
+import threading
+
+from django.db import connection
+from django.test import TestCase
+
+from . import STANDALONE
+
+_test_database_lock = threading.Lock()
+_test_database_created = False
+
+
+class FakeClock(object):
+    """
+    Clock that only moves when told to, passed where the code under test takes a clock callable.
+    """
+
+    def __init__(self, now=0.0, step=0.0):
+        """
+        Constructor
+
+        Args:
+          now (float): The starting time in seconds.
+          step (float): Seconds the clock moves forward every time it is read.
+        """
+        self.now = now
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class DatabaseTestCase(TestCase):
+    """
+    TestCase for tests that use the database, each test runs in a transaction that is rolled back. When the tests run
+    without a Django project, the test database is created the first time such a test runs, otherwise the test runner
+    of the project creates it.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        global _test_database_created
+
+        with _test_database_lock:
+            if STANDALONE and not _test_database_created:
+                connection.creation.create_test_db(verbosity=0)
+                _test_database_created = True
+
+        super(DatabaseTestCase, cls).setUpClass()
@@ -0,0 +1,141 @@
+import json
+import threading
+import unittest
+
+from django.test import RequestFactory
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .. import federated, views
+from ..federated import ServiceSearchResult, iter_federated_search, merge_results
+from ..models import DatasetService
+from ..registry import get_service_registry
+from .fakes import DatabaseTestCase
+from .mock_server import MockCkanApp, MockServer
+
+
+class FederatedTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        get_service_registry(DatasetService).clear()
+        self.addCleanup(get_service_registry(DatasetService).clear)
+
+        self.apps = {'ckan': MockCkanApp(), 'slow': MockCkanApp(latency=2)}
+
+        for name, app in sorted(self.apps.items()):
+            server = MockServer(app).start()
+            self.addCleanup(server.stop)
+            DatasetService.objects.create(name=name, endpoint=server.url + '/api/3/action/')
+
+        for name in ('rainfall', 'rainfall-stations', 'streamflow'):
+            self.apps['ckan'].package_create({'name': name, 'title': name.title()})
+
+        self.apps['slow'].package_create({'name': 'rainfall', 'title': 'Rainfall'})
+
+
+
+class TestIterFederatedSearch(FederatedTestCase):
+
+    def test_results_come_as_services_answer(self):
+        finished = []
+        done = threading.Event()
+        search_service = federated._search_service
+
+        def record(service_name, *args):
+            result = search_service(service_name, *args)
+
+            if service_name == 'slow':
+                finished.append(result)
+                done.set()
+
+            return result
+
+        with mock.patch.object(federated, '_search_service', record):
+            results = list(iter_federated_search('rainfall', timeout={'ckan': 5, 'slow': 0.3}))
+
+            # The requests of the late call give up at the deadline instead of keeping a thread of the pool busy
+            self.assertTrue(done.wait(1.5))
+
+        self.assertEqual([('ckan', ServiceSearchResult.OK), ('slow', ServiceSearchResult.TIMEOUT)],
+                         [(result.service, result.status) for result in results])
+        self.assertEqual((2, ['rainfall', 'rainfall-stations']),
+                         (results[0].count, sorted(dataset['name'] for dataset in results[0].datasets)))
+        self.assertEqual(ServiceSearchResult.ERROR, finished[0].status)
+
+    def test_errors(self):
+        self.apps['slow'].latency = 0
+        self.apps['slow'].package_search = None
+        results = dict((result.service, result) for result in iter_federated_search('rainfall', limit=1,
+                                                                                     services=['ckan', 'slow', 'gone']))
+
+        self.assertEqual((ServiceSearchResult.OK, 1), (results['ckan'].status, len(results['ckan'].datasets)))
+        self.assertEqual(ServiceSearchResult.ERROR, results['slow'].status)
+        self.assertIn('gone', results['gone'].error)
+
+    def test_engines_are_looked_up_in_the_calling_thread(self):
+        threads = []
+
+        def get_dataset_engine(name):
+            threads.append(threading.current_thread())
+            return engine(name)
+
+        engine = federated.get_dataset_engine
+
+        with mock.patch.object(federated, 'get_dataset_engine', get_dataset_engine):
+            list(iter_federated_search('rainfall', services=['ckan']))
+
+        self.assertEqual([threading.current_thread()], threads)
+
+
+class TestMergeResults(unittest.TestCase):
+
+    def test_datasets_are_interleaved_by_rank(self):
+        merged = merge_results([
+            ServiceSearchResult('ckan', ServiceSearchResult.OK, [{'name': 'rainfall'}, {'name': 'streamflow'},
+                                                                  {'id': 'no-name'}]),
+            ServiceSearchResult('slow', ServiceSearchResult.TIMEOUT),
+            ServiceSearchResult('hydroshare', ServiceSearchResult.OK, [{'name': 'Snowpack'}, {'name': 'Rainfall'}]),
+        ])
+
+        self.assertEqual([('ckan', 'rainfall'), ('hydroshare', 'Snowpack'), ('ckan', 'streamflow'),
+                          ('ckan', 'no-name')],
+                         [(entry['service'], entry['dataset'].get('name') or entry['dataset']['id'])
+                          for entry in merged])
+
+        # The first service with a dataset wins, the others are recorded
+        self.assertEqual(['hydroshare'], merged[0]['duplicates'])
+
+
+class TestSearchView(FederatedTestCase):
+
+    def get(self, **params):
+        return views.search(RequestFactory().get('/search/', params))
+
+    def test_merged_results(self):
+        response = self.get(q='rainfall', service='ckan', limit='1')
+        content = json.loads(response.content.decode('utf-8'))
+
+        self.assertEqual(['ckan'], [service['service'] for service in content['services']])
+        self.assertEqual(1, len(content['results']))
+
+    def test_stream(self):
+        response = self.get(q='rainfall', stream='1', timeout='0.3')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+
+        self.assertEqual([('ckan', 'ok'), ('slow', 'timeout')], [(line['service'], line['status'])
+                                                                 for line in lines[:-1]])
+        self.assertEqual(2, len(lines[-1]['results']))
+
+    def test_bad_parameters(self):
+        self.assertEqual(400, self.get().status_code)
+        self.assertEqual(400, self.get(q='rainfall', timeout='soon').status_code)
+
+        with mock.patch.object(federated, 'get_dataset_engine') as get_dataset_engine:
+            response = self.get(q='rainfall', service=['ckan', 'other'])
+
+        self.assertEqual(400, response.status_code)
+        self.assertIn('other', json.loads(response.content.decode('utf-8'))['error'])
+        self.assertFalse(get_dataset_engine.called)
@@ -0,0 +1,181 @@
+import time
+import unittest
+
+from ..health import CircuitBreaker, CircuitBreakerLayer, CircuitOpenError, EndpointHealth, choose_endpoint, \
+    get_endpoint_health, service_endpoints
+from ..proxy import EngineProxy
+from ..transport import SessionPool
+from .fakes import FakeClock
+from .mock_server import MockServer
+
+
+class FakeEngine(object):
+
+    def __init__(self):
+        self.fail = False
+        self.calls = 0
+
+    def get_dataset(self, dataset_id, **kwargs):
+        self.calls += 1
+
+        if self.fail:
+            raise IOError('connection refused')
+
+        return {'success': True, 'result': {'id': dataset_id}}
+
+
+class FakeService(object):
+
+    def __init__(self, endpoint, mirrors=''):
+        self.endpoint = endpoint
+        self.mirrors = mirrors
+        self.failure_threshold = 2
+        self.breaker_cooldown = 30
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.engine = FakeEngine()
+        self.health = EndpointHealth('http://a', CircuitBreaker(failure_threshold=2, cooldown=30, clock=self.clock))
+        self.proxy = EngineProxy(self.engine, 'ckan', [CircuitBreakerLayer(self.health, clock=self.clock)])
+
+    def fail_twice(self):
+        self.engine.fail = True
+
+        for _ in range(2):
+            self.assertRaises(IOError, self.proxy.get_dataset, 'a')
+
+    def test_opens_after_threshold(self):
+        # Execute
+        self.fail_twice()
+
+        # Verify
+        self.assertEqual(self.health.breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitOpenError, self.proxy.get_dataset, 'a')
+        self.assertEqual(self.engine.calls, 2)
+
+    def test_half_open_lets_one_test_call_through(self):
+        # Setup
+        self.fail_twice()
+        self.clock.now = 30
+
+        # Execute
+        self.assertTrue(self.health.breaker.allow())
+
+        # Verify
+        self.assertFalse(self.health.breaker.allow())
+
+    def test_successful_test_call_closes(self):
+        # Setup
+        self.fail_twice()
+        self.clock.now = 30
+        self.engine.fail = False
+
+        # Execute
+        result = self.proxy.get_dataset('a')
+
+        # Verify
+        self.assertTrue(result['success'])
+        self.assertEqual(self.health.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_test_call_opens_again(self):
+        # Setup
+        self.fail_twice()
+        self.clock.now = 30
+
+        # Execute
+        self.assertRaises(IOError, self.proxy.get_dataset, 'a')
+
+        # Verify
+        self.assertEqual(self.health.breaker.state, CircuitBreaker.OPEN)
+        self.clock.now = 59
+        self.assertRaises(CircuitOpenError, self.proxy.get_dataset, 'a')
+
+
+class TestChooseEndpoint(unittest.TestCase):
+
+    def test_mirrors_are_parsed(self):
+        # Execute
+        endpoints = service_endpoints(FakeService('http://a', '\n http://b \nhttp://a\n\nhttp://c'))
+
+        # Verify
+        self.assertEqual(endpoints, ['http://a', 'http://b', 'http://c'])
+
+    def test_fastest_available_endpoint_is_chosen(self):
+        # Setup
+        service = FakeService('http://test-main', 'http://test-fast\nhttp://test-down')
+        main, fast, down = [choose_endpoint(FakeService(endpoint)) for endpoint in service_endpoints(service)]
+        main.record_success(0.5)
+        fast.record_success(0.1)
+        down.record_failure()
+        down.record_failure()
+
+        # Execute
+        chosen = choose_endpoint(service)
+
+        # Verify
+        self.assertIs(chosen, fast)
+
+    def test_main_endpoint_when_none_is_available(self):
+        # Setup
+        service = FakeService('http://test-gone', 'http://test-gone-too')
+        main = choose_endpoint(FakeService('http://test-gone'))
+
+        for endpoint in service_endpoints(service):
+            health = choose_endpoint(FakeService(endpoint))
+            health.record_failure()
+            health.record_failure()
+
+        # Execute
+        chosen = choose_endpoint(service)
+
+        # Verify
+        self.assertIs(chosen, main)
+
+    def test_unmeasured_mirror_comes_after_measured_endpoint(self):
+        # Setup
+        service = FakeService('http://test-measured', 'http://test-new')
+        choose_endpoint(FakeService('http://test-measured')).record_success(2.0)
+
+        # Execute
+        chosen = choose_endpoint(service)
+
+        # Verify
+        self.assertEqual(chosen.endpoint, 'http://test-measured')
+
+    def test_breaker_settings_of_one_service_do_not_change_another(self):
+        # Execute
+        strict = get_endpoint_health('http://test-shared', failure_threshold=1, cooldown=10)
+        lenient = get_endpoint_health('http://test-shared', failure_threshold=10, cooldown=60)
+
+        # Verify
+        self.assertIsNot(strict, lenient)
+        self.assertEqual(strict.breaker.failure_threshold, 1)
+        self.assertIs(strict, get_endpoint_health('http://test-shared', failure_threshold=1, cooldown=10))
+
+
+class HungApp(object):
+
+    def __call__(self, request):
+        time.sleep(0.5)
+        return 200, {}, b'{}'
+
+
+class TestRequestTimeout(unittest.TestCase):
+
+    def test_hung_endpoint_trips_the_breaker(self):
+        # Setup
+        pool = SessionPool(timeout=(1, 0.1))
+        health = EndpointHealth('http://hung', CircuitBreaker(failure_threshold=1, cooldown=30))
+
+        with MockServer(HungApp()) as server:
+            engine = EngineProxy(pool, 'ckan', [CircuitBreakerLayer(health)])
+
+            # Execute
+            self.assertRaises(IOError, engine.request, 'get', server.url + '/api')
+            pool.clear()
+
+        # Verify
+        self.assertRaises(CircuitOpenError, engine.request, 'get', 'http://hung/api')
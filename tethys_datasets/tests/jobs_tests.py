@@ -0,0 +1,172 @@
+import json
+from datetime import timedelta
+
+import requests
+from django.contrib.auth.models import AnonymousUser, User
+from django.http import Http404
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .. import jobs, views
+from ..jobs import JobWorkerPool, STALE_AFTER, submit_job
+from ..models import DatasetJob, DatasetService
+from ..registry import get_service_registry
+from .bulk_tests import refused_error
+from .fakes import DatabaseTestCase
+
+# No URLs are needed, but the redirect to the login page resolves LOGIN_URL against a URLconf
+urlpatterns = []
+
+
+class JobTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        get_service_registry(DatasetService).clear()
+        self.addCleanup(get_service_registry(DatasetService).clear)
+        DatasetService.objects.create(name='ckan', endpoint='http://localhost/api/3/action/', job_concurrency=1)
+        self.pool = JobWorkerPool(workers=1)
+
+    def run_claimed(self, outcome):
+        """
+        Claim the next job and run it with run_job answering or raising the given outcome.
+        """
+        job = self.pool.claim()
+
+        with mock.patch.object(jobs, 'run_job', side_effect=[outcome]):
+            self.pool.run(job)
+
+        return DatasetJob.objects.get(pk=job.pk)
+
+    def ready(self, job):
+        DatasetJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+
+
+class TestSubmitJob(JobTestCase):
+
+    def test_methods(self):
+        self.assertEqual('{"id": "r"}', submit_job('ckan', 'update_resource', id='r').arguments)
+        submit_job('geoserver', 'create_layer', spatial=True, layer_id='topp:roads')
+
+        with self.assertRaises(ValueError):
+            submit_job('ckan', 'delete_resource', id='r')
+
+        with self.assertRaises(ValueError):
+            submit_job('geoserver', 'delete_layer', spatial=True, layer_id='topp:roads')
+
+    def test_owner(self):
+        user = User.objects.create_user('alice')
+
+        self.assertEqual(user, submit_job('ckan', 'update_resource', owner=user).owner)
+        self.assertIsNone(submit_job('ckan', 'update_resource', owner=AnonymousUser()).owner)
+
+
+class TestJobWorkerPool(JobTestCase):
+
+    def test_outcomes(self):
+        submit_job('ckan', 'update_resource', id='r')
+        job = self.run_claimed({'success': True, 'result': {'id': 'r'}})
+        self.assertEqual((DatasetJob.SUCCEEDED, {'id': 'r'}), (job.status, json.loads(job.result)['result']))
+
+        # Answers of the service are final
+        submit_job('ckan', 'update_resource', id='r')
+        job = self.run_claimed({'success': False, 'error': 'Not found'})
+        self.assertEqual((DatasetJob.FAILED, 'Not found', 1), (job.status, job.error, job.attempts))
+
+    def test_idempotent_jobs_are_retried(self):
+        job = submit_job('ckan', 'update_resource', max_attempts=2, id='r')
+        self.assertEqual(DatasetJob.QUEUED, self.run_claimed(requests.ReadTimeout('timed out')).status)
+
+        self.ready(job)
+        job = self.run_claimed(None)
+        self.assertEqual((DatasetJob.FAILED, 2), (job.status, job.attempts))
+
+    def test_creating_jobs_are_retried_only_when_the_service_was_not_reached(self):
+        submit_job('ckan', 'create_resource', dataset_id='rainfall', name='Rainfall')
+
+        # The service may have created the resource before the response was lost
+        job = self.run_claimed(requests.ReadTimeout('timed out'))
+        self.assertEqual((DatasetJob.FAILED, 'timed out'), (job.status, job.error))
+
+        submit_job('ckan', 'create_resource', dataset_id='rainfall', name='Rainfall')
+        job = self.run_claimed(None)
+        self.assertEqual(DatasetJob.FAILED, job.status)
+
+        job = submit_job('ckan', 'create_resource', dataset_id='rainfall', name='Rainfall')
+        self.assertEqual(DatasetJob.QUEUED, self.run_claimed(refused_error()).status)
+
+        self.ready(job)
+        self.assertEqual(DatasetJob.SUCCEEDED, self.run_claimed({'success': True}).status)
+
+    def test_stale_jobs(self):
+        again = submit_job('ckan', 'update_resource', id='r')
+        exhausted = submit_job('ckan', 'update_resource', max_attempts=1, id='r')
+        creating = submit_job('ckan', 'create_resource', dataset_id='rainfall', name='Rainfall')
+        stale = timezone.now() - timedelta(seconds=STALE_AFTER + 1)
+        DatasetJob.objects.update(status=DatasetJob.RUNNING, worker='stopped', attempts=1, heartbeat_at=stale)
+
+        self.assertEqual(1, self.pool.requeue_stale())
+
+        for job in (again, exhausted, creating):
+            job.refresh_from_db()
+
+        self.assertEqual((DatasetJob.QUEUED, ''), (again.status, again.worker))
+        self.assertEqual((DatasetJob.FAILED, ''), (exhausted.status, exhausted.worker))
+        self.assertIsNotNone(exhausted.finished_at)
+
+        # The resource may have been created before the worker stopped
+        self.assertEqual((DatasetJob.FAILED, ''), (creating.status, creating.worker))
+
+    def test_claim(self):
+        first = submit_job('ckan', 'update_resource', id='r')
+        second = submit_job('ckan', 'update_resource', id='s')
+        missing = submit_job('other', 'update_resource', id='r')
+
+        self.assertEqual(first.pk, self.pool.claim().pk)
+
+        # A pool that counted the running jobs before the first claim still does not exceed the limit
+        self.assertFalse(JobWorkerPool()._claim_job(second, 1, timezone.now()))
+
+        # The service runs one job at a time, and the job of the unknown service fails
+        self.assertIsNone(JobWorkerPool().claim())
+        missing.refresh_from_db()
+        self.assertEqual(DatasetJob.FAILED, missing.status)
+
+
+class TestJobStatus(JobTestCase):
+
+    def setUp(self):
+        super(TestJobStatus, self).setUp()
+        self.owner = User.objects.create_user('alice')
+        self.job = submit_job('ckan', 'update_resource', owner=self.owner, id='r')
+
+    def get(self, user, wait=None):
+        request = RequestFactory().get('/jobs/{0}/'.format(self.job.job_id), {'wait': wait} if wait else {})
+        request.user = user
+        return views.job_status(request, self.job.job_id)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'], LOGIN_URL='/accounts/login/', ROOT_URLCONF=__name__)
+    def test_only_the_owner_and_staff_see_the_job(self):
+        self.assertEqual(302, self.get(AnonymousUser()).status_code)
+
+        with self.assertRaises(Http404):
+            self.get(User.objects.create_user('bob'))
+
+        self.assertEqual(self.job.job_id, json.loads(self.get(self.owner).content.decode('utf-8'))['job_id'])
+        self.assertEqual(200, self.get(User.objects.create_user('carol', is_staff=True)).status_code)
+
+    def test_wait_is_capped(self):
+        clock = [0.0]
+
+        def sleep(seconds):
+            clock[0] += seconds
+
+        with mock.patch.object(views.time, 'time', lambda: clock[0]), \
+                mock.patch.object(views.time, 'sleep', sleep):
+            self.get(self.owner, wait=600)
+
+        self.assertEqual(views.MAX_JOB_WAIT, clock[0])
@@ -0,0 +1,191 @@
+import shutil
+import tempfile
+import time
+import unittest
+
+from django.test import RequestFactory
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .. import views
+from ..map_cache import MapCache, MapCacheInvalidationLayer, geoserver_root, map_service_url, request_layers
+from ..models import SpatialDatasetService
+from ..proxy import EngineProxy
+from ..registry import get_service_registry
+from .fakes import DatabaseTestCase, FakeClock
+from .mock_server import MockServer
+
+
+class LayerEngine(object):
+
+    def update_layer(self, layer_id, debug=False, **kwargs):
+        return {'success': True}
+
+    def delete_workspace(self, workspace_id, purge=False, recurse=False, debug=False):
+        return {'success': True}
+
+
+class TestMapCache(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.clock = FakeClock(now=time.time())
+        self.cache = MapCache(self.location, max_size=100, timeout=60, max_entry_size=50,
+                              clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def store(self, layers, body=b'x' * 10, **params):
+        params = dict(params, layers=layers)
+        self.cache.set('gs', 'wms', params, 'image/png', [body]).file.close()
+        return params
+
+    def read(self, params):
+        entry = self.cache.get('gs', 'wms', params)
+
+        if entry is None:
+            return None
+
+        with entry.file:
+            return entry.file.read()
+
+    def test_request_layers(self):
+        self.assertEqual(['roads', 'states'], request_layers('wms', {'LAYERS': 'topp:states,topp:roads'}))
+        self.assertEqual(['roads'], request_layers('gwc/service/tms/1.0.0/topp:roads@EPSG:900913@png/1/0/0.png', {}))
+        self.assertEqual('http://host/geoserver', geoserver_root('http://host/geoserver/rest/'))
+
+    def test_parameter_order_and_case(self):
+        self.cache.set('gs', 'wms', {'LAYERS': 'a', 'BBOX': '0,0,1,1'}, 'image/png', [b'tile']).file.close()
+        entry = self.cache.get('gs', 'wms', {'bbox': '0,0,1,1', 'layers': 'a'})
+        entry.file.close()
+        self.assertEqual('image/png', entry.content_type)
+
+    def test_least_recently_used_evicted(self):
+        first = self.store('a', bbox='1')
+        second = self.store('a', bbox='2')
+
+        for i in range(9):
+            self.read(first)
+            self.store('b', bbox=str(i))
+
+        self.assertEqual(b'x' * 10, self.read(first))
+        self.assertIsNone(self.read(second))
+        self.assertLessEqual(self.cache.size, 100)
+
+    def test_large_responses_not_kept(self):
+        entry = self.cache.set('gs', 'wms', {'layers': 'a'}, 'image/png', [b'x' * 60])
+
+        with entry.file:
+            self.assertEqual(60, len(entry.file.read()))
+
+        self.assertIsNone(self.read({'layers': 'a'}))
+        self.assertEqual(0, self.cache.size)
+
+    def test_timeout(self):
+        params = self.store('a')
+        self.clock.now += 61
+        self.assertIsNone(self.read(params))
+
+    def test_index_rebuilt_from_disk(self):
+        params = self.store('a')
+        cache = MapCache(self.location, max_size=100, clock=self.clock)
+        self.assertEqual(b'x' * 10, self.read(params))
+        cache.get('gs', 'wms', params).file.close()
+        self.assertEqual(10, cache.size)
+
+    def test_write_invalidates_changed_layers(self):
+        states = self.store('topp:states')
+        roads = self.store('topp:roads')
+        capabilities = self.store('', request='GetCapabilities')
+        engine = EngineProxy(LayerEngine(), 'gs', [MapCacheInvalidationLayer(self.cache)])
+
+        engine.update_layer('topp:states', title='States')
+
+        self.assertIsNone(self.read(states))
+        self.assertIsNone(self.read(capabilities))
+        self.assertEqual(b'x' * 10, self.read(roads))
+        self.assertEqual(10, self.cache.size)
+
+        engine.delete_workspace('topp')
+
+        self.assertIsNone(self.read(roads))
+        self.assertEqual(0, self.cache.size)
+
+
+TRAVERSALS = (
+    'gwc/service/../../rest/workspaces.json',
+    'gwc/service/wms/../../../rest/security/usergroup/users',
+    'gwc/service/%2e%2e/%2e%2e/rest',
+    'gwc/service/%252e%252e/rest',
+    '../rest/wms',
+    './wms',
+    'topp//wms',
+    'gwc/service/',
+    'gwc/service/rest/seed',
+    'rest/wms',
+)
+
+
+class TestMapServiceUrl(unittest.TestCase):
+
+    def test_map_services(self):
+        endpoint = 'http://host/geoserver/rest/'
+
+        self.assertEqual('http://host/geoserver/wms', map_service_url(endpoint, 'wms'))
+        self.assertEqual('http://host/geoserver/topp/ows', map_service_url(endpoint, 'topp/ows'))
+        self.assertEqual('http://host/geoserver/gwc/service/wmts', map_service_url(endpoint, 'gwc/service/wmts'))
+        self.assertEqual('http://host/geoserver/gwc/service/tms/1.0.0/topp:roads@EPSG:900913@png/1/0/0.png',
+                         map_service_url(endpoint, 'gwc/service/tms/1.0.0/topp:roads@EPSG:900913@png/1/0/0.png'))
+
+    def test_other_paths_are_refused(self):
+        for path in TRAVERSALS:
+            self.assertIsNone(map_service_url('http://host/geoserver/rest/', path), path)
+
+        self.assertIsNone(map_service_url('http://host/geoserver/../rest/', 'wms'))
+
+
+class TestMapProxy(DatabaseTestCase):
+
+    def setUp(self):
+        self.paths = []
+
+        def app(request):
+            self.paths.append(request.path.split('?')[0])
+            return 200, {'Content-Type': 'image/png'}, b'tile'
+
+        self.server = MockServer(app)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location, True)
+        cache = MapCache(self.location, max_size=1000, timeout=60)
+        patch = mock.patch.object(views, 'get_map_cache', lambda: cache)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        get_service_registry(SpatialDatasetService).clear()
+        self.addCleanup(get_service_registry(SpatialDatasetService).clear)
+        SpatialDatasetService.objects.create(name='gs', endpoint=self.server.url + '/geoserver/rest/')
+
+    def get(self, path):
+        request = RequestFactory().get('/maps/gs/' + path, {'layers': 'topp:roads'})
+        response = views.map_proxy(request, 'gs', path)
+        return response.status_code, response.get('X-Cache')
+
+    def test_map_requests_are_cached(self):
+        self.assertEqual((200, 'MISS'), self.get('topp/wms'))
+        self.assertEqual((200, 'HIT'), self.get('topp/wms'))
+        self.assertEqual(['/geoserver/topp/wms'], self.paths)
+
+    def test_traversals_are_refused(self):
+        for path in TRAVERSALS:
+            self.assertEqual((400, None), self.get(path), path)
+
+        # Nothing reached GeoServer or the cache
+        self.assertEqual([], self.paths)
+        self.assertEqual((200, 'MISS'), self.get('gwc/service/wms'))
@@ -0,0 +1,105 @@
+import unittest
+
+from ..metrics import CallSample, InMemorySink, MetricsLayer, PrometheusSink
+from ..proxy import EngineProxy
+from ..transport import SessionPool, track_transfers
+from .mock_server import MockServer, SuccessApp
+from .fakes import FakeClock
+
+
+class FakeEngine(object):
+
+    def get_dataset(self, dataset_id, **kwargs):
+        return {'success': True, 'result': {'id': dataset_id}}
+
+    def search_datasets(self, query=None, **kwargs):
+        return {'success': False, 'error': {'message': 'failed'}}
+
+    def delete_dataset(self, dataset_id, **kwargs):
+        raise IOError('connection refused')
+
+
+class TestMetricsLayer(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = InMemorySink(buckets=(0.01, 0.1))
+        self.proxy = EngineProxy(FakeEngine(), 'ckan', [MetricsLayer([self.sink], clock=FakeClock(step=0.02))])
+
+    def test_calls_are_counted_per_method(self):
+        # Execute
+        self.proxy.get_dataset('a')
+        self.proxy.get_dataset('b')
+        self.proxy.search_datasets(query={'name': 'a'})
+
+        # Verify
+        stats = dict((s.method, s) for s in self.sink.snapshot())
+        self.assertEqual(stats['get_dataset'].calls, 2)
+        self.assertEqual(stats['get_dataset'].errors, 0)
+        self.assertAlmostEqual(stats['get_dataset'].mean_duration, 0.02)
+        self.assertEqual(stats['get_dataset'].bucket_counts, [0, 2, 0])
+        self.assertEqual(stats['search_datasets'].error_rate, 1.0)
+
+    def test_exceptions_are_errors(self):
+        # Execute
+        self.assertRaises(IOError, self.proxy.delete_dataset, 'a')
+
+        # Verify
+        stats = self.sink.snapshot()[0]
+        self.assertEqual((stats.method, stats.calls, stats.errors), ('delete_dataset', 1, 1))
+
+    def test_failing_sink_does_not_break_calls(self):
+        # Setup
+        class BrokenSink(object):
+            def record(self, sample):
+                raise ValueError()
+
+        proxy = EngineProxy(FakeEngine(), 'ckan', [MetricsLayer([BrokenSink(), self.sink])])
+
+        # Execute
+        result = proxy.get_dataset('a')
+
+        # Verify
+        self.assertTrue(result['success'])
+        self.assertEqual(self.sink.snapshot()[0].calls, 1)
+
+
+class TestPrometheusSink(unittest.TestCase):
+
+    def test_render(self):
+        # Setup
+        sink = PrometheusSink(buckets=(0.1, 1.0))
+        sink.record(CallSample('ckan', 'get_dataset', 0.5, False, 10, 200))
+        sink.record(CallSample('ckan', 'get_dataset', 2.0, True, 10, 0))
+
+        # Execute
+        text = sink.render()
+
+        # Verify
+        self.assertIn('tethys_datasets_call_duration_seconds_bucket{service="ckan",method="get_dataset",le="1.0"} 1',
+                      text)
+        self.assertIn('tethys_datasets_call_duration_seconds_bucket{service="ckan",method="get_dataset",le="+Inf"} 2',
+                      text)
+        self.assertIn('tethys_datasets_call_duration_seconds_count{service="ckan",method="get_dataset"} 2', text)
+        self.assertIn('tethys_datasets_call_errors_total{service="ckan",method="get_dataset"} 1', text)
+        self.assertIn('tethys_datasets_received_bytes_total{service="ckan",method="get_dataset"} 200', text)
+
+
+class TestTrackTransfers(unittest.TestCase):
+
+    def test_bytes_are_counted(self):
+        # Setup
+        pool = SessionPool()
+
+        with MockServer(SuccessApp()) as server:
+            # Execute
+            with track_transfers() as outer:
+                with track_transfers() as inner:
+                    response = pool.request('post', server.url + '/api', data=b'x' * 100)
+
+            pool.clear()
+
+        # Verify
+        self.assertEqual(inner.requests, 1)
+        self.assertEqual(inner.bytes_sent, 100)
+        self.assertEqual(inner.bytes_received, len(response.content))
+        self.assertEqual(outer.bytes_received, inner.bytes_received)
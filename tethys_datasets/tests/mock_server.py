@@ -0,0 +1,487 @@
+"""
+In-process stand-in HTTP server for exercising engines without a live dataset service.
+
+MockCkanApp implements the CKAN action API and MockGeoServerApp a small part of the GeoServer REST API. Both can be
+served together with route_by_prefix().
+"""
+import datetime
+import email
+import json
+import re
+import sys
+import threading
+import time
+import uuid
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+def json_response(data, status=200):
+    """
+    Build a (status, headers, body) response tuple with a JSON body.
+    """
+    return status, {'Content-Type': 'application/json'}, json.dumps(data).encode('utf-8')
+
+
+class SuccessApp(object):
+    """
+    Answers every request with an empty successful CKAN action response.
+    """
+
+    def __call__(self, request):
+        return json_response({'help': '', 'success': True, 'result': []})
+
+
+def route_by_prefix(routes):
+    """
+    Build an app that dispatches requests to other apps by path prefix.
+
+    Args:
+      routes (dict): Apps keyed by path prefix (e.g.: {'/api/3/action': MockCkanApp(), '/geoserver': ...}).
+    """
+    def app(request):
+        for prefix, routed_app in routes.items():
+            if request.path.startswith(prefix):
+                return routed_app(request)
+
+        return 404, {'Content-Type': 'text/plain'}, b'Not Found'
+
+    return app
+
+
+class MockCkanApp(object):
+    """
+    In-memory stand-in for the CKAN action API (/api/3/action/<action>).
+
+    Implements the actions used by the CKAN engine: package_list, current_package_list_with_resources,
+    package_search, package_show, package_create, package_update, package_delete, resource_search, resource_show,
+    resource_create, resource_update, resource_delete and recently_changed_packages_activity_list. Searches support
+    "field:value" terms and "field:[from TO to]" ranges in q and fq.
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        Constructor
+
+        Args:
+          latency (float, optional): Seconds each request is delayed to simulate the network. Defaults to 0.
+        """
+        self.latency = latency
+        self.packages = {}
+        self.resources = {}
+        self.activities = []
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        action = request.path.split('?')[0].rstrip('/').split('/')[-1]
+        handler = getattr(self, action, None)
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.requests += 1
+
+            if handler is None:
+                return self._error('Action "{0}" not found.'.format(action), 400)
+
+            try:
+                return json_response({'help': '', 'success': True, 'result': handler(request.data())})
+            except KeyError as e:
+                return self._error('Not found: {0}'.format(e), 404)
+
+    @staticmethod
+    def _error(message, status):
+        return json_response({'help': '', 'success': False, 'error': {'message': message}}, status)
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.utcnow().isoformat()
+
+    def _record(self, activity_type, package):
+        package['metadata_modified'] = self._now()
+        self.activities.append({'activity_type': activity_type, 'object_id': package['id'],
+                                'timestamp': package['metadata_modified']})
+
+    def _get_package(self, id_or_name):
+        if id_or_name in self.packages:
+            return self.packages[id_or_name]
+
+        for package in self.packages.values():
+            if package['name'] == id_or_name:
+                return package
+
+        raise KeyError(id_or_name)
+
+    @staticmethod
+    def _page(items, data, limit_key='limit', offset_key='offset'):
+        offset = int(data.get(offset_key) or 0)
+        limit = data.get(limit_key)
+        return items[offset:offset + int(limit)] if limit is not None else items[offset:]
+
+    @staticmethod
+    def _matches(item, terms):
+        for term in re.findall(r'\S+:\[[^\]]*\]|\S+', terms):
+            if not term or term == '*:*' or ':' not in term:
+                continue
+
+            field, value = term.split(':', 1)
+            value = value.strip('"')
+
+            # Like the catch-all field of the CKAN search index
+            if field == 'text':
+                actual = u' '.join(u'{0}'.format(item.get(name) or '') for name in ('name', 'title', 'notes'))
+            else:
+                actual = u'{0}'.format(item.get(field, ''))
+
+            if value.startswith('[') and value.endswith(']'):
+                # Solr dates end with a time zone, CKAN timestamps do not
+                low, high = [bound.rstrip('Z') for bound in value[1:-1].split(' TO ')]
+                if (low != '*' and actual < low) or (high != '*' and actual > high):
+                    return False
+            elif value.lower() not in actual.lower():
+                return False
+
+        return True
+
+    def _sorted_packages(self):
+        return sorted(self.packages.values(), key=lambda package: package['name'])
+
+    def package_list(self, data):
+        return self._page([package['name'] for package in self._sorted_packages()], data)
+
+    def current_package_list_with_resources(self, data):
+        return self._page(self._sorted_packages(), data)
+
+    def package_search(self, data):
+        results = [package for package in self._sorted_packages()
+                   if self._matches(package, data.get('q') or '') and self._matches(package, data.get('fq') or '')]
+
+        # Sorts like "metadata_modified asc, id asc", applied from the last field to the first
+        for order in reversed((data.get('sort') or '').split(',')):
+            field, _, direction = order.strip().partition(' ')
+
+            if field:
+                results.sort(key=lambda package: package.get(field, ''), reverse=direction == 'desc')
+
+        return {'count': len(results), 'results': self._page(results, data, 'rows', 'start')}
+
+    def package_show(self, data):
+        return self._get_package(data['id'])
+
+    def package_create(self, data):
+        package = dict(data, id=str(uuid.uuid4()), resources=[], tags=data.get('tags', []))
+        self._record('new package', package)
+        self.packages[package['id']] = package
+        return package
+
+    def package_update(self, data):
+        package = self._get_package(data['id'])
+        package.update(dict((key, value) for key, value in data.items() if key != 'id'))
+        self._record('changed package', package)
+        return package
+
+    def package_delete(self, data):
+        package = self._get_package(data['id'])
+
+        for resource in package['resources']:
+            del self.resources[resource['id']]
+
+        del self.packages[package['id']]
+        self._record('deleted package', package)
+
+    def recently_changed_packages_activity_list(self, data):
+        return self._page(list(reversed(self.activities)), data)
+
+    def resource_search(self, data):
+        results = [resource for resource in self.resources.values() if self._matches(resource, data.get('query'))]
+        return {'count': len(results), 'results': self._page(results, data)}
+
+    def resource_show(self, data):
+        return self.resources[data['id']]
+
+    @staticmethod
+    def _set_upload(resource, upload):
+        if not upload:
+            return
+
+        # Uploads sent without a file name arrive as plain form values
+        if not isinstance(upload, tuple):
+            upload = (resource['name'], upload)
+
+        resource.update(url_type='upload', size=len(upload[1]), url='http://mock/download/' + upload[0])
+
+    def resource_create(self, data):
+        package = self._get_package(data.pop('package_id'))
+        resource = {'id': str(uuid.uuid4()), 'package_id': package['id'], 'url_type': None}
+        upload = data.pop('upload', None)
+        resource.update(data)
+        self._set_upload(resource, upload)
+        resource.setdefault('name', resource['id'])
+        self.resources[resource['id']] = resource
+        package['resources'].append(resource)
+        self._record('changed package', package)
+        return resource
+
+    def resource_update(self, data):
+        resource = self.resources[data['id']]
+        upload = data.pop('upload', None)
+        resource.update(data)
+        self._set_upload(resource, upload)
+        self._record('changed package', self._get_package(resource['package_id']))
+        return resource
+
+    def resource_delete(self, data):
+        resource = self.resources.pop(data['id'])
+        package = self._get_package(resource['package_id'])
+        package['resources'] = [r for r in package['resources'] if r['id'] != resource['id']]
+        self._record('changed package', package)
+
+
+class MockGeoServerApp(object):
+    """
+    Minimal stand-in for the GeoServer REST API and OGC services under /geoserver.
+
+    REST: GET about/version, workspaces, layers, layergroups and styles and their items (as .xml or .json), POST
+    workspaces or namespaces and DELETE workspaces/<name>. OGC: GET wms, wfs and gwc/service/* answer with a small
+    placeholder body.
+    """
+
+    # Smallest valid PNG image, a single transparent pixel
+    PNG = (b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f'
+           b'\x15\xc4\x89\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND'
+           b'\xaeB`\x82')
+
+    def __init__(self, latency=0.0):
+        """
+        Constructor
+
+        Args:
+          latency (float, optional): Seconds each request is delayed to simulate the network. Defaults to 0.
+        """
+        self.latency = latency
+        self.workspaces = ['topp']
+        self.layers = {'topp:states': 'polygon'}
+        self.styles = ['polygon', 'line', 'point']
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def add_layer(self, name, style='polygon'):
+        with self._lock:
+            self.layers[name] = style
+
+    def __call__(self, request):
+        path = request.path.split('?')[0]
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.requests += 1
+
+            if '/geoserver/rest/' in path:
+                return self._rest(request, path.split('/geoserver/rest/', 1)[1])
+
+            service = path.split('/geoserver/', 1)[-1]
+
+            if service in ('wms', 'ows') or service.startswith('gwc/service/'):
+                if 'GetCapabilities' in request.path:
+                    return 200, {'Content-Type': 'application/xml'}, b'<WMS_Capabilities version="1.3.0"/>'
+
+                return 200, {'Content-Type': 'image/png'}, self.PNG
+
+            if service == 'wfs':
+                return json_response({'type': 'FeatureCollection', 'features': []})
+
+        return 404, {'Content-Type': 'text/plain'}, b'Not Found'
+
+    def _rest(self, request, resource):
+        name, _, extension = resource.rstrip('/').rpartition('.')
+
+        if not name or '/' in extension:
+            name, extension = resource.rstrip('/'), 'xml'
+
+        if request.method == 'GET':
+            collections = {
+                'workspaces': ('workspace', self.workspaces),
+                'layers': ('layer', sorted(self.layers)),
+                'layergroups': ('layerGroup', []),
+                'styles': ('style', self.styles),
+            }
+
+            if name == 'about/version':
+                return 200, {'Content-Type': 'application/xml'}, \
+                    b'<about><resource name="GeoServer"><Version>2.20.0</Version></resource></about>'
+
+            if name in collections:
+                return self._collection(name, collections[name][0], collections[name][1], extension)
+
+            # Workspace specific collections are always empty
+            parts = name.split('/')
+
+            if len(parts) == 2 and parts[0] in collections and parts[1] in collections[parts[0]][1]:
+                element = collections[parts[0]][0]
+
+                if extension == 'json':
+                    return json_response({element: {'name': parts[1]}})
+
+                body = u'<{0}><name>{1}</name></{0}>'.format(element, parts[1])
+                return 200, {'Content-Type': 'application/xml'}, body.encode('utf-8')
+
+            if len(parts) == 3 and parts[0] == 'workspaces' and parts[1] in self.workspaces:
+                return self._collection(parts[2], parts[2][:-1], [], extension)
+
+        elif request.method == 'POST' and name in ('workspaces', 'namespaces'):
+            tag = 'name' if name == 'workspaces' else 'prefix'
+            workspace = request.body.decode('utf-8').split('<{0}>'.format(tag))[1].split('</{0}>'.format(tag))[0]
+            self.workspaces.append(workspace)
+            return 201, {'Content-Type': 'text/plain'}, workspace.encode('utf-8')
+
+        elif request.method == 'DELETE' and name.startswith('workspaces/'):
+            workspace = name.split('/', 1)[1]
+
+            if workspace in self.workspaces:
+                self.workspaces.remove(workspace)
+                return 200, {'Content-Type': 'text/plain'}, b''
+
+        return 404, {'Content-Type': 'text/plain'}, b'Not Found'
+
+    def _collection(self, collection, element, names, extension):
+        href = 'http://localhost/geoserver/rest/{0}/{{0}}.xml'.format(collection)
+
+        if extension == 'json':
+            items = [{'name': name, 'href': href.format(name)} for name in names]
+            return json_response({collection: {element: items} if items else ''})
+
+        items = u''.join(
+            u'<{0}><name>{1}</name><atom:link xmlns:atom="http://www.w3.org/2005/Atom" rel="alternate" href="{2}" '
+            u'type="application/xml"/></{0}>'.format(element, name, href.format(name)) for name in names
+        )
+        body = u'<{0}>{1}</{0}>'.format(collection, items)
+        return 200, {'Content-Type': 'application/xml'}, body.encode('utf-8')
+
+
+class MockRequest(object):
+    """
+    Request passed to mock server apps.
+    """
+
+    def __init__(self, method, path, headers, body):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode('utf-8')) if self.body else {}
+
+    def form(self):
+        """
+        Parse a multipart/form-data body into a dictionary of field values. File fields are returned as
+        (filename, content) tuples.
+        """
+        header = 'Content-Type: {0}\r\n\r\n'.format(self.headers.get('Content-Type')).encode('utf-8')
+        message = email.message_from_bytes(header + self.body)
+        fields = {}
+
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            filename = part.get_filename()
+            content = part.get_payload(decode=True)
+
+            if filename:
+                fields[name] = (filename, content)
+            else:
+                fields[name] = content.decode('utf-8')
+
+        return fields
+
+    def data(self):
+        """
+        Parameters of the request, from either a JSON or a multipart/form-data body.
+        """
+        if (self.headers.get('Content-Type') or '').startswith('multipart/form-data'):
+            return self.form()
+
+        return self.json()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately, so Nagle's algorithm would stall every keep-alive response
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        request = MockRequest(self.command, self.path, self.headers, body)
+
+        status, headers, content = self.server.app(request)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients that time out close the connection before the answer is written
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+class MockServer(object):
+    """
+    Threaded HTTP server running in the background of the current process.
+
+    Usage:
+      with MockServer(SuccessApp()) as server:
+          engine = CkanDatasetEngine(endpoint=server.url + '/api/3/action')
+    """
+
+    def __init__(self, app=None, host='127.0.0.1', port=0):
+        self.app = app or SuccessApp()
+        self._server = _ThreadingHTTPServer((host, port), _RequestHandler)
+        self._server.app = self.app
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,95 @@
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .. import pagination
+from ..exceptions import DatasetServiceError
+from ..pagination import iter_datasets, iter_pages, iter_search_results
+
+
+class CappedEngine(object):
+    """
+    Engine over a catalog of datasets that returns at most rows_max datasets per call, like CKAN.
+    """
+
+    def __init__(self, size, rows_max=1000):
+        self.names = ['dataset-{0}'.format(index) for index in range(size)]
+        self.rows_max = rows_max
+        self.calls = []
+
+    def search_datasets(self, query=None, filtered_query=None, rows=10, start=0, **kwargs):
+        self.calls.append((rows, start))
+        names = self.names[start:start + min(rows, self.rows_max)]
+        return {'success': True, 'result': {'count': len(self.names), 'results': [{'name': name} for name in names]}}
+
+    def list_datasets(self, with_resources=False, limit=None, offset=0, **kwargs):
+        self.calls.append((limit, offset))
+        return {'success': True, 'result': self.names[offset:offset + min(limit, self.rows_max)]}
+
+
+class TestIterPages(unittest.TestCase):
+
+    def test_short_page_is_last(self):
+        for prefetch in (True, False):
+            offsets = []
+
+            def fetch(offset):
+                offsets.append(offset)
+                return list(range(offset, min(offset + 2, 5)))
+
+            self.assertEqual([0, 1, 2, 3, 4], list(iter_pages(fetch, 2, prefetch=prefetch)))
+            self.assertEqual([0, 2, 4], offsets)
+
+    def test_counted_pages_end_with_count(self):
+        for prefetch in (True, False):
+            offsets = []
+
+            # The pages are shorter than requested
+            def fetch(offset):
+                offsets.append(offset)
+                return list(range(offset, min(offset + 3, 7))), 7
+
+            self.assertEqual(list(range(7)), list(iter_pages(fetch, 5, prefetch=prefetch, counted=True)))
+            self.assertEqual([0, 3, 6], offsets)
+
+    def test_counted_pages_end_with_empty_page(self):
+        # Datasets deleted while paging make the count too large
+        pages = {0: ([1, 2], 5), 2: ([], 4)}
+        self.assertEqual([1, 2], list(iter_pages(pages.get, 2, prefetch=False, counted=True)))
+
+
+class TestIterSearchResults(unittest.TestCase):
+
+    def iterate(self, function, engine, **kwargs):
+        with mock.patch.object(pagination, 'get_dataset_engine', lambda name, app_class=None: engine):
+            return list(function('ckan', **kwargs))
+
+    def test_page_size_above_rows_max(self):
+        engine = CappedEngine(2500)
+        results = self.iterate(iter_search_results, engine, page_size=5000, prefetch=False)
+
+        self.assertEqual(engine.names, [result['name'] for result in results])
+        self.assertEqual([(1000, 0), (1000, 1000), (1000, 2000)], engine.calls)
+
+    def test_rows_max_below_max_page_size(self):
+        engine = CappedEngine(25, rows_max=10)
+        results = self.iterate(iter_search_results, engine, page_size=20)
+
+        self.assertEqual(engine.names, [result['name'] for result in results])
+        self.assertEqual([0, 10, 20], [start for rows, start in engine.calls])
+
+    def test_list_datasets_page_size_is_lowered(self):
+        engine = CappedEngine(1500)
+
+        self.assertEqual(engine.names, self.iterate(iter_datasets, engine, page_size=2000, prefetch=False))
+        self.assertEqual([(1000, 0), (1000, 1000)], engine.calls)
+
+    def test_failed_call(self):
+        engine = CappedEngine(5)
+        engine.search_datasets = lambda **kwargs: {'success': False, 'error': 'Solr is down'}
+
+        with self.assertRaises(DatasetServiceError):
+            self.iterate(iter_search_results, engine)
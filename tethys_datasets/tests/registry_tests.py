@@ -0,0 +1,94 @@
+import threading
+import unittest
+
+from ..registry import ServiceRegistry
+from .fakes import FakeClock
+
+
+class FakeService(object):
+
+    def __init__(self, pk, name):
+        self.pk = pk
+        self.name = name
+
+
+class FakeQuerySet(object):
+
+    def __init__(self, services):
+        self.services = services
+
+    def first(self):
+        return self.services[0] if self.services else None
+
+
+class FakeManager(object):
+
+    def __init__(self):
+        self.rows = {}
+        self.queries = []
+
+    def all(self):
+        self.queries.append('all')
+        return list(self.rows.values())
+
+    def filter(self, name):
+        self.queries.append(name)
+        return FakeQuerySet([service for service in self.rows.values() if service.name == name])
+
+
+class FakeModel(object):
+    objects = None
+
+
+class TestServiceRegistry(unittest.TestCase):
+
+    def setUp(self):
+        FakeModel.objects = FakeManager()
+        FakeModel.objects.rows[1] = FakeService(1, 'ckan')
+        self.clock = FakeClock()
+        self.registry = ServiceRegistry(FakeModel, ttl=60, clock=self.clock)
+
+    def test_unknown_names_are_not_queried_again_until_reload(self):
+        self.assertIsNone(self.registry.get('app_only'))
+        self.assertIsNone(self.registry.get('app_only'))
+        self.assertEqual(['all', 'app_only'], FakeModel.objects.queries)
+
+        # Created in another process
+        FakeModel.objects.rows[2] = FakeService(2, 'app_only')
+        self.clock.now = 60
+        self.assertEqual(2, self.registry.get('app_only').pk)
+
+    def test_saved_service_replaces_unknown_name_and_renames(self):
+        self.assertIsNone(self.registry.get('hydroshare'))
+        self.registry.update(FakeService(1, 'hydroshare'))
+
+        self.assertEqual(1, self.registry.get('hydroshare').pk)
+        self.assertEqual(['hydroshare'], self.registry.names())
+
+    def test_concurrent_clear_and_updates(self):
+        errors = []
+
+        def read():
+            try:
+                for _ in range(2000):
+                    self.registry.get('ckan')
+                    self.registry.names()
+            except Exception as e:
+                errors.append(e)
+
+        def write():
+            for pk in range(2, 2000):
+                self.registry.update(FakeService(pk, 'service{0}'.format(pk)))
+
+                if pk % 100 == 0:
+                    self.registry.clear()
+
+        threads = [threading.Thread(target=read), threading.Thread(target=read), threading.Thread(target=write)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
@@ -0,0 +1,98 @@
+import unittest
+
+from ..proxy import EngineProxy
+from ..response_cache import LocalMemoryBackend, ResponseCacheLayer
+from .fakes import FakeClock
+
+
+class FakeEngine(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def get_dataset(self, dataset_id, **kwargs):
+        self.calls.append(('get_dataset', dataset_id))
+        return {'success': True, 'result': {'id': dataset_id, 'tags': []}}
+
+    def search_datasets(self, query=None, **kwargs):
+        self.calls.append(('search_datasets', query))
+        return {'success': False, 'error': {'message': 'failed'}}
+
+    def update_dataset(self, dataset_id, **kwargs):
+        self.calls.append(('update_dataset', dataset_id))
+        return {'success': True, 'result': {'id': dataset_id}}
+
+
+class TestResponseCacheLayer(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.backend = LocalMemoryBackend(max_entries=10, clock=self.clock)
+        self.engine = FakeEngine()
+        self.proxy = EngineProxy(self.engine, 'ckan', [ResponseCacheLayer(ttl=60, backend=self.backend)])
+
+    def test_read_is_cached(self):
+        # Execute
+        self.proxy.get_dataset('a', include_tracking=True, use_default_schema=True)
+        result = self.proxy.get_dataset('a', use_default_schema=True, include_tracking=True)
+
+        # Verify
+        self.assertEqual(result['result']['id'], 'a')
+        self.assertEqual(len(self.engine.calls), 1)
+
+    def test_cached_response_can_not_be_modified(self):
+        # Setup
+        self.proxy.get_dataset('a')['result']['tags'].append('changed')
+
+        # Execute
+        result = self.proxy.get_dataset('a')
+
+        # Verify
+        self.assertEqual(result['result']['tags'], [])
+
+    def test_entries_expire(self):
+        # Setup
+        self.proxy.get_dataset('a')
+
+        # Execute
+        self.clock.now = 60
+        self.proxy.get_dataset('a')
+
+        # Verify
+        self.assertEqual(len(self.engine.calls), 2)
+
+    def test_failed_responses_are_not_cached(self):
+        # Execute
+        self.proxy.search_datasets(query={'version': '1.0'})
+        self.proxy.search_datasets(query={'version': '1.0'})
+
+        # Verify
+        self.assertEqual(len(self.engine.calls), 2)
+
+    def test_write_invalidates_service(self):
+        # Setup
+        self.proxy.get_dataset('a')
+
+        # Execute
+        self.proxy.update_dataset('a', version='2.0')
+        self.proxy.get_dataset('a')
+
+        # Verify
+        self.assertEqual([call[0] for call in self.engine.calls], ['get_dataset', 'update_dataset', 'get_dataset'])
+        self.assertEqual(len(self.backend), 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        # Setup
+        backend = LocalMemoryBackend(max_entries=2, clock=self.clock)
+        proxy = EngineProxy(self.engine, 'ckan', [ResponseCacheLayer(ttl=60, backend=backend)])
+        proxy.get_dataset('a')
+        proxy.get_dataset('b')
+        proxy.get_dataset('a')
+
+        # Execute
+        proxy.get_dataset('c')
+        proxy.get_dataset('a')
+        proxy.get_dataset('b')
+
+        # Verify
+        self.assertEqual([call[1] for call in self.engine.calls], ['a', 'b', 'c', 'b'])
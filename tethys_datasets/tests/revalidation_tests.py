@@ -0,0 +1,119 @@
+import unittest
+
+from requests.models import Response
+
+from ..health import CircuitBreaker, CircuitBreakerLayer, EndpointHealth
+from ..proxy import EngineProxy
+from ..response_cache import LocalMemoryBackend, ResponseCacheLayer
+from ..revalidation import CkanRevalidator, get_revalidation_stats
+from ..transport import ConditionalCache
+from .fakes import FakeClock
+
+
+class FakeCkanEngine(object):
+
+    def __init__(self):
+        self.modified = '2015-01-01T00:00:00'
+        self.calls = []
+
+    def get_dataset(self, dataset_id, **kwargs):
+        self.calls.append('get_dataset')
+        return {'success': True, 'result': {'id': dataset_id, 'metadata_modified': self.modified}}
+
+    def execute_api_method(self, method, **kwargs):
+        self.calls.append(method)
+        return {'success': True, 'result': {'count': 1, 'results': [{'id': 'a', 'metadata_modified': self.modified}]}}
+
+
+class TestCkanRevalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.engine = FakeCkanEngine()
+        layer = ResponseCacheLayer(ttl=60, backend=LocalMemoryBackend(max_entries=10, clock=self.clock),
+                                   revalidator=CkanRevalidator(self.engine), clock=self.clock)
+        self.proxy = EngineProxy(self.engine, 'ckan', [layer])
+        get_revalidation_stats().reset()
+
+    def test_unchanged_dataset_is_reused(self):
+        self.proxy.get_dataset('a')
+        self.clock.now += 61
+        self.proxy.get_dataset('a')
+        self.proxy.get_dataset('a')
+
+        self.assertEqual(['get_dataset', 'package_search'], self.engine.calls)
+        self.assertEqual(1, get_revalidation_stats().as_dict()['ckan']['unchanged'])
+
+    def test_modified_dataset_is_fetched_again(self):
+        self.proxy.get_dataset('a')
+        self.clock.now += 61
+        self.engine.modified = '2015-01-02T00:00:00'
+
+        self.assertEqual('2015-01-02T00:00:00', self.proxy.get_dataset('a')['result']['metadata_modified'])
+        self.assertEqual(['get_dataset', 'package_search', 'get_dataset'], self.engine.calls)
+        self.assertEqual({'revalidated': 1, 'unchanged': 0, 'bytes_saved': 0}, get_revalidation_stats().as_dict()['ckan'])
+
+
+class TestRevalidationThroughTheBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.engine = FakeCkanEngine()
+        self.health = EndpointHealth('http://ckan', CircuitBreaker(failure_threshold=1, cooldown=300, clock=self.clock))
+        self.limited = []
+        breaker = [self.limit, CircuitBreakerLayer(self.health, clock=self.clock)]
+        layer = ResponseCacheLayer(ttl=60, backend=LocalMemoryBackend(max_entries=10, clock=self.clock),
+                                   revalidator=CkanRevalidator(EngineProxy(self.engine, 'ckan', breaker)),
+                                   clock=self.clock)
+        self.proxy = EngineProxy(self.engine, 'ckan', [layer] + breaker)
+
+    def limit(self, call, proceed):
+        # Stands for the rate limit layer, which is also inside the cache
+        self.limited.append(call.method)
+        return proceed()
+
+    def test_stale_response_is_served_while_the_breaker_is_open(self):
+        first = self.proxy.get_dataset('a')
+        self.clock.now += 61
+        self.health.record_failure(IOError('connection refused'))
+
+        self.assertEqual(first, self.proxy.get_dataset('a'))
+
+        # The probe was stopped by the breaker instead of going to the service
+        self.assertEqual(['get_dataset'], self.engine.calls)
+
+    def test_probes_pass_through_the_breaker(self):
+        self.proxy.get_dataset('a')
+        self.clock.now += 61
+        self.proxy.get_dataset('a')
+
+        self.assertEqual(['get_dataset', 'package_search'], self.engine.calls)
+        self.assertEqual(['get_dataset', 'execute_api_method'], self.limited)
+
+
+def make_response(status_code, body=b'', headers=None):
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = body
+    return response
+
+
+class TestConditionalCache(unittest.TestCase):
+
+    def test_only_responses_with_validators_are_kept(self):
+        cache = ConditionalCache(max_size=10, max_entry_size=6)
+        key = cache.key('http://host/rest/layers.json', {'auth': ('admin', 'geoserver')})
+
+        cache.put(key, make_response(200, b'layers'))
+        self.assertIsNone(cache.get(key))
+
+        cache.put(key, make_response(200, b'layers', {'ETag': '"1"'}))
+        stored = cache.get(key)
+        self.assertEqual({'If-None-Match': '"1"'}, stored.conditional_headers(None))
+        self.assertEqual(b'layers', stored.restore(make_response(304, headers={'ETag': '"1"'})).content)
+
+        # Other credentials do not share the response, large bodies and evicted bodies are dropped
+        self.assertNotEqual(key, cache.key('http://host/rest/layers.json', {'auth': ('other', 'geoserver')}))
+        cache.put(key, make_response(200, b'all layers', {'ETag': '"2"'}))
+        self.assertEqual((0, 0), (len(cache), cache.size))
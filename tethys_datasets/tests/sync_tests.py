@@ -0,0 +1,149 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from ..models import DatasetService, DatasetSyncState, SyncedDataset
+from ..registry import get_service_registry
+from ..sync import ChangeEvent, catalog_changed, iter_modified_datasets, sync_catalog
+from .fakes import DatabaseTestCase
+from .mock_server import MockCkanApp, MockServer
+
+
+class ChangingCkanApp(MockCkanApp):
+    """
+    CKAN stand-in whose datasets can be changed after a number of searches, like a catalog edited during a sync.
+    """
+
+    def __init__(self):
+        super(ChangingCkanApp, self).__init__()
+        self.searches = 0
+        self.on_search = {}
+
+    def add(self, name, modified):
+        package = self.package_create({'name': name})
+        package['metadata_modified'] = modified
+        return package
+
+    def package_search(self, data):
+        self.searches += 1
+
+        if self.searches in self.on_search:
+            self.on_search[self.searches]()
+
+        return super(ChangingCkanApp, self).package_search(data)
+
+
+class SyncTestCase(DatabaseTestCase):
+
+    def setUp(self):
+        self.app = ChangingCkanApp()
+        self.server = MockServer(self.app)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        get_service_registry(DatasetService).clear()
+        self.addCleanup(get_service_registry(DatasetService).clear)
+        DatasetService.objects.create(name='ckan', endpoint=self.server.url + '/api/3/action/')
+
+        self.events = []
+        catalog_changed.connect(self.receive)
+        self.addCleanup(catalog_changed.disconnect, self.receive)
+
+    def receive(self, sender, event, **kwargs):
+        self.events.append(event)
+
+    def changes(self, kind):
+        return sorted(self.app.packages[event.dataset_id]['name'] if event.kind != ChangeEvent.DELETED
+                      else event.dataset_id for event in self.events if event.kind == kind)
+
+
+class TestIterModifiedDatasets(SyncTestCase):
+
+    def test_datasets_modified_during_the_iteration_are_not_lost(self):
+        packages = [self.app.add('dataset-{0}'.format(index), '2015-01-01T00:00:0{0}.000000'.format(index))
+                    for index in range(6)]
+
+        def modify():
+            packages[0]['metadata_modified'] = '2015-01-02T00:00:00.000000'
+
+        # Moving a dataset of the first page to the end would shift the pages of an offset iteration
+        self.app.on_search[2] = modify
+        names = [dataset['name'] for dataset in iter_modified_datasets('ckan', page_size=2)]
+
+        self.assertEqual(['dataset-0', 'dataset-1', 'dataset-2', 'dataset-3', 'dataset-4', 'dataset-5',
+                          'dataset-0'], names)
+
+    def test_datasets_modified_in_the_same_second(self):
+        for index in range(5):
+            self.app.add('dataset-{0}'.format(index), '2015-01-01T00:00:00.00000{0}'.format(index))
+
+        self.app.add('later', '2015-01-01T00:00:01.000000')
+        names = [dataset['name'] for dataset in iter_modified_datasets('ckan', since='2015-01-01T00:00:00',
+                                                                        page_size=2)]
+
+        self.assertEqual(['dataset-0', 'dataset-1', 'dataset-2', 'dataset-3', 'dataset-4', 'later'], names)
+
+
+class TestSyncCatalog(SyncTestCase):
+
+    def test_changes(self):
+        first = self.app.add('first', '2015-01-01T00:00:00.000000')
+        second = self.app.add('second', '2015-01-01T00:00:01.000000')
+
+        result = sync_catalog('ckan', page_size=1)
+        self.assertTrue(result.full)
+        self.assertEqual(['first', 'second'], self.changes(ChangeEvent.ADDED))
+
+        self.events = []
+        self.app.package_update({'id': first['id'], 'title': 'First'})
+        self.app.package_delete({'id': second['id']})
+        self.app.add('third', '2099-01-01T00:00:00.000000')
+
+        result = sync_catalog('ckan', page_size=1)
+        self.assertFalse(result.full)
+        self.assertEqual(['third'], self.changes(ChangeEvent.ADDED))
+        self.assertEqual(['first'], self.changes(ChangeEvent.UPDATED))
+        self.assertEqual([second['id']], self.changes(ChangeEvent.DELETED))
+        self.assertEqual(['first', 'third'], sorted(SyncedDataset.objects.values_list('name', flat=True)))
+
+    def test_known_datasets_are_loaded_per_page(self):
+        for index in range(4):
+            self.app.add('dataset-{0}'.format(index), '2015-01-01T00:00:0{0}.000000'.format(index))
+
+        sync_catalog('ckan')
+        self.app.add('new', '2099-01-01T00:00:00.000000')
+
+        with CaptureQueriesContext(connection) as queries:
+            sync_catalog('ckan', page_size=2)
+
+        selects = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('SELECT') and 'tethys_datasets_synceddataset' in query['sql']]
+        self.assertTrue(selects)
+
+        # Every query is restricted to the ids of a page or of one changed dataset
+        for sql in selects:
+            self.assertRegex(sql, r'"dataset_id" (IN \(|= )')
+
+    def test_pages_are_written_as_they_come(self):
+        for index in range(4):
+            self.app.add('dataset-{0}'.format(index), '2015-01-01T00:00:0{0}.000000'.format(index))
+
+        sync_catalog('ckan')
+        self.app.add('new-0', '2099-01-01T00:00:00.000000')
+        self.app.add('new-1', '2099-01-01T00:00:01.000000')
+        last = self.app.add('new-2', '2099-01-01T00:00:02.000000')
+        progress = []
+
+        def record(sender, event, **kwargs):
+            if event.dataset_id == last['id']:
+                progress.append((len(self.events), DatasetSyncState.objects.get().watermark,
+                                 SyncedDataset.objects.count()))
+
+        catalog_changed.connect(record)
+        self.addCleanup(catalog_changed.disconnect, record)
+        self.events = []
+        sync_catalog('ckan', page_size=2)
+
+        # The first page (dataset-3, fetched again as of the watermark, and new-0) was written, signaled and
+        # checkpointed before the second page
+        self.assertEqual([(3, '2099-01-01T00:00:00.000000', 7)], progress)
+        self.assertEqual('2099-01-01T00:00:02.000000', DatasetSyncState.objects.get().watermark)
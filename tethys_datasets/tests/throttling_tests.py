@@ -0,0 +1,77 @@
+import unittest
+
+from ..throttling import AdaptiveLimit, RateLimitError, ServiceLimiter, TokenBucket
+from .fakes import FakeClock
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_rate_and_burst(self):
+        clock = FakeClock(now=1000.0)
+        bucket = TokenBucket(10, burst=2, clock=clock)
+
+        self.assertEqual([0.0, 0.0], [bucket.reserve(), bucket.reserve()])
+        self.assertAlmostEqual(0.1, bucket.reserve())
+        self.assertAlmostEqual(0.2, bucket.reserve())
+
+        clock.now += 10
+        self.assertEqual(0.0, bucket.reserve())
+
+    def test_max_wait_and_pause(self):
+        clock = FakeClock(now=1000.0)
+        bucket = TokenBucket(0, clock=clock)
+        bucket.pause(5)
+
+        self.assertIsNone(bucket.reserve(max_wait=1))
+        self.assertEqual(5, bucket.reserve())
+
+
+class TestAdaptiveLimit(unittest.TestCase):
+
+    def test_throttling_halves_and_full_use_grows(self):
+        clock = FakeClock(now=1000.0)
+        limit = AdaptiveLimit(8, clock=clock)
+
+        self.assertTrue(limit.acquire())
+        limit.release(0.1, throttled=True)
+        self.assertEqual(4, limit.limit)
+
+        # Lowered at most once per round of calls
+        limit.acquire()
+        limit.release(0.1, throttled=True)
+        self.assertEqual(4, limit.limit)
+
+        for _ in range(4):
+            limit.acquire()
+
+        self.assertFalse(limit.acquire(timeout=0))
+        limit.release(0.1)
+        self.assertEqual(4.25, limit.limit)
+
+    def test_slow_service_lowers_limit(self):
+        clock = FakeClock(now=1000.0)
+        limit = AdaptiveLimit(10, clock=clock)
+
+        for latency in (0.1, 0.1, 1.0, 1.0, 1.0):
+            limit.acquire()
+            limit.release(latency)
+
+        self.assertEqual(5, limit.limit)
+
+
+class TestServiceLimiter(unittest.TestCase):
+
+    def test_waits_for_tokens_and_rejects_long_waits(self):
+        clock = FakeClock(now=1000.0)
+        limiter = ServiceLimiter('ckan', clock=clock)
+        limiter._sleep = clock.sleep
+        limiter.configure(rate_limit=1, rate_burst=1, max_concurrency=0)
+
+        limiter.acquire(max_wait=5)
+        limiter.acquire(max_wait=5)
+        self.assertEqual(1001.0, clock.now)
+
+        limiter.record(throttled=True, retry_after=30)
+        self.assertRaises(RateLimitError, limiter.acquire, 5)
+        self.assertEqual({'calls': 2, 'throttled': 1, 'rejected': 1},
+                         dict((key, limiter.as_dict()[key]) for key in ('calls', 'throttled', 'rejected')))
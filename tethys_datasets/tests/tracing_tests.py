@@ -0,0 +1,77 @@
+import logging
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from .. import tracing
+from ..proxy import EngineProxy
+from ..tracing import ServiceProfiler, Trace, TracingLayer
+from .fakes import FakeClock
+
+
+class SlowEngine(object):
+
+    def __init__(self, clock):
+        self.clock = clock
+
+    def get_dataset(self, dataset_id, **kwargs):
+        self.clock.now += 2.0
+        return {'success': True, 'result': {'id': dataset_id}}
+
+
+class TestTracingLayer(unittest.TestCase):
+
+    def setUp(self):
+        self.options = tracing._tracing_options
+        tracing._tracing_options = {'THRESHOLD': 1.0, 'LEVEL': logging.WARNING, 'PROFILE_LOCATION': None}
+
+    def tearDown(self):
+        tracing._tracing_options = self.options
+
+    def test_first_call_includes_the_resolution(self):
+        clock = FakeClock()
+        resolution = Trace('ckan', 'resolve', clock=clock)
+        resolution.add('import', 0.5)
+        clock.now += 0.75
+        resolution.finish('resolve')
+
+        proxy = EngineProxy(SlowEngine(clock), 'ckan', [TracingLayer(2.5, resolution=resolution, clock=clock)])
+
+        with self.assertLogs('tethys_datasets.tracing', logging.WARNING) as logs:
+            proxy.get_dataset('a')
+            proxy.get_dataset('b')
+            proxy = EngineProxy(SlowEngine(clock), 'ckan', [TracingLayer(1.0, clock=clock)])
+            proxy.get_dataset('c')
+
+        self.assertEqual(2, len(logs.output))
+        self.assertIn('ckan.get_dataset 2750.0 ms (resolve 250.0 ms, import 500.0 ms, construct 0.0 ms, '
+                      'request 0.0 ms, parse 2000.0 ms)', logs.output[0])
+
+
+class TestServiceProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_profiles_are_added_up(self):
+        profiler = ServiceProfiler('ckan', os.path.join(self.location, 'ckan'), rate=1.0)
+
+        self.assertTrue(profiler.sample())
+        self.assertEqual(3, profiler.profile(lambda: profiler.profile(lambda: sum([1, 2]))))
+        profiler.profile(lambda: sum([3]))
+
+        stats = pstats.Stats(profiler.path)
+        calls = dict((function[2], stat[1]) for function, stat in stats.stats.items())
+        self.assertEqual(2, calls['<built-in method builtins.sum>'])
+        self.assertEqual(2, profiler.samples)
+
+        # Profiles removed by another process are started over
+        os.remove(profiler.path)
+        profiler.profile(lambda: sum([4]))
+        calls = dict((function[2], stat[1]) for function, stat in pstats.Stats(profiler.path).stats.items())
+        self.assertEqual(1, calls['<built-in method builtins.sum>'])
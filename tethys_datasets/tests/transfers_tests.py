@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.test import override_settings
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .. import transfers
+from ..transfers import _ckan_action, download_file
+from .mock_server import MockServer, json_response
+
+
+class FormApp(object):
+    """
+    Keeps the fields of multipart/form-data requests and serves a file to GET requests.
+    """
+
+    def __init__(self, content=b''):
+        self.content = content
+        self.requests = []
+        self.forms = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+
+        if request.method == 'GET':
+            return 200, {'Content-Type': 'application/octet-stream'}, self.content
+
+        self.forms.append(request.form())
+        return json_response({'success': True, 'result': {}})
+
+
+class FakeEngine(object):
+
+    def __init__(self, endpoint, apikey='secret'):
+        self.endpoint = endpoint
+        self.apikey = apikey
+
+
+class TestCkanUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.path = os.path.join(self.location, 'data.csv')
+
+        with open(self.path, 'wb') as data:
+            data.write(b'a,b\n' * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def test_fields_are_encoded(self):
+        app = FormApp()
+        progress = []
+        fields = {'package_id': 'p', 'description': u'"quoted"\r\n--boundary é', 'position': 2,
+                  'extras': {'source': 'gauge'}, 'url': '', 'format': None}
+
+        with MockServer(app) as server:
+            response = _ckan_action(FakeEngine(server.url), 'resource_create', fields, self.path, 1000,
+                                    lambda sent, total: progress.append((sent, total)))
+
+        self.assertTrue(response['success'])
+        form = app.forms[0]
+        self.assertEqual(u'"quoted"\r\n--boundary é', form['description'])
+        self.assertEqual('2', form['position'])
+        self.assertEqual({'source': 'gauge'}, json.loads(form['extras']))
+        self.assertEqual('data.csv', form['name'])
+        self.assertNotIn('format', form)
+        self.assertEqual(('data.csv', b'a,b\n' * 1000), form['upload'])
+        self.assertEqual('secret', app.requests[0].headers['Authorization'])
+
+        # The file is read in chunks
+        self.assertEqual([(1000, 4000), (2000, 4000), (3000, 4000), (4000, 4000)], progress)
+
+    @override_settings(TETHYS_DATASETS_CONNECTION_POOLING=False)
+    def test_pooling_setting_is_respected(self):
+        app = FormApp(b'content')
+
+        with mock.patch.object(transfers, 'get_session_pool', side_effect=AssertionError('pool used')):
+            with MockServer(app) as server:
+                _ckan_action(FakeEngine(server.url), 'resource_create', {}, self.path, 1000, None)
+                path = download_file(server.url + '/data.csv', os.path.join(self.location, 'download.csv'))
+
+        with open(path, 'rb') as download:
+            self.assertEqual(b'content', download.read())
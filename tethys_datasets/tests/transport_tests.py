@@ -0,0 +1,96 @@
+import time
+import types
+import unittest
+
+import requests
+
+from .. import transport
+from ..transport import PoolSettings, PooledRequests, SessionPool, install, request_deadline
+from .mock_server import MockCkanApp, MockServer
+
+
+class CookieApp(object):
+
+    def __init__(self):
+        self.cookies = []
+
+    def __call__(self, request):
+        self.cookies.append(request.headers.get('Cookie'))
+        return 200, {'Set-Cookie': 'sessionid=account-a; Path=/'}, b'{}'
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def test_services_on_one_host_share_merged_settings(self):
+        pool = SessionPool()
+        pool.configure('http://host/a/', PoolSettings(maxsize=4, max_retries=2, backoff=0.0), source='a')
+        session = pool.session('http://host/')
+
+        pool.configure('http://host/b/', PoolSettings(maxsize=20, max_retries=0, backoff=0.5), source='b')
+        self.assertEqual(PoolSettings(20, 2, 0.5), pool.host_settings('http://host/'))
+        session = pool.session('http://host/')
+
+        # Configuring the services again does not rebuild the session
+        for _ in range(3):
+            pool.configure('http://host/a/', PoolSettings(maxsize=4, max_retries=2, backoff=0.0), source='a')
+            pool.configure('http://host/b/', PoolSettings(maxsize=20, max_retries=0, backoff=0.5), source='b')
+
+        self.assertIs(session, pool.session('http://host/x'))
+
+        pool.configure('http://host/b/', PoolSettings(maxsize=2, max_retries=0, backoff=0.0), source='b')
+        self.assertEqual(PoolSettings(4, 2, 0.0), pool.host_settings('http://host/'))
+        self.assertIsNot(session, pool.session('http://host/'))
+
+    def test_cookies_are_not_shared(self):
+        app = CookieApp()
+        pool = SessionPool()
+
+        with MockServer(app) as server:
+            pool.request('get', server.url + '/login', auth=('a', 'secret'))
+            pool.request('get', server.url + '/data', auth=('b', 'secret'))
+            pool.request('get', server.url + '/data', cookies={'explicit': '1'})
+            pool.clear()
+
+        self.assertEqual([None, None, 'explicit=1'], app.cookies)
+
+    def test_requests_give_up_at_the_deadline(self):
+        app = MockCkanApp(latency=2)
+        pool = SessionPool()
+
+        with MockServer(app) as server:
+            start = time.time()
+
+            # Timeouts are reported as connection errors by the retrying adapter
+            with request_deadline(start + 0.2), self.assertRaises((requests.Timeout, requests.ConnectionError)):
+                pool.request('get', server.url + '/api/3/action/package_list', timeout=30)
+
+            self.assertLess(time.time() - start, 1)
+
+            # Nothing is sent once the deadline has passed
+            with request_deadline(start), self.assertRaisesRegex(requests.Timeout, 'deadline'):
+                pool.request('get', server.url + '/api/3/action/package_list')
+
+            pool.clear()
+
+
+class TestInstall(unittest.TestCase):
+
+    def test_engine_module_requests_go_through_the_pool(self):
+        engine_module = types.ModuleType('engine_module')
+        engine_module.requests = requests
+        other_module = types.ModuleType('other_module')
+        other_module.requests = object()
+
+        install(engine_module)
+        install(other_module)
+
+        self.assertIsInstance(engine_module.requests, PooledRequests)
+        self.assertIs(requests.codes, engine_module.requests.codes)
+        self.assertNotIsInstance(other_module.requests, PooledRequests)
+
+        with MockServer() as server:
+            with transport.track_transfers() as counter:
+                engine_module.requests.get(server.url + '/api')
+                engine_module.requests.session().post(server.url + '/api', data=b'x')
+
+        self.assertEqual(2, counter.requests)
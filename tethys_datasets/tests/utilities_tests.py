@@ -0,0 +1,91 @@
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .. import metrics, utilities
+from ..base import DatasetService
+from ..coalescing import SingleFlightLayer
+from ..metrics import InMemorySink, MetricsLayer
+from ..proxy import EngineProxy
+from ..utilities import get_app_services, get_dataset_engine, reset_app_services_cache
+from .mock_server import MockCkanApp, MockServer
+
+
+class CountingApp(object):
+    instances = 0
+    declarations = []
+
+    def __init__(self):
+        CountingApp.instances += 1
+
+    def dataset_services(self):
+        return self.declarations
+
+    def spatial_dataset_services(self):
+        return None
+
+
+class TestGetAppServices(unittest.TestCase):
+
+    def setUp(self):
+        CountingApp.instances = 0
+        CountingApp.declarations = [
+            DatasetService(name='ckan', type='ckan', endpoint='http://first/api/3/action/'),
+            DatasetService(name='ckan', type='ckan', endpoint='http://second/api/3/action/'),
+        ]
+        reset_app_services_cache()
+
+    def tearDown(self):
+        reset_app_services_cache()
+
+    def test_app_class_is_instantiated_once(self):
+        services = get_app_services(CountingApp)
+
+        self.assertIs(services, get_app_services(CountingApp))
+        self.assertEqual(1, CountingApp.instances)
+        self.assertEqual({}, get_app_services(CountingApp, spatial=True))
+
+    def test_first_declaration_wins(self):
+        self.assertEqual('http://first/api/3/action/', get_app_services(CountingApp)['ckan'].endpoint)
+
+    def test_reset(self):
+        get_app_services(CountingApp)
+        CountingApp.declarations = []
+
+        reset_app_services_cache(object)
+        self.assertIn('ckan', get_app_services(CountingApp))
+
+        reset_app_services_cache(CountingApp)
+        self.assertEqual({}, get_app_services(CountingApp))
+        self.assertEqual(2, CountingApp.instances)
+
+
+class TestAppServiceEngines(unittest.TestCase):
+
+    def setUp(self):
+        self.sink = InMemorySink()
+        patches = [mock.patch.object(utilities, '_is_app_class', lambda app_class: True),
+                   mock.patch.object(metrics, '_sinks', [self.sink])]
+
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        reset_app_services_cache()
+        self.addCleanup(reset_app_services_cache)
+
+    def test_engine_is_wrapped_in_service_independent_layers(self):
+        with MockServer(MockCkanApp()) as server:
+            CountingApp.declarations = [DatasetService(name='app_ckan', type='ckan',
+                                                       endpoint=server.url + '/api/3/action/')]
+            engine = get_dataset_engine('app_ckan', CountingApp)
+
+            self.assertIsInstance(engine, EngineProxy)
+            self.assertEqual([MetricsLayer, SingleFlightLayer], [type(layer) for layer in engine._layers])
+            self.assertTrue(engine.list_datasets()['success'])
+
+        self.assertEqual([('app_ckan', 'list_datasets', 1)],
+                         [(stats.service, stats.method, stats.calls) for stats in self.sink.snapshot()])
@@ -0,0 +1,382 @@
+"""
+Rate limits and adaptive concurrency limits of the site-wide dataset services.
+
+Services that throttle their clients answer bursts with 429 Too Many Requests, and retrying those makes the burst worse.
+Calls made through the engines of a site-wide dataset service can instead be held back before they reach the service:
+
+* A token bucket lets rate_limit calls per second through, and up to rate_burst calls at once after an idle period.
+  A 429 response with a Retry-After header pauses the bucket for that long.
+* An adaptive limit keeps at most max_concurrency calls in flight. The limit grows by one call per round of calls that
+  use it fully and is halved when the service throttles a call or gets much slower than its usual latency (additive
+  increase, multiplicative decrease), so the service is driven at the concurrency it can actually handle.
+
+Both are set per service in the admin pages and are shared by all engines of the service in a process. Calls that
+would wait longer than TETHYS_DATASETS_RATE_LIMIT_MAX_WAIT seconds (30 by default) raise a RateLimitError instead.
+Throttled responses are recognized on requests sent through the connection pool (see tethys_datasets.transport).
+"""
+import threading
+import time
+
+from django.conf import settings
+
+from .exceptions import DatasetServiceError
+
+# Factor by which the concurrency limit is lowered
+BACKOFF_RATIO = 0.5
+
+# A moving average of the latency above this multiple of the usual latency of the service lowers the concurrency limit
+LATENCY_TOLERANCE = 2.0
+
+# Weight of the newest call in the moving average of the latency
+LATENCY_SMOOTHING = 0.2
+
+# Weight of a slower call in the usual latency, which follows the fastest recent calls
+BASELINE_DRIFT = 0.01
+
+
+class RateLimitError(DatasetServiceError):
+    """
+    Raised instead of making a call that would wait too long for the rate limit or concurrency limit of its service.
+    """
+    pass
+
+
+class TokenBucket(object):
+    """
+    Token bucket that lets a number of calls per second through.
+    """
+
+    def __init__(self, rate, burst=10, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          rate (float): Calls per second. 0 lets every call through.
+          burst (int): Most calls let through at once after an idle period.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._paused_until = 0
+
+    def configure(self, rate, burst):
+        with self._lock:
+            self.rate = rate
+            self.burst = max(1, burst)
+            self._tokens = min(self._tokens, self.burst)
+
+    def reserve(self, max_wait=None):
+        """
+        Take a token, going into debt if none is left, so callers are let through in the order they came.
+
+        Args:
+          max_wait (float, optional): Do not take a token that is available only after this many seconds.
+
+        Returns:
+          (float): Seconds to wait before the call, None if the token was not taken.
+        """
+        with self._lock:
+            now = self._clock()
+
+            if self.rate <= 0:
+                wait = max(0.0, self._paused_until - now)
+            else:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                wait = max((1 - self._tokens) / self.rate, self._paused_until - now, 0.0)
+
+            if max_wait is not None and wait > max_wait:
+                return None
+
+            if self.rate > 0:
+                self._tokens -= 1
+
+            return wait
+
+    def pause(self, seconds):
+        """
+        Hold back all calls for a number of seconds, e.g. after a Retry-After answer.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+
+class AdaptiveLimit(object):
+    """
+    Limit of the calls in flight, adapted with additive increase and multiplicative decrease.
+    """
+
+    def __init__(self, max_limit, min_limit=1, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          max_limit (int): Highest limit, and the limit to start with.
+          min_limit (int): Lowest limit.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.baseline = None
+        self.latency = None
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._decreased_at = None
+
+    def configure(self, max_limit):
+        with self._condition:
+            self.max_limit = max_limit
+            self.limit = min(self.limit, max_limit)
+            self._condition.notify_all()
+
+    def acquire(self, timeout=None):
+        """
+        Wait for a free slot.
+
+        Args:
+          timeout (float, optional): Most seconds to wait.
+
+        Returns:
+          (bool): True if a slot was taken.
+        """
+        with self._condition:
+            deadline = None if timeout is None else self._clock() + timeout
+
+            while self.in_flight >= int(self.limit):
+                remaining = None if deadline is None else deadline - self._clock()
+
+                if remaining is not None and remaining <= 0:
+                    return False
+
+                self._condition.wait(remaining)
+
+            self.in_flight += 1
+            return True
+
+    def release(self, latency=None, throttled=False):
+        """
+        Free a slot and adapt the limit to the outcome of the call.
+
+        Args:
+          latency (float, optional): Seconds the call took. None if it failed without telling about the load.
+          throttled (bool, optional): The service answered with 429 Too Many Requests.
+        """
+        with self._condition:
+            full = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+
+            if latency is not None:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += (latency - self.baseline) * BASELINE_DRIFT
+
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency += (latency - self.latency) * LATENCY_SMOOTHING
+
+            overloaded = throttled or (latency is not None and self.latency > self.baseline * LATENCY_TOLERANCE)
+
+            if overloaded:
+                now = self._clock()
+
+                # The calls that were in flight when the limit was lowered tell about the old limit, so the limit is
+                # lowered at most once per round of calls
+                if self._decreased_at is None or now - self._decreased_at > (self.latency or 0):
+                    self.limit = max(self.min_limit, self.limit * BACKOFF_RATIO)
+                    self._decreased_at = now
+            elif latency is not None and full:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+            self._condition.notify()
+
+
+class ServiceLimiter(object):
+    """
+    Rate limit and concurrency limit of a site-wide dataset service.
+    """
+
+    def __init__(self, service_name, clock=time.time):
+        self.service_name = service_name
+        self.bucket = TokenBucket(0, clock=clock)
+        self.concurrency = None
+        self.calls = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.waited = 0.0
+        self._clock = clock
+        self._sleep = time.sleep
+        self._lock = threading.Lock()
+        self._limits = None
+
+    def configure(self, rate_limit, rate_burst, max_concurrency):
+        """
+        Apply the limits of the service. Changes take effect for the next calls.
+        """
+        limits = (rate_limit, rate_burst, max_concurrency)
+
+        if limits == self._limits:
+            return
+
+        self._limits = limits
+        self.bucket.configure(rate_limit, rate_burst)
+
+        if not max_concurrency:
+            self.concurrency = None
+        elif self.concurrency is None:
+            self.concurrency = AdaptiveLimit(max_concurrency, clock=self._clock)
+        else:
+            self.concurrency.configure(max_concurrency)
+
+    def _reject(self):
+        with self._lock:
+            self.rejected += 1
+
+        raise RateLimitError('Dataset service "{0}" is busy, try again later.'.format(self.service_name))
+
+    def acquire(self, max_wait=None):
+        """
+        Wait until a call may be made.
+
+        Returns:
+          (AdaptiveLimit): The concurrency limit whose slot was taken, to be released after the call.
+        """
+        start = self._clock()
+        wait = self.bucket.reserve(max_wait)
+
+        if wait is None:
+            self._reject()
+
+        if wait:
+            self._sleep(wait)
+
+        concurrency = self.concurrency
+
+        if concurrency is not None:
+            timeout = None if max_wait is None else max(0, max_wait - (self._clock() - start))
+
+            if not concurrency.acquire(timeout):
+                self._reject()
+
+        with self._lock:
+            self.calls += 1
+            self.waited += self._clock() - start
+
+        return concurrency
+
+    def record(self, throttled, retry_after=None):
+        if throttled:
+            with self._lock:
+                self.throttled += 1
+
+            if retry_after:
+                self.bucket.pause(retry_after)
+
+    def as_dict(self):
+        concurrency = self.concurrency
+
+        return {
+            'service': self.service_name,
+            'rate_limit': self.bucket.rate,
+            'concurrency_limit': int(concurrency.limit) if concurrency is not None else None,
+            'in_flight': concurrency.in_flight if concurrency is not None else None,
+            'calls': self.calls,
+            'throttled': self.throttled,
+            'rejected': self.rejected,
+            'waited': self.waited,
+        }
+
+    def __repr__(self):
+        return '<ServiceLimiter: service={0}, rate_limit={1}>'.format(self.service_name, self.bucket.rate)
+
+
+class RateLimitLayer(object):
+    """
+    EngineProxy layer that holds calls back to the rate limit and concurrency limit of the service.
+    """
+
+    def __init__(self, limiter, max_wait=None, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          limiter (ServiceLimiter): Limiter of the service of the engine.
+          max_wait (float, optional): Most seconds a call waits. Defaults to the TETHYS_DATASETS_RATE_LIMIT_MAX_WAIT
+            setting.
+          clock (callable): Function returning the current time in seconds.
+        """
+        # Imported here so that building the layers does not import requests
+        from .transport import track_transfers
+
+        self.limiter = limiter
+        self.max_wait = max_wait if max_wait is not None else getattr(settings, 'TETHYS_DATASETS_RATE_LIMIT_MAX_WAIT',
+                                                                      30)
+        self._clock = clock
+        self._track_transfers = track_transfers
+
+    def __call__(self, call, proceed):
+        concurrency = self.limiter.acquire(self.max_wait)
+        latency = None
+        throttled = False
+
+        try:
+            with self._track_transfers() as counter:
+                start = self._clock()
+
+                try:
+                    response = proceed()
+                except (IOError, OSError):
+                    # Timeouts and refused connections are signs of overload as well
+                    throttled = True
+                    raise
+
+                latency = self._clock() - start
+                throttled = counter.throttled > 0
+                self.limiter.record(throttled, counter.retry_after)
+                return response
+        finally:
+            if concurrency is not None:
+                concurrency.release(latency, throttled)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_service_limiter(service):
+    """
+    Get the process-wide limiter of a site-wide dataset service. The limits are updated if they changed.
+
+    Args:
+      service (DatasetService): DatasetService or SpatialDatasetService model instance.
+
+    Returns:
+      (ServiceLimiter): The limiter.
+    """
+    key = (service.__class__.__name__, service.name)
+    limiter = _limiters.get(key)
+
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+
+            if limiter is None:
+                limiter = ServiceLimiter(service.name)
+                _limiters[key] = limiter
+
+    limiter.configure(service.rate_limit, service.rate_burst, service.max_concurrency)
+    return limiter
+
+
+def get_service_limiters():
+    """
+    Get the limiters of all site-wide dataset services used by this process.
+    """
+    return list(_limiters.values())
@@ -0,0 +1,418 @@
+"""
+Slow call tracing and sampled profiling of the engines of site-wide dataset services.
+
+The time of a call is split into phases:
+
+* resolve: looking up the service and its endpoint and building the layers of the engine (get_dataset_engine and
+  get_spatial_dataset_engine).
+* import: importing the engine module, the first time the engine is needed.
+* construct: creating the engine object, when it is not in the engine cache.
+* request: sending requests through the connection pool and receiving their responses.
+* parse: the rest of the call, mostly decoding and processing the responses in the engine and the other layers.
+
+The first call made with an engine also counts the resolution of the engine. Calls slower than the threshold are
+logged with their phases to the tethys_datasets.tracing logger:
+
+    TETHYS_DATASETS_TRACING = {
+        'THRESHOLD': 1.0,
+        'LEVEL': 'WARNING',
+    }
+
+Calls to a service can also be profiled with cProfile by setting the profiling sample rate of the service in the admin
+pages. The profiles of every process are kept in one directory per service under PROFILE_LOCATION (in the temporary
+directory by default) and can be downloaded as one .prof file from the admin page of the service.
+"""
+import cProfile
+import functools
+import logging
+import marshal
+import os
+import pstats
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+log = logging.getLogger(__name__)
+
+PHASES = ('resolve', 'import', 'construct', 'request', 'parse')
+
+
+class Trace(object):
+    """
+    Phases of a traced call or engine resolution.
+    """
+
+    def __init__(self, service, operation, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          service (string): Name of the dataset service.
+          operation (string): Name of the engine method, 'resolve' for the resolution of an engine.
+          clock (callable): Function returning the current time in seconds.
+        """
+        self.service = service
+        self.operation = operation
+        self.phases = OrderedDict((name, 0.0) for name in PHASES)
+        self.duration = 0.0
+        self.details = []
+
+        # Set when the trace is reported with the first call made with the engine
+        self.claimed = False
+        self._clock = clock
+        self._start = clock()
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    def finish(self, residual):
+        """
+        Stop the trace. The time not spent in any other phase is given to the residual phase.
+        """
+        self.duration = self._clock() - self._start
+        self.phases[residual] += max(0.0, self.duration - sum(self.phases.values()))
+
+    def include(self, other):
+        """
+        Count the phases of another trace, e.g. the resolution of the engine, as part of this one.
+        """
+        for name, seconds in other.phases.items():
+            self.phases[name] += seconds
+
+        self.duration += other.duration
+
+    def __str__(self):
+        phases = ', '.join('{0} {1:.1f} ms'.format(name, seconds * 1000) for name, seconds in self.phases.items())
+        details = ''.join(', {0}'.format(detail) for detail in self.details)
+        return '{0}.{1} {2:.1f} ms ({3}){4}'.format(self.service, self.operation, self.duration * 1000, phases,
+                                                    details)
+
+
+_local = threading.local()
+
+
+class phase(object):
+    """
+    Context manager that counts the time spent in its block as a phase of the engine resolution being traced by the
+    current thread, if any.
+
+    Usage:
+      with phase('import'):
+          module = importlib.import_module(module_string)
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = getattr(_local, 'trace', None)
+
+        if self.trace is not None:
+            self.start = self.trace._clock()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.trace is not None:
+            self.trace.add(self.name, self.trace._clock() - self.start)
+
+
+def traced_resolution(function):
+    """
+    Decorator of the functions resolving the engine of a dataset service by name, which traces the resolution while
+    tracing is on. Resolutions not taken over by a TracingLayer are logged on their own if they are slow.
+    """
+    @functools.wraps(function)
+    def wrapper(name, *args, **kwargs):
+        # Nested resolutions are part of the outer one
+        if get_trace_threshold() is None or getattr(_local, 'trace', None) is not None:
+            return function(name, *args, **kwargs)
+
+        trace = _local.trace = Trace(name, 'resolve')
+
+        try:
+            return function(name, *args, **kwargs)
+        finally:
+            _local.trace = None
+            trace.finish('resolve')
+
+            if not trace.claimed and trace.duration >= get_trace_threshold():
+                log_trace(trace)
+
+    return wrapper
+
+
+def current_resolution():
+    """
+    Take over the engine resolution being traced by the current thread, so that it is reported with the first call
+    made with the engine.
+
+    Returns:
+      (Trace): The trace, None if the thread does not trace a resolution.
+    """
+    trace = getattr(_local, 'trace', None)
+
+    if trace is not None:
+        trace.claimed = True
+
+    return trace
+
+
+def log_trace(trace):
+    log.log(_options()['LEVEL'], 'Slow call %s', trace)
+
+
+class ServiceProfiler(object):
+    """
+    Profiles a sample of the calls to a dataset service with cProfile. The profiles of a process are added up and
+    saved to a file named after the process in the directory of the service.
+    """
+
+    def __init__(self, service_name, location, rate=0.0):
+        """
+        Constructor
+
+        Args:
+          service_name (string): Name of the dataset service.
+          location (string): Directory of the profiles of the service.
+          rate (float): Share of the calls profiled, from 0 to 1.
+        """
+        self.service_name = service_name
+        self.location = location
+        self.rate = rate
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stats = None
+
+    @property
+    def path(self):
+        return os.path.join(self.location, '{0}.prof'.format(os.getpid()))
+
+    def sample(self):
+        return self.rate > 0 and random.random() < self.rate
+
+    def profile(self, function):
+        """
+        Call function under cProfile and add its profile to the profiles of the service.
+        """
+        # Only one profiler can be active in a thread, calls made inside a profiled call are part of its profile
+        if getattr(_local, 'profiling', False):
+            return function()
+
+        profile = cProfile.Profile()
+
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiling tool is active
+            return function()
+
+        _local.profiling = True
+
+        try:
+            return function()
+        finally:
+            profile.disable()
+            _local.profiling = False
+
+            try:
+                self.save(profile)
+            except Exception:
+                # Profiling must never break engine calls
+                log.exception('Saving the profile of "%s" failed.', self.service_name)
+
+    def save(self, profile):
+        with self._lock:
+            # Profiles cleared by another process are not written back
+            if self._stats is None or not os.path.exists(self.path):
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+            self.samples += 1
+
+            if not os.path.isdir(self.location):
+                os.makedirs(self.location)
+
+            temp_path = '{0}.{1}.tmp'.format(self.path, threading.current_thread().ident)
+            self._stats.dump_stats(temp_path)
+            os.rename(temp_path, self.path)
+
+    def as_dict(self):
+        return {'service': self.service_name, 'rate': self.rate, 'samples': self.samples}
+
+
+def profile_location(service):
+    """
+    Get the directory of the profiles of a site-wide dataset service.
+
+    Args:
+      service (DatasetService): DatasetService or SpatialDatasetService model instance.
+    """
+    return os.path.join(_options()['PROFILE_LOCATION'], service.__class__.__name__.lower(),
+                        quote(service.name, safe=''))
+
+
+def profile_files(service):
+    """
+    List the profile files saved by all processes for a site-wide dataset service.
+    """
+    location = profile_location(service)
+
+    if not os.path.isdir(location):
+        return []
+
+    return sorted(os.path.join(location, name) for name in os.listdir(location) if name.endswith('.prof'))
+
+
+def merged_profile(service):
+    """
+    Add up the profiles saved by all processes for a site-wide dataset service.
+
+    Returns:
+      (bytes): The profile in the format of cProfile and pstats (.prof), None if there is none.
+    """
+    stats = None
+
+    for path in profile_files(service):
+        try:
+            if stats is None:
+                stats = pstats.Stats(path)
+            else:
+                stats.add(path)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            # Being replaced or cleared by another process
+            continue
+
+    return marshal.dumps(stats.stats) if stats is not None else None
+
+
+def clear_profiles(service):
+    """
+    Remove the profiles saved for a site-wide dataset service by all processes.
+    """
+    shutil.rmtree(profile_location(service), ignore_errors=True)
+
+
+class TracingLayer(object):
+    """
+    EngineProxy layer that logs slow calls with their phases and profiles a sample of the calls.
+    """
+
+    def __init__(self, threshold=None, profiler=None, resolution=None, clock=time.time):
+        """
+        Constructor
+
+        Args:
+          threshold (float, optional): Calls taking at least this many seconds are logged. None logs no calls.
+          profiler (ServiceProfiler, optional): Profiler of the service of the engine.
+          resolution (Trace, optional): Trace of the resolution of the engine, reported with the first call.
+          clock (callable): Function returning the current time in seconds.
+        """
+        # Imported here so that building the layers does not import requests
+        from .transport import track_transfers
+
+        self.threshold = threshold
+        self.profiler = profiler
+        self._resolution = resolution
+        self._clock = clock
+        self._track_transfers = track_transfers
+
+    def __call__(self, call, proceed):
+        resolution, self._resolution = self._resolution, None
+        profiled = self.profiler is not None and self.profiler.sample()
+
+        if self.threshold is None:
+            return self.profiler.profile(proceed) if profiled else proceed()
+
+        trace = Trace(call.service, call.method, clock=self._clock)
+
+        with self._track_transfers() as counter:
+            try:
+                return self.profiler.profile(proceed) if profiled else proceed()
+            finally:
+                trace.add('request', counter.request_time)
+                trace.finish('parse')
+
+                if resolution is not None:
+                    trace.include(resolution)
+
+                if trace.duration >= self.threshold:
+                    trace.details.append('{0} requests, {1} bytes received'.format(counter.requests,
+                                                                                   counter.bytes_received))
+
+                    if call.coalesced:
+                        trace.details.append('coalesced')
+
+                    if profiled:
+                        trace.details.append('profiled')
+
+                    log_trace(trace)
+
+
+_tracing_options = None
+_tracing_options_lock = threading.Lock()
+
+
+def _options():
+    global _tracing_options
+
+    if _tracing_options is None:
+        with _tracing_options_lock:
+            if _tracing_options is None:
+                options = getattr(settings, 'TETHYS_DATASETS_TRACING', {})
+                _tracing_options = {
+                    'THRESHOLD': options.get('THRESHOLD'),
+                    'LEVEL': logging.getLevelName(options.get('LEVEL', 'WARNING')),
+                    'PROFILE_LOCATION': options.get('PROFILE_LOCATION') or os.path.join(tempfile.gettempdir(),
+                                                                                        'tethys_datasets_profiles'),
+                }
+
+    return _tracing_options
+
+
+def get_trace_threshold():
+    """
+    Get the seconds from which calls are logged, from the TETHYS_DATASETS_TRACING setting.
+
+    Returns:
+      (float): The threshold, None if slow calls are not logged.
+    """
+    return _options()['THRESHOLD']
+
+
+_profilers = {}
+_profilers_lock = threading.Lock()
+
+
+def get_service_profiler(service):
+    """
+    Get the process-wide profiler of a site-wide dataset service. The sample rate is updated if it changed.
+
+    Args:
+      service (DatasetService): DatasetService or SpatialDatasetService model instance.
+
+    Returns:
+      (ServiceProfiler): The profiler.
+    """
+    key = (service.__class__.__name__, service.name)
+    profiler = _profilers.get(key)
+
+    if profiler is None:
+        with _profilers_lock:
+            profiler = _profilers.get(key)
+
+            if profiler is None:
+                profiler = ServiceProfiler(service.name, profile_location(service))
+                _profilers[key] = profiler
+
+    profiler.rate = service.profile_rate
+    return profiler
@@ -0,0 +1,303 @@
+"""
+Streaming resource uploads and downloads.
+
+Files are sent and received in chunks of bounded size, so transfers of multi-gigabyte files use a constant amount of
+memory. Progress is reported through a callback that is called with the number of bytes transferred so far and the
+total number of bytes (None when the server does not say). Interrupted downloads are resumed with HTTP range requests
+when the server supports them.
+"""
+import json
+import os
+
+import requests
+from django.conf import settings
+from requests_toolbelt import MultipartEncoder
+
+from .exceptions import DatasetServiceError
+from .pagination import get_result
+from .proxy import call_through
+from .transport import get_session_pool
+from .utilities import get_dataset_engine
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class ProgressFile(object):
+    """
+    Read-only file that reads at most chunk_size bytes at a time and reports the bytes read so far.
+    """
+
+    def __init__(self, path, progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Constructor
+
+        Args:
+          path (string): Path to the file.
+          progress (callable, optional): Called with the bytes read so far and the size of the file.
+          chunk_size (int, optional): Maximum number of bytes read from the file at a time. Defaults to 1 MiB.
+        """
+        self.path = path
+        self.progress = progress
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        self.bytes_read = 0
+        self._file = open(path, 'rb')
+
+    @property
+    def len(self):
+        # Bytes left, which MultipartEncoder uses for the length of the body
+        return self.size - self.bytes_read
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+
+        chunk = self._file.read(min(size, self.chunk_size))
+
+        if not chunk and self.bytes_read < self.size:
+            raise IOError('The file "{0}" changed size during the upload.'.format(self.path))
+
+        self.bytes_read += len(chunk)
+
+        if chunk and self.progress:
+            self.progress(self.bytes_read, self.size)
+
+        return chunk
+
+    def close(self):
+        self._file.close()
+
+
+def form_value(value):
+    """
+    Encode a form field value: strings are sent as they are, other values (numbers, lists, dictionaries) as JSON.
+    """
+    if isinstance(value, (bytes, type(u''))):
+        return value
+
+    return json.dumps(value)
+
+
+def _request(method, url, **kwargs):
+    """
+    Send a request through the process-wide session pool, or with requests when TETHYS_DATASETS_CONNECTION_POOLING is
+    False, like the requests of the engines.
+    """
+    if getattr(settings, 'TETHYS_DATASETS_CONNECTION_POOLING', True):
+        return get_session_pool().request(method, url, **kwargs)
+
+    return requests.request(method, url, **kwargs)
+
+
+def _ckan_action(engine, action, fields, path, chunk_size, progress):
+    """
+    Call a CKAN action with a file upload streamed from disk.
+    """
+    fields = dict(fields)
+
+    if 'name' not in fields:
+        fields['name'] = os.path.basename(path)
+
+    upload = ProgressFile(path, progress=progress, chunk_size=chunk_size)
+
+    try:
+        form = [(name, form_value(value)) for name, value in sorted(fields.items()) if value is not None]
+        form.append(('upload', (os.path.basename(path), upload, 'application/octet-stream')))
+        body = MultipartEncoder(fields=form)
+        headers = {'Content-Type': body.content_type}
+
+        if engine.apikey:
+            headers['Authorization'] = str(engine.apikey)
+            headers['X-CKAN-API-Key'] = str(engine.apikey)
+
+        url = '/'.join((engine.endpoint.rstrip('/'), action))
+        response = _request('post', url, data=body, headers=headers)
+    finally:
+        upload.close()
+
+    try:
+        return json.loads(response.text)
+    except ValueError:
+        raise DatasetServiceError('Call to {0} failed with status code {1}.'.format(action, response.status_code))
+
+
+def upload_resource(service_name, dataset_id, path, progress=None, chunk_size=DEFAULT_CHUNK_SIZE, app_class=None,
+                    **kwargs):
+    """
+    Create a resource with a file streamed from disk.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      dataset_id (string): The id or name of the dataset to which the resource will be added.
+      path (string): Path to the file to upload.
+      progress (callable, optional): Called with the bytes sent so far and the size of the file.
+      chunk_size (int, optional): Maximum number of bytes read from disk at a time. Defaults to 1 MiB.
+      app_class (class, optional): The app class to include in the search for dataset engines.
+      **kwargs: Any other resource properties (e.g.: name, format, description).
+
+    Returns:
+      The response dictionary of the create_resource call.
+    """
+    engine = get_dataset_engine(service_name, app_class)
+
+    # Only CKAN can be streamed to, other engines upload with their own create_resource method
+    if engine.type != 'CKAN':
+        return engine.create_resource(dataset_id, file=path, **kwargs)
+
+    fields = dict(kwargs, package_id=dataset_id, url='')
+    return call_through(engine, 'create_resource', _ckan_action, engine, 'resource_create', fields, path, chunk_size,
+                        progress)
+
+
+def update_resource_file(service_name, resource_id, path, progress=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                         app_class=None, **kwargs):
+    """
+    Replace the file of a resource with a file streamed from disk.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      resource_id (string): The id of the resource to update.
+      path (string): Path to the file to upload.
+      progress (callable, optional): Called with the bytes sent so far and the size of the file.
+      chunk_size (int, optional): Maximum number of bytes read from disk at a time. Defaults to 1 MiB.
+      app_class (class, optional): The app class to include in the search for dataset engines.
+      **kwargs: Any other resource properties to update.
+
+    Returns:
+      The response dictionary of the update_resource call.
+    """
+    engine = get_dataset_engine(service_name, app_class)
+
+    if engine.type != 'CKAN':
+        return engine.update_resource(resource_id, file=path, **kwargs)
+
+    fields = dict(kwargs, id=resource_id, url='')
+    return call_through(engine, 'update_resource', _ckan_action, engine, 'resource_update', fields, path, chunk_size,
+                        progress)
+
+
+def _same_host(url, other_url):
+    return urlsplit(url).netloc.lower() == urlsplit(other_url).netloc.lower()
+
+
+def download_file(url, path, progress=None, chunk_size=DEFAULT_CHUNK_SIZE, headers=None, max_attempts=3):
+    """
+    Download a file to disk, resuming from a partial download left by an earlier attempt.
+
+    The file is written to path + '.part' and renamed to path once complete. When the server supports range requests,
+    a partial file is continued where it stopped, otherwise the download starts over.
+
+    Args:
+      url (string): URL of the file.
+      path (string): Path to save the file to.
+      progress (callable, optional): Called with the bytes downloaded so far and the size of the file.
+      chunk_size (int, optional): Number of bytes held in memory at a time. Defaults to 1 MiB.
+      headers (dict, optional): Extra request headers.
+      max_attempts (int, optional): Number of times the download is attempted after connection errors. Defaults to 3.
+
+    Returns:
+      (string): The path of the downloaded file.
+    """
+    partial_path = path + '.part'
+    attempt = 0
+
+    while True:
+        attempt += 1
+
+        try:
+            _download_part(url, partial_path, progress, chunk_size, headers or {})
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            if attempt >= max_attempts:
+                raise
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    os.rename(partial_path, path)
+    return path
+
+
+def _download_part(url, partial_path, progress, chunk_size, headers):
+    offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    headers = dict(headers)
+
+    if offset:
+        headers['Range'] = 'bytes={0}-'.format(offset)
+
+    response = _request('get', url, headers=headers, stream=True)
+
+    try:
+        if offset and response.status_code == 416:
+            # The partial file is already complete
+            return
+
+        response.raise_for_status()
+
+        if offset and response.status_code == 206 and \
+                response.headers.get('Content-Range', '').startswith('bytes {0}-'.format(offset)):
+            mode = 'ab'
+        else:
+            # The server ignored the range, start over
+            mode = 'wb'
+            offset = 0
+
+        length = response.headers.get('Content-Length')
+        total = offset + int(length) if length is not None else None
+
+        with open(partial_path, mode) as destination:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if not chunk:
+                    continue
+
+                destination.write(chunk)
+                offset += len(chunk)
+
+                if progress:
+                    progress(offset, total)
+    finally:
+        response.close()
+
+
+def download_resource(service_name, resource_id, path, progress=None, chunk_size=DEFAULT_CHUNK_SIZE, max_attempts=3,
+                      app_class=None):
+    """
+    Download the file of a resource to disk, streaming it in chunks and resuming interrupted downloads.
+
+    Args:
+      service_name (string): Name of the dataset service.
+      resource_id (string): The id of the resource.
+      path (string): Path to save the file to.
+      progress (callable, optional): Called with the bytes downloaded so far and the size of the file.
+      chunk_size (int, optional): Number of bytes held in memory at a time. Defaults to 1 MiB.
+      max_attempts (int, optional): Number of times the download is attempted after connection errors. Defaults to 3.
+      app_class (class, optional): The app class to include in the search for dataset engines.
+
+    Returns:
+      (string): The path of the downloaded file.
+    """
+    engine = get_dataset_engine(service_name, app_class)
+    resource = get_result(engine.get_resource(resource_id), 'get_resource')
+    return download_resource_file(engine, resource, path, progress=progress, chunk_size=chunk_size,
+                                  max_attempts=max_attempts)
+
+
+def download_resource_file(engine, resource, path, progress=None, chunk_size=DEFAULT_CHUNK_SIZE, max_attempts=3):
+    """
+    Download the file of a resource dictionary already fetched with get_resource. Takes the arguments of
+    download_resource, with the engine of the dataset service and the resource instead of their names.
+    """
+    url = resource['url']
+    headers = {}
+
+    # Files uploaded to private datasets need the API key, which must not be sent to other hosts
+    if engine.apikey and _same_host(url, engine.endpoint):
+        headers['Authorization'] = str(engine.apikey)
+
+    return download_file(url, path, progress=progress, chunk_size=chunk_size, headers=headers,
+                         max_attempts=max_attempts)
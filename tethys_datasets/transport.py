@@ -0,0 +1,708 @@
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from email.utils import mktime_tz, parsedate_tz
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase
+from requests.models import PreparedRequest
+from requests.structures import CaseInsensitiveDict
+
+from .credentials import get_credential_manager
+from .revalidation import get_revalidation_stats
+
+try:
+    from http.cookiejar import DefaultCookiePolicy
+except ImportError:
+    from cookielib import DefaultCookiePolicy
+
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+
+class PoolSettings(namedtuple('PoolSettings', ('maxsize', 'max_retries', 'backoff'))):
+    """
+    Connection pool settings for one host.
+
+    Attributes:
+      maxsize (int): Maximum number of keep-alive connections kept open to the host.
+      max_retries (int): Number of times a request is retried after a connection error. Idempotent requests are also
+        retried after a 502, 503 or 504 response.
+      backoff (float): Backoff factor in seconds between retries (backoff * 2 ** (retry - 1)).
+    """
+
+    @classmethod
+    def from_service(cls, service):
+        """
+        Pool settings of a DatasetService or SpatialDatasetService model instance.
+        """
+        return cls(maxsize=service.pool_maxsize, max_retries=service.max_retries, backoff=service.retry_backoff)
+
+
+DEFAULT_POOL_SETTINGS = PoolSettings(maxsize=10, max_retries=0, backoff=0.0)
+
+# Seconds to wait for a connection and for data from the server, for requests sent without a timeout
+DEFAULT_TIMEOUT = (10, 60)
+
+
+# Modules of client libraries used by engine modules whose requests are also sent through the session pool
+CLIENT_MODULES = ('geoserver.catalog',)
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return parts.scheme.lower(), parts.netloc.lower()
+
+
+def merge_pool_settings(pool_settings):
+    """
+    Merge the pool settings of the services on one host, taking the largest value of each setting so the result does
+    not depend on the order in which the services were configured.
+
+    Args:
+      pool_settings (iterable): The PoolSettings of the services.
+
+    Returns:
+      (PoolSettings): The settings of the host.
+    """
+    pool_settings = list(pool_settings)
+
+    if not pool_settings:
+        return DEFAULT_POOL_SETTINGS
+
+    return PoolSettings(*(max(values) for values in zip(*pool_settings)))
+
+
+class NoCookiesPolicy(DefaultCookiePolicy):
+    """
+    Cookie policy that keeps no cookies, so the sessions shared by engines with different credentials never send the
+    cookies set for one account with the requests of another.
+    """
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+class SessionPool(object):
+    """
+    Keep-alive sessions shared by all engines, one per host. The sessions keep no cookies.
+    """
+
+    def __init__(self, conditional_cache=None, timeout=DEFAULT_TIMEOUT):
+        """
+        Constructor
+
+        Args:
+          conditional_cache (ConditionalCache, optional): Store of the responses of GET requests with validators, which
+            are then revalidated with conditional requests.
+          timeout (tuple): Connect and read timeouts in seconds of the requests sent without a timeout.
+        """
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._settings = {}
+        self._requested = {}
+        self.conditional_cache = conditional_cache
+
+    def configure(self, url, pool_settings, source=None):
+        """
+        Set the pool settings a service wants for the host of url. Services on the same host share its session, which
+        gets the merged settings of all of them (see merge_pool_settings) and is only rebuilt when those change.
+
+        Args:
+          url (string): Any URL on the host, usually the endpoint of a dataset service.
+          pool_settings (PoolSettings): The new settings.
+          source (hashable, optional): The service asking for the settings, e.g. its engine cache tag.
+        """
+        host = _host(url)
+
+        if self._requested.get(host, {}).get(source) == pool_settings:
+            return
+
+        with self._lock:
+            requested = dict(self._requested.get(host, {}))
+            requested[source] = pool_settings
+            self._requested[host] = requested
+            merged = merge_pool_settings(requested.values())
+
+            if self._settings.get(host) != merged:
+                self._settings[host] = merged
+
+                # Requests in flight keep using the old session, which is closed when garbage collected
+                self._sessions.pop(host, None)
+
+    def host_settings(self, url):
+        """
+        Get the pool settings of the host of url.
+        """
+        return self._settings.get(_host(url), DEFAULT_POOL_SETTINGS)
+
+    def session(self, url):
+        """
+        Get the session for the host of url.
+
+        Args:
+          url (string): The request URL.
+
+        Returns:
+          (requests.Session): The pooled session.
+        """
+        host = _host(url)
+        session = self._sessions.get(host)
+
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(host)
+
+                if session is None:
+                    session = self._create_session(self._settings.get(host, DEFAULT_POOL_SETTINGS))
+                    self._sessions[host] = session
+
+        return session
+
+    @staticmethod
+    def _create_session(pool_settings):
+        retry = Retry(total=pool_settings.max_retries,
+                      backoff_factor=pool_settings.backoff,
+                      status_forcelist=(502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_settings.maxsize, max_retries=retry)
+
+        session = requests.Session()
+        session.cookies.set_policy(NoCookiesPolicy())
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the session of the host of url. Takes the same arguments as requests.request. Requests
+        sent without a timeout get the timeout of the pool.
+
+        Requests with the basic auth credentials of an account that uses an access token (see
+        tethys_datasets.credentials) are sent with the token instead.
+        """
+        # Engines and client libraries rarely pass a timeout, and a hung server would block the caller forever
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+
+        kwargs['timeout'] = _limit_timeout(kwargs['timeout'])
+
+        token = _access_token(url, kwargs.get('auth'))
+        cache, cache_key, stored = self.conditional_cache, None, None
+
+        if cache is not None and method.lower() == 'get' and not kwargs.get('stream'):
+            cache_key = cache.key(url, kwargs)
+            stored = cache.get(cache_key)
+
+            if stored is not None:
+                kwargs['headers'] = stored.conditional_headers(kwargs.get('headers'))
+
+        counters = getattr(_local, 'counters', None)
+        start = time.time() if counters else None
+
+        if token is None:
+            response = self.session(url).request(method=method, url=url, **kwargs)
+        else:
+            response = self._request_with_token(token, method, url, kwargs)
+
+        if counters:
+            _count_transfer(response, kwargs.get('stream', False), time.time() - start)
+
+        if cache_key is not None:
+            if response.status_code == 304 and stored is not None:
+                response = stored.restore(response)
+                get_revalidation_stats().record('http', True, len(stored.content))
+            else:
+                if stored is not None:
+                    get_revalidation_stats().record('http', False)
+
+                cache.put(cache_key, response)
+
+        return response
+
+    def _request_with_token(self, token, method, url, kwargs):
+        access_token = token.get(self._post_token_request)
+        kwargs['auth'] = BearerAuth(access_token)
+        response = self.session(url).request(method=method, url=url, **kwargs)
+
+        # Bodies read from files can not be sent again
+        replayable = not kwargs.get('files') and not hasattr(kwargs.get('data'), 'read')
+
+        if response.status_code == 401 and replayable:
+            # Revoked before it expired
+            token.invalidate(access_token)
+            response.close()
+            kwargs['auth'] = BearerAuth(token.get(self._post_token_request))
+            response = self.session(url).request(method=method, url=url, **kwargs)
+
+        return response
+
+    def _post_token_request(self, token_url, data, client_auth):
+        response = self.session(token_url).post(token_url, data=data, auth=client_auth, timeout=30)
+
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+    def clear(self):
+        """
+        Close all sessions.
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        for session in sessions:
+            session.close()
+
+
+class BearerAuth(AuthBase):
+    """
+    Sends an OAuth2 access token.
+    """
+
+    def __init__(self, access_token):
+        self.access_token = access_token
+
+    def __call__(self, request):
+        request.headers['Authorization'] = 'Bearer {0}'.format(self.access_token)
+        return request
+
+
+def _access_token(url, auth):
+    if auth is None:
+        return None
+
+    if isinstance(auth, tuple):
+        username, password = auth[:2]
+    else:
+        username, password = getattr(auth, 'username', None), getattr(auth, 'password', None)
+
+    return get_credential_manager().lookup(url, username, password)
+
+
+class StoredResponse(object):
+    """
+    Body, headers and validators of a response kept for conditional requests.
+    """
+    __slots__ = ('status_code', 'reason', 'headers', 'encoding', 'content', 'etag', 'last_modified')
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.reason = response.reason
+        self.headers = dict(response.headers)
+        self.encoding = response.encoding
+        self.content = response.content
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+
+    def conditional_headers(self, headers):
+        headers = dict(headers or {})
+
+        if self.etag:
+            headers.setdefault('If-None-Match', self.etag)
+
+        if self.last_modified:
+            headers.setdefault('If-Modified-Since', self.last_modified)
+
+        return headers
+
+    def restore(self, not_modified):
+        """
+        Turn a 304 Not Modified response into the stored response, updated with the headers of the 304 response.
+        """
+        headers = CaseInsensitiveDict(self.headers)
+        headers.update(not_modified.headers)
+        not_modified.status_code = self.status_code
+        not_modified.reason = self.reason
+        not_modified.headers = headers
+        not_modified.encoding = self.encoding
+        not_modified._content = self.content
+        return not_modified
+
+
+class ConditionalCache(object):
+    """
+    LRU store of the responses of GET requests that came with an ETag or Last-Modified header.
+    """
+
+    def __init__(self, max_size=32 * 1024 ** 2, max_entry_size=4 * 1024 ** 2):
+        """
+        Constructor
+
+        Args:
+          max_size (int): Most bytes of response bodies kept.
+          max_entry_size (int): Most bytes of a single response body kept.
+        """
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(url, kwargs):
+        """
+        Key of a GET request. Responses are only shared by requests with the same URL, parameters, credentials and
+        Accept header.
+        """
+        request = PreparedRequest()
+        request.prepare_url(url, kwargs.get('params'))
+        headers = CaseInsensitiveDict(kwargs.get('headers') or {})
+        auth = kwargs.get('auth')
+
+        if isinstance(auth, tuple):
+            credentials = repr(auth)
+        elif auth is not None:
+            credentials = repr(sorted(vars(auth).items()))
+        else:
+            credentials = headers.get('Authorization', '')
+
+        # Keys are kept in memory, so they hold a digest of the credentials rather than the credentials
+        digest = hashlib.sha1(credentials.encode('utf-8')).hexdigest()
+        return request.url, headers.get('Accept', ''), digest
+
+    def get(self, key):
+        with self._lock:
+            stored = self._entries.pop(key, None)
+
+            if stored is not None:
+                self._entries[key] = stored
+
+            return stored
+
+    def put(self, key, response):
+        """
+        Keep a response if it is a complete 200 response with validators, and drop the previous one otherwise.
+        """
+        keep = response.status_code == 200 and (response.headers.get('ETag') or response.headers.get('Last-Modified'))
+        stored = StoredResponse(response) if keep else None
+
+        if stored is not None and len(stored.content) > self.max_entry_size:
+            stored = None
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+
+            if previous is not None:
+                self.size -= len(previous.content)
+
+            if stored is None:
+                return
+
+            self._entries[key] = stored
+            self.size += len(stored.content)
+
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted.content)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class PooledSession(object):
+    """
+    Stand-in for the sessions that client libraries create with requests.session(), sending their requests through a
+    SessionPool. Retry adapters mounted on it are ignored in favor of the retry settings of the pool.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.verify = True
+        self.headers = {}
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def close(self):
+        pass
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('verify', self.verify)
+
+        if self.headers:
+            kwargs['headers'] = dict(self.headers, **(kwargs.get('headers') or {}))
+
+        return self._pool.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('get', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('head', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('post', url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('put', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('patch', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+
+class PooledRequests(object):
+    """
+    Stand-in for the requests module in engine modules. Requests made with the module-level functions (get, post,
+    etc.) and with sessions made by session() are sent through a SessionPool, everything else is looked up on the
+    requests module.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    def request(self, method, url, **kwargs):
+        return self._pool.request(method, url, **kwargs)
+
+    def session(self):
+        return PooledSession(self._pool)
+
+    def get(self, url, params=None, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('get', url, params=params, **kwargs)
+
+    def options(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('options', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('head', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('post', url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('put', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('patch', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+
+class TransferCounter(object):
+    """
+    Bytes sent and received by the requests made while the counter is active (see track_transfers), the seconds spent
+    waiting for their responses, and the number of those answered with 429 Too Many Requests along with the longest
+    Retry-After of their responses in seconds.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.request_time = 0.0
+        self.throttled = 0
+        self.retry_after = None
+
+
+_local = threading.local()
+
+
+class track_transfers(object):
+    """
+    Context manager that counts the bytes of the requests sent through the session pool by the current thread.
+    Counters can be nested, a request is counted by every active counter.
+
+    Usage:
+      with track_transfers() as counter:
+          engine.list_datasets()
+
+      print(counter.bytes_received)
+    """
+
+    def __enter__(self):
+        self.counter = TransferCounter()
+
+        if getattr(_local, 'counters', None) is None:
+            _local.counters = []
+
+        _local.counters.append(self.counter)
+        return self.counter
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.counters.remove(self.counter)
+
+
+class request_deadline(object):
+    """
+    Context manager that makes the requests sent through the session pool by the current thread give up at a deadline:
+    their connect and read timeouts are cut down to the seconds left, and requests sent after the deadline raise
+    requests.Timeout. Deadlines can be nested, the earliest one applies.
+
+    Usage:
+      with request_deadline(time.time() + 5):
+          engine.search_datasets(query={'text': 'rainfall'})
+    """
+
+    def __init__(self, deadline):
+        """
+        Constructor
+
+        Args:
+          deadline (float): Time (as returned by time.time) by which the requests must be done.
+        """
+        self.deadline = deadline
+
+    def __enter__(self):
+        if getattr(_local, 'deadlines', None) is None:
+            _local.deadlines = []
+
+        _local.deadlines.append(self.deadline)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.deadlines.remove(self.deadline)
+
+
+def _limit_timeout(timeout):
+    deadlines = getattr(_local, 'deadlines', None)
+
+    if not deadlines:
+        return timeout
+
+    left = min(deadlines) - time.time()
+
+    if left <= 0:
+        raise requests.Timeout('The deadline of the request has passed.')
+
+    if isinstance(timeout, tuple):
+        return tuple(left if value is None else min(value, left) for value in timeout)
+
+    return left if timeout is None else min(timeout, left)
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+
+    if hasattr(body, '__len__'):
+        return len(body)
+
+    return getattr(body, 'len', 0)
+
+
+def _count_transfer(response, stream, elapsed=0.0):
+    sent = _body_size(response.request.body)
+
+    # Reading the content of a streamed response here would defeat the streaming
+    if stream:
+        received = int(response.headers.get('Content-Length') or 0)
+    else:
+        received = len(response.content)
+
+    throttled = response.status_code == 429
+    retry_after = _retry_after(response) if throttled else None
+
+    for counter in _local.counters:
+        counter.requests += 1
+        counter.bytes_sent += sent
+        counter.bytes_received += received
+        counter.request_time += elapsed
+
+        if throttled:
+            counter.throttled += 1
+            counter.retry_after = max(counter.retry_after or 0, retry_after or 0) or None
+
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    # An HTTP date
+    parsed = parsedate_tz(value)
+
+    if parsed is None:
+        return None
+
+    return max(0.0, mktime_tz(parsed) - time.time())
+
+
+def _conditional_cache():
+    options = getattr(settings, 'TETHYS_DATASETS_CONDITIONAL_REQUESTS', {})
+
+    if options is False:
+        return None
+
+    return ConditionalCache(max_size=options.get('MAX_SIZE', 32 * 1024 ** 2),
+                            max_entry_size=options.get('MAX_ENTRY_SIZE', 4 * 1024 ** 2))
+
+
+_session_pool = SessionPool()
+_session_pool_configured = False
+
+
+def _configure_session_pool():
+    global _session_pool_configured
+
+    # The settings are read on first use rather than on import
+    if not _session_pool_configured:
+        _session_pool.conditional_cache = _conditional_cache()
+        timeout = getattr(settings, 'TETHYS_DATASETS_REQUEST_TIMEOUT', DEFAULT_TIMEOUT)
+        _session_pool.timeout = tuple(timeout) if isinstance(timeout, (list, tuple)) else timeout
+        _session_pool_configured = True
+
+
+def get_session_pool():
+    """
+    Get the process-wide session pool.
+    """
+    _configure_session_pool()
+    return _session_pool
+
+
+def install(module):
+    """
+    Route the requests made by an engine module through the process-wide session pool. Modules that do not use the
+    requests module are left alone.
+
+    Args:
+      module (module): The module that defines the engine class.
+    """
+    _configure_session_pool()
+
+    if getattr(module, 'requests', None) is requests:
+        module.requests = PooledRequests(_session_pool)
+
+    # Client libraries the engines talk through
+    for name in CLIENT_MODULES:
+        client_module = sys.modules.get(name)
+
+        if getattr(client_module, 'requests', None) is requests:
+            client_module.requests = PooledRequests(_session_pool)
@@ -2,4 +2,9 @@ from django.conf.urls import patterns, url, include
 
 urlpatterns = patterns('',
     url(r'^$', 'tethys_datasets.views.home', name='home'),
-)
\ No newline at end of file
+    url(r'^metrics/$', 'tethys_datasets.views.metrics', name='metrics'),
+    url(r'^search/$', 'tethys_datasets.views.search', name='search'),
+    url(r'^jobs/(?P<job_id>[0-9a-f]{32})/$', 'tethys_datasets.views.job_status', name='job_status'),
+    url(r'^maps/(?P<service_name>[^/]+)/(?P<path>(?:[\w.-]+/)?(?:wms|wfs|ows)|gwc/service/.+)$',
+        'tethys_datasets.views.map_proxy', name='map_proxy'),
+)
@@ -1,80 +1,320 @@
-from tethys_apps.base.app_base import TethysAppBase
+import importlib
+import logging
+import sys
+import threading
+
+from django.conf import settings
+
+from .cache import get_engine_cache, engine_cache_key, service_cache_tag
+from .coalescing import SingleFlightLayer
+from .credentials import configure_service
+from .health import CircuitBreakerLayer, choose_endpoint, get_endpoint_health
+from .map_cache import MapCacheInvalidationLayer, get_map_cache
+from .metrics import MetricsLayer, get_metrics_sinks
 from .models import DatasetService as DsModel, SpatialDatasetService as SdsModel
+from .proxy import wrap_engine
+from .registry import get_service_registry
+from .response_cache import ResponseCacheLayer
+from .revalidation import CkanRevalidator
+from .throttling import RateLimitLayer, get_service_limiter
+from .tracing import (TracingLayer, current_resolution, get_service_profiler, get_trace_threshold, phase,
+                      traced_resolution)
+
+log = logging.getLogger(__name__)
+
+# Engine classes by dot-path, so each engine module is imported and patched only once
+_engine_classes = {}
+
+
+def _transport():
+    # The transport module pulls in requests, which is only needed once an engine is created
+    from . import transport
+    return transport
+
+
+def _is_app_class(app_class):
+    from tethys_apps.base.app_base import TethysAppBase
+    return issubclass(app_class, TethysAppBase)
+
+
+def get_engine_class(engine):
+    """
+    Get a DatasetEngine class from a string that points at the engine class. The engine module is imported the first
+    time the class is needed.
+
+    Args:
+      engine (string): Dot-path of the engine class.
+
+    Returns:
+      (class): The engine class.
+    """
+    EngineClass = _engine_classes.get(engine)
+
+    if EngineClass is None:
+        # Derive import parts from engine string
+        module_string, _, engine_class_string = engine.rpartition('.')
+
+        with phase('import'):
+            # Import
+            module = importlib.import_module(module_string)
+            EngineClass = getattr(module, engine_class_string)
+
+            # Send the requests of the engine through the shared connection pool
+            if getattr(settings, 'TETHYS_DATASETS_CONNECTION_POOLING', True):
+                _transport().install(sys.modules[EngineClass.__module__])
+
+        _engine_classes[engine] = EngineClass
+
+    return EngineClass
 
 
 def initialize_engine_object(engine, endpoint, apikey=None, username=None, password=None):
     """
     Initialize a DatasetEngine object from a string that points at the engine class.
     """
-    # Derive import parts from engine string
-    engine_split = engine.split('.')
-    module_string = '.'.join(engine_split[:-1])
-    engine_class_string = engine_split[-1]
-
-    # Import
-    module = __import__(module_string, fromlist=[engine_class_string])
-    EngineClass = getattr(module, engine_class_string)
+    EngineClass = get_engine_class(engine)
 
     # Create Engine Object
-    engine_instance = EngineClass(endpoint=endpoint,
-                                  apikey=apikey,
-                                  username=username,
-                                  password=password)
+    with phase('construct'):
+        engine_instance = EngineClass(endpoint=endpoint,
+                                      apikey=apikey,
+                                      username=username,
+                                      password=password)
     return engine_instance
 
 
-def get_dataset_engine(name, app_class=None):
+def get_engine_object(engine, endpoint, apikey=None, username=None, password=None, tag=None, pool_settings=None):
     """
-    Get a dataset engine with the given name.
+    Get a DatasetEngine object from the process-wide engine cache, initializing it if necessary.
 
     Args:
-      name (string): Name of the dataset engine to retrieve.
-      app_class (class): The app class to include in the search for dataset engines.
+      engine (string): Dot-path of the engine class.
+      endpoint (string): URL of the dataset service API endpoint.
+      apikey (string, optional): API key for the dataset service.
+      username (string, optional): Username for the dataset service.
+      password (string, optional): Password for the dataset service.
+      tag (hashable, optional): Label used to invalidate the cached engine (see tethys_datasets.signals).
+      pool_settings (PoolSettings, optional): Connection pool settings for the host of the endpoint.
+
+    Returns:
+      (DatasetEngine): A dataset engine object shared by all callers with the same engine, endpoint and credentials.
+    """
+    if pool_settings:
+        _transport().get_session_pool().configure(endpoint, pool_settings, source=tag)
+
+    key = engine_cache_key(engine, endpoint, apikey, username, password)
+
+    return get_engine_cache().get_or_create(key,
+                                            lambda: initialize_engine_object(engine=engine,
+                                                                             endpoint=endpoint,
+                                                                             apikey=apikey,
+                                                                             username=username,
+                                                                             password=password),
+                                            tag=tag)
+
+
+def get_service_engine(service, endpoint=None):
+    """
+    Get the engine of a site-wide dataset service, wrapped in the layers of the service.
+
+    Args:
+      service (DatasetService): DatasetService or SpatialDatasetService model instance.
+      endpoint (string, optional): The endpoint to use. Defaults to the healthiest endpoint of the service.
 
     Returns:
       (DatasetEngine): A dataset engine object.
     """
-    # If the app_class is given, check it first for a dataset engine
-    app_dataset_services = None
+    if endpoint is None:
+        endpoint = choose_endpoint(service).endpoint
+
+    # Accounts that exchange their password for an access token share the token with all engines of the account
+    if service.username:
+        configure_service(service, endpoint)
+
+    engine = get_engine_object(engine=str(service.engine),
+                               endpoint=endpoint,
+                               apikey=service.apikey,
+                               username=service.username,
+                               password=service.password,
+                               tag=service_cache_tag(service),
+                               pool_settings=_transport().PoolSettings.from_service(service))
+
+    return wrap_engine(engine, service.name, get_engine_layers(service, endpoint, engine))
+
+
+def get_engine_layers(service, endpoint=None, engine=None):
+    """
+    Get the layers that calls to the engine of a site-wide dataset service pass through (see tethys_datasets.proxy).
+
+    Args:
+      service (DatasetService): DatasetService or SpatialDatasetService model instance.
+      endpoint (string, optional): The endpoint the engine talks to. Defaults to the main endpoint of the service.
+      engine (DatasetEngine, optional): The engine, used to revalidate stale cached responses of CKAN services.
+
+    Returns:
+      (list): The layers, outermost first.
+    """
+    layers = _outer_layers(get_service_profiler(service) if service.profile_rate else None)
+
+    # Calls answered by the cache or shared with other callers do not count against the limits of the service.
+    # Outside the breaker, so the latencies used to route between mirrors do not include the time spent waiting.
+    inner_layers = []
+
+    if service.rate_limit or service.max_concurrency:
+        inner_layers.append(RateLimitLayer(get_service_limiter(service)))
+
+    # Innermost, so calls answered by the cache are not blocked by an open breaker. The latencies it measures are
+    # also used to route between mirrors.
+    if service.failure_threshold or service.mirrors:
+        inner_layers.append(CircuitBreakerLayer(get_endpoint_health(endpoint or service.endpoint,
+                                                                    service.failure_threshold,
+                                                                    service.breaker_cooldown)))
+
+    # Only DatasetService has a cache_ttl
+    cache_ttl = getattr(service, 'cache_ttl', 0)
+
+    if cache_ttl:
+        revalidator = None
+
+        # The probes of the revalidator count against the limits of the service and respect its breaker
+        if engine is not None and service.engine == DsModel.CKAN:
+            revalidator = CkanRevalidator(wrap_engine(engine, service.name, inner_layers))
+
+        layers.append(ResponseCacheLayer(cache_ttl, revalidator=revalidator))
+
+    # Changes to the layers of a GeoServer remove their cached map responses
+    map_cache = get_map_cache() if isinstance(service, SdsModel) else None
+
+    if map_cache is not None:
+        layers.append(MapCacheInvalidationLayer(map_cache))
 
-    if app_class and issubclass(app_class, TethysAppBase):
+    return layers + inner_layers
+
+
+def get_app_engine_layers():
+    """
+    Get the layers that calls to the engine of a dataset service declared by an app pass through. App services have
+    none of the settings of site-wide services (caching, rate limits, circuit breakers, profiling), so only the layers
+    that do not depend on them are used: tracing, metrics and the sharing of concurrent reads.
+
+    Returns:
+      (list): The layers, outermost first.
+    """
+    return _outer_layers()
+
+
+def _outer_layers(profiler=None):
+    layers = []
+    threshold = get_trace_threshold()
+
+    # Outermost, so slow calls are timed as the caller sees them
+    if threshold is not None or profiler is not None:
+        layers.append(TracingLayer(threshold, profiler, resolution=current_resolution()))
+
+    sinks = get_metrics_sinks()
+
+    # Measure the calls as the caller sees them, including the ones answered by the cache
+    if sinks:
+        layers.append(MetricsLayer(sinks))
+
+    # Identical concurrent reads share one call to the service
+    if getattr(settings, 'TETHYS_DATASETS_COALESCE_READS', True):
+        layers.append(SingleFlightLayer())
+
+    return layers
+
+
+_app_services = {}
+_app_services_lock = threading.Lock()
+
+
+def get_app_services(app_class, spatial=False):
+    """
+    Get the dataset services declared by an app class. The app class is instantiated only the first time it is
+    looked up in a process.
+
+    Args:
+      app_class (class): The app class.
+      spatial (bool, optional): Get the spatial dataset services instead of the dataset services. Defaults to False.
+
+    Returns:
+      (dict): Dictionary of DatasetService or SpatialDatasetService declarations keyed by name.
+    """
+    key = (app_class, spatial)
+    services = _app_services.get(key)
+
+    if services is None:
         # Instantiate app class and retrieve dataset services list
         app = app_class()
-        app_dataset_services = app.dataset_services()
 
-    if app_dataset_services:
-        # Search for match
-        for app_dataset_service in app_dataset_services:
+        if spatial:
+            declarations = app.spatial_dataset_services()
+        else:
+            declarations = app.dataset_services()
 
-            # If match is found, initiate engine object
-            if app_dataset_service.name == name:
-                return initialize_engine_object(engine=app_dataset_service.engine,
-                                                endpoint=app_dataset_service.endpoint,
-                                                apikey=app_dataset_service.apikey,
-                                                username=app_dataset_service.username,
-                                                password=app_dataset_service.password)
+        services = {}
 
-    # If the dataset engine cannot be found in the app_class, check database for site-wide dataset engines
-    site_dataset_services = DsModel.objects.all()
+        # The first declaration with a given name wins
+        for declaration in declarations or ():
+            services.setdefault(declaration.name, declaration)
 
-    if site_dataset_services:
-        # Search for match
-        for site_dataset_service in site_dataset_services:
+        with _app_services_lock:
+            services = _app_services.setdefault(key, services)
 
-            # If match is found initiate engine object
-            if site_dataset_service.name == name:
-                dataset_service_object = initialize_engine_object(engine=site_dataset_service.engine.encode('utf-8'),
-                                                                  endpoint=site_dataset_service.endpoint,
-                                                                  apikey=site_dataset_service.apikey,
-                                                                  username=site_dataset_service.username,
-                                                                  password=site_dataset_service.password)
+    return services
 
-                return dataset_service_object
+
+def reset_app_services_cache(app_class=None):
+    """
+    Forget the dataset services declared by app classes, e.g. between tests or after the app code is reloaded.
+
+    Args:
+      app_class (class, optional): Only forget the declarations of this app class. Defaults to all app classes.
+    """
+    with _app_services_lock:
+        if app_class is None:
+            _app_services.clear()
+        else:
+            _app_services.pop((app_class, False), None)
+            _app_services.pop((app_class, True), None)
+
+
+@traced_resolution
+def get_dataset_engine(name, app_class=None):
+    """
+    Get a dataset engine with the given name.
+
+    Args:
+      name (string): Name of the dataset engine to retrieve.
+      app_class (class): The app class to include in the search for dataset engines.
+
+    Returns:
+      (DatasetEngine): A dataset engine object.
+    """
+    # If the app_class is given, check it first for a dataset engine
+    if app_class and _is_app_class(app_class):
+        app_dataset_service = get_app_services(app_class).get(name)
+
+        # If match is found, initiate engine object
+        if app_dataset_service:
+            engine = get_engine_object(engine=app_dataset_service.engine,
+                                       endpoint=app_dataset_service.endpoint,
+                                       apikey=app_dataset_service.apikey,
+                                       username=app_dataset_service.username,
+                                       password=app_dataset_service.password)
+            return wrap_engine(engine, name, get_app_engine_layers())
+
+    # If the dataset engine cannot be found in the app_class, check the registry of site-wide dataset engines
+    site_dataset_service = get_service_registry(DsModel).get(name)
+
+    if site_dataset_service:
+        return get_service_engine(site_dataset_service)
 
     raise NameError('Could not find dataset service with name "{0}". Please check that dataset service with that name '
                     'exists in settings.py or in your app.py.'.format(name))
 
 
+@traced_resolution
 def get_spatial_dataset_engine(name, app_class=None):
     """
     Get a spatial dataset engine with the given name.
@@ -87,47 +327,49 @@ def get_spatial_dataset_engine(name, app_class=None):
       (SpatialDatasetEngine): A spatial dataset engine object.
     """
     # If the app_class is given, check it first for a dataset engine
-    app_spatial_dataset_services = None
-
-    if app_class and issubclass(app_class, TethysAppBase):
-        # Instantiate app class and retrieve dataset services list
-        app = app_class()
-        app_spatial_dataset_services = app.spatial_dataset_services()
+    if app_class and _is_app_class(app_class):
+        app_spatial_dataset_service = get_app_services(app_class, spatial=True).get(name)
 
-    if app_spatial_dataset_services:
-        # Search for match
-        for app_spatial_dataset_service in app_spatial_dataset_services:
+        # If match is found, initiate engine object
+        if app_spatial_dataset_service:
+            engine = get_engine_object(engine=app_spatial_dataset_service.engine,
+                                       endpoint=app_spatial_dataset_service.endpoint,
+                                       apikey=app_spatial_dataset_service.apikey,
+                                       username=app_spatial_dataset_service.username,
+                                       password=app_spatial_dataset_service.password)
+            return wrap_engine(engine, name, get_app_engine_layers())
 
-            # If match is found, initiate engine object
-            if app_spatial_dataset_service.name == name:
-                return initialize_engine_object(engine=app_spatial_dataset_service.engine,
-                                                endpoint=app_spatial_dataset_service.endpoint,
-                                                apikey=app_spatial_dataset_service.apikey,
-                                                username=app_spatial_dataset_service.username,
-                                                password=app_spatial_dataset_service.password)
-
-    # If the dataset engine cannot be found in the app_class, check database for site-wide dataset engines
-    site_spatial_dataset_services = SdsModel.objects.all()
-
-    if site_spatial_dataset_services:
-        # Search for match
-        for site_spatial_dataset_service in site_spatial_dataset_services:
-
-            # If match is found initiate engine object
-            if site_spatial_dataset_service.name == name:
-                return initialize_engine_object(engine=site_spatial_dataset_service.engine.encode('utf-8'),
-                                                endpoint=site_spatial_dataset_service.endpoint,
-                                                apikey=site_spatial_dataset_service.apikey,
-                                                username=site_spatial_dataset_service.username,
-                                                password=site_spatial_dataset_service.password)
+    # If the dataset engine cannot be found in the app_class, check the registry of site-wide dataset engines
+    site_spatial_dataset_service = get_service_registry(SdsModel).get(name)
 
+    if site_spatial_dataset_service:
+        return get_service_engine(site_spatial_dataset_service)
 
     raise NameError('Could not find spatial dataset service with name "{0}". Please check that dataset service with that name '
                     'exists in either the Admin Settings or in your app.py.'.format(name))
 
 
+def warm_up(connect=False):
+    """
+    Create the engines of all site-wide dataset services ahead of the first request, importing the engine modules on
+    the way.
 
+    Args:
+      connect (bool, optional): Also open a pooled connection to the endpoint of every service. Defaults to False.
+    """
+    for model in (DsModel, SdsModel):
+        registry = get_service_registry(model)
 
+        for name in registry.names():
+            service = registry.get(name)
 
+            if service is None:
+                continue
 
+            try:
+                get_service_engine(service)
 
+                if connect:
+                    _transport().get_session_pool().request('head', service.endpoint, timeout=10).close()
+            except Exception:
+                log.warning('Could not warm up the engine of dataset service "%s".', name, exc_info=True)
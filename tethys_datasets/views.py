@@ -1,10 +1,230 @@
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, \
+    HttpResponseNotAllowed, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 
+from .catalog import search_catalog
+from .federated import DEFAULT_TIMEOUT, federated_search, iter_federated_search, merge_results
+from .health import choose_endpoint
+from .jobs import can_see_job, describe_job, get_job
+from .map_cache import CHUNK_SIZE, get_map_cache, map_service_url
+from .metrics import find_metrics_sink, PrometheusSink
+from .models import DatasetService, SpatialDatasetService
+from .registry import get_service_registry
+
+CATALOG_PAGE_SIZE = 20
+
+# Seconds to wait for GeoServer to answer a proxied map request
+MAP_PROXY_TIMEOUT = 60
+
+# Longest deadline in seconds and most datasets per service a client can ask for in a federated search
+MAX_SEARCH_TIMEOUT = 60
+MAX_SEARCH_LIMIT = 100
+
+# Longest wait in seconds a client can ask for when polling a job, and the interval at which the job is checked. The
+# wait holds a worker of the web server, so it is kept short.
+MAX_JOB_WAIT = 5
+JOB_WAIT_INTERVAL = 0.5
+
+# WFS requests that change or lock features, which the map proxy does not pass on
+WFS_WRITE_REQUESTS = ('transaction', 'lockfeature', 'getfeaturewithlock')
+
 
 def home(request):
     """
     Home page for Tethys Datasets
     """
-    context = {}
+    sink = find_metrics_sink()
+    service_stats = []
+
+    if sink:
+        for stats in sink.snapshot():
+            service_stats.append({'service': stats.service,
+                                  'method': stats.method,
+                                  'calls': stats.calls,
+                                  'coalesced': stats.coalesced,
+                                  'error_rate': stats.error_rate * 100,
+                                  'mean_ms': stats.mean_duration * 1000,
+                                  'p95_ms': stats.quantile(0.95) * 1000,
+                                  'bytes_sent': stats.bytes_sent,
+                                  'bytes_received': stats.bytes_received})
+
+    # Browse and search the local copy of the catalogs, without calling the dataset services
+    query = request.GET.get('q', '')
+    service_name = request.GET.get('service', '')
+
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+
+    catalog = search_catalog(query, service_name or None, limit=CATALOG_PAGE_SIZE,
+                             offset=(page - 1) * CATALOG_PAGE_SIZE)
+
+    context = {'metrics_enabled': sink is not None,
+               'service_stats': service_stats,
+               'query': query,
+               'service_name': service_name,
+               'indexed_services': DatasetService.objects.filter(index_catalog=True).values_list('name', flat=True),
+               'datasets': catalog['results'],
+               'dataset_count': catalog['count'],
+               'page': page,
+               'previous_page': page - 1 if page > 1 else None,
+               'next_page': page + 1 if page * CATALOG_PAGE_SIZE < catalog['count'] else None}
 
     return render(request, 'tethys_datasets/home.html', context)
+
+
+def metrics(request):
+    """
+    Engine call metrics in the Prometheus text exposition format
+    """
+    sink = find_metrics_sink(PrometheusSink)
+
+    if sink is None:
+        raise Http404('No Prometheus metrics sink is configured.')
+
+    return HttpResponse(sink.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _cached_map_response(entry, cache_status):
+    accel_redirect = getattr(settings, 'TETHYS_DATASETS_MAP_CACHE', {}).get('ACCEL_REDIRECT')
+
+    if accel_redirect and entry.relative_path:
+        # nginx sends the file itself
+        entry.file.close()
+        response = HttpResponse(content_type=entry.content_type)
+        response['X-Accel-Redirect'] = accel_redirect.rstrip('/') + '/' + entry.relative_path.replace('\\', '/')
+    else:
+        response = FileResponse(entry.file, content_type=entry.content_type)
+        response['Content-Length'] = entry.size
+
+    response['X-Cache'] = cache_status
+    return response
+
+
+def map_proxy(request, service_name, path):
+    """
+    Pass a WMS, WFS or tile request to the GeoServer of a spatial dataset service, answering from the map cache when
+    possible
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    params = request.GET.dict()
+
+    for name, value in params.items():
+        if name.lower() == 'request' and value.lower() in WFS_WRITE_REQUESTS:
+            return HttpResponseForbidden('WFS transactions are not passed on by the map proxy.')
+
+    service = get_service_registry(SpatialDatasetService).get(service_name)
+
+    if service is None or service.engine != SpatialDatasetService.GEOSERVER:
+        raise Http404('No GeoServer spatial dataset service named "{0}".'.format(service_name))
+
+    # Checked before the cache, so responses of other parts of GeoServer are never stored
+    url = map_service_url(choose_endpoint(service).endpoint, path)
+
+    if url is None:
+        return HttpResponseBadRequest('"{0}" is not a path of the map services of GeoServer.'.format(path))
+
+    cache = get_map_cache()
+
+    if cache is not None:
+        entry = cache.get(service_name, path, params)
+
+        if entry is not None:
+            return _cached_map_response(entry, 'HIT')
+
+    # Imported here so that loading the views does not import requests
+    from .transport import get_session_pool
+
+    try:
+        upstream = get_session_pool().request('get', url, params=params, stream=True, timeout=MAP_PROXY_TIMEOUT)
+    except (IOError, OSError):
+        return HttpResponse('GeoServer did not answer.', status=502, content_type='text/plain')
+
+    content_type = upstream.headers.get('Content-Type', 'application/octet-stream')
+
+    # GeoServer reports errors of OGC requests as service exception documents with status 200
+    if cache is None or upstream.status_code != 200 or 'ogc.se' in content_type:
+        return StreamingHttpResponse(upstream.iter_content(CHUNK_SIZE), status=upstream.status_code,
+                                     content_type=content_type)
+
+    try:
+        entry = cache.set(service_name, path, params, content_type, upstream.iter_content(CHUNK_SIZE))
+    finally:
+        upstream.close()
+
+    return _cached_map_response(entry, 'MISS')
+
+
+@login_required
+def job_status(request, job_id):
+    """
+    Status and progress of a background job as JSON, shown to the user who submitted the job and to staff users. With
+    ?wait=<seconds> (at most MAX_JOB_WAIT), the answer is held back until the job is done or the time has passed.
+    """
+    job = get_job(job_id)
+
+    # Other users can not tell the job from a missing one
+    if job is None or not can_see_job(request.user, job):
+        raise Http404('No job "{0}".'.format(job_id))
+
+    try:
+        wait = min(float(request.GET.get('wait', 0)), MAX_JOB_WAIT)
+    except ValueError:
+        wait = 0
+
+    deadline = time.time() + wait
+
+    while not job.done and time.time() < deadline:
+        time.sleep(JOB_WAIT_INTERVAL)
+        job.refresh_from_db()
+
+    return JsonResponse(describe_job(job))
+
+
+def search(request):
+    """
+    Search several dataset services at once and answer with the merged results as JSON. Parameters: q, service (can
+    be repeated, defaults to all services), timeout (seconds) and limit (datasets per service). With stream=1 the
+    answer is a stream of JSON lines, one per service as it answers, followed by the merged results.
+    """
+    query = request.GET.get('q', '').strip()
+
+    if not query:
+        return JsonResponse({'error': 'The q parameter is required.'}, status=400)
+
+    try:
+        timeout = min(float(request.GET.get('timeout', DEFAULT_TIMEOUT)), MAX_SEARCH_TIMEOUT)
+        limit = max(1, min(int(request.GET.get('limit', 20)), MAX_SEARCH_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'timeout and limit must be numbers.'}, status=400)
+
+    services = request.GET.getlist('service') or None
+
+    # Unknown names would each cost a query and an entry in the registry
+    if services is not None:
+        unknown = sorted(set(services) - set(get_service_registry(DatasetService).names()))
+
+        if unknown:
+            return JsonResponse({'error': 'Unknown dataset services: {0}.'.format(', '.join(unknown))}, status=400)
+
+    if request.GET.get('stream') not in ('1', 'true'):
+        return JsonResponse(federated_search(query, services, timeout=timeout, limit=limit))
+
+    def lines():
+        service_results = []
+
+        for service_result in iter_federated_search(query, services, timeout=timeout, limit=limit):
+            service_results.append(service_result)
+            yield json.dumps(service_result.as_dict()) + '\n'
+
+        yield json.dumps({'results': merge_results(service_results)}) + '\n'
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')